@@ -0,0 +1,320 @@
+import os
+import sys
+import json
+import threading
+from collections import deque
+import numpy as np
+from prediction_store import PREDICTION_STORE_DIR, PREDICTION_REORDER_MICROS, get_prediction_store, list_tickers, match_actuals, from_micros
+
+METRICS_DIR = 'data/metrics'
+METRICS_WINDOW = int(os.getenv('PRISMTRADE_METRICS_WINDOW', '100'))
+METRICS_DAY_MICROS = 24 * 60 * 60 * 1000000
+LARGEST_ERRORS = 5
+VOLATILE_CHANGE_PCT = 0.8
+STAT_FIELDS = ['count', 'error', 'error_sq', 'abs_error', 'error_pct', 'direction_hits', 'direction_matches',
+               'over', 'under', 'volatile', 'prediction_diff', 'actual_diff', 'x', 'y', 'xx', 'yy', 'xy']
+STAT = {name: i for i, name in enumerate(STAT_FIELDS)}
+
+def pair_stats(current_price, predicted, actual):
+    """Вектор вкладов одной пары прогноз/факт в суммы STAT_FIELDS."""
+    error = predicted - actual
+    error_pct = abs(error / actual) * 100
+    prediction_diff = ((predicted - current_price) / current_price) * 100
+    actual_diff = ((actual - current_price) / current_price) * 100
+    x = abs(prediction_diff)
+    return np.array([
+        1.0, error, error * error, abs(error), error_pct,
+        (predicted > current_price and actual > current_price) or (predicted < current_price and actual < current_price),
+        (predicted > current_price) == (actual > current_price),
+        prediction_diff > actual_diff, prediction_diff < actual_diff, abs(actual_diff) > VOLATILE_CHANGE_PCT,
+        prediction_diff, actual_diff, x, error_pct, x * x, error_pct * error_pct, x * error_pct
+    ], dtype=np.float64)
+
+def summarize(sums):
+    count = sums[STAT['count']]
+    if count == 0:
+        return {'samples': 0}
+    return {
+        'rmse': round(float(np.sqrt(sums[STAT['error_sq']] / count)), 3),
+        'mae': round(float(sums[STAT['abs_error']] / count), 3),
+        'mape': round(float(sums[STAT['error_pct']] / count), 2),
+        'bias': round(float(sums[STAT['error']] / count), 3),
+        'direction_accuracy': round(float(sums[STAT['direction_hits']] / count * 100), 2),
+        'samples': int(count)
+    }
+
+def correlation(sums):
+    count = sums[STAT['count']]
+    x, y = sums[STAT['x']], sums[STAT['y']]
+    denominator = (count * sums[STAT['xx']] - x * x) * (count * sums[STAT['yy']] - y * y)
+    if denominator <= 0:
+        return float('nan')
+    return float((count * sums[STAT['xy']] - x * y) / np.sqrt(denominator))
+
+class IntervalMetrics:
+    """Накопленные суммы по одному горизонту: за все время, за последние METRICS_WINDOW пар и за сутки."""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self.total = np.zeros(len(STAT_FIELDS))
+        self.last_n = deque()
+        self.last_n_sums = np.zeros(len(STAT_FIELDS))
+        self.last_day = deque()
+        self.last_day_sums = np.zeros(len(STAT_FIELDS))
+        self.largest_errors = []
+        self.resolved_until = None
+        self.sequence = 0
+
+    def add(self, time, stats):
+        self.total += stats
+        self.last_n.append((time, stats))
+        self.last_n_sums += stats
+        if len(self.last_n) > self.window:
+            self.last_n_sums -= self.last_n.popleft()[1]
+        self.last_day.append((time, stats))
+        self.last_day_sums += stats
+        while self.last_day[0][0] <= time - METRICS_DAY_MICROS:
+            self.last_day_sums -= self.last_day.popleft()[1]
+        # При равной ошибке раньше идет более ранний прогноз, как при устойчивой сортировке
+        entry = (-stats[STAT['error_pct']], self.sequence, time, stats)
+        self.sequence += 1
+        if len(self.largest_errors) < LARGEST_ERRORS or entry[:2] < self.largest_errors[-1][:2]:
+            self.largest_errors.append(entry)
+            self.largest_errors.sort(key=lambda item: item[:2])
+            del self.largest_errors[LARGEST_ERRORS:]
+
+    def state(self):
+        return {
+            'total': self.total.tolist(),
+            'last_n': [[time, stats.tolist()] for time, stats in self.last_n],
+            'last_day': [[time, stats.tolist()] for time, stats in self.last_day],
+            'largest_errors': [[time, stats.tolist()] for _, _, time, stats in self.largest_errors],
+            'resolved_until': self.resolved_until,
+            'sequence': self.sequence
+        }
+
+    @classmethod
+    def from_state(cls, state, window=METRICS_WINDOW):
+        metrics = cls(window)
+        metrics.total = np.array(state['total'])
+        metrics.last_n = deque((time, np.array(stats)) for time, stats in state['last_n'][-window:])
+        metrics.last_day = deque((time, np.array(stats)) for time, stats in state['last_day'])
+        # Суммы окон пересчитываем заново, чтобы не копить ошибку округления между перезапусками
+        metrics.last_n_sums = sum((stats for _, stats in metrics.last_n), np.zeros(len(STAT_FIELDS)))
+        metrics.last_day_sums = sum((stats for _, stats in metrics.last_day), np.zeros(len(STAT_FIELDS)))
+        metrics.largest_errors = [(-stats[STAT['error_pct']], i, time, np.array(stats)) for i, (time, stats) in enumerate(state['largest_errors'])]
+        metrics.resolved_until = state['resolved_until']
+        metrics.sequence = state['sequence']
+        return metrics
+
+class MetricsAccumulator:
+    """Метрики точности прогнозов одного тикера, обновляемые по мере их разрешения.
+
+    Прогноз на interval минут разрешается, когда в истории появилась запись не
+    раньше его целевого времени: после этого ближайшая к цели запись уже не
+    изменится. update() читает из PredictionStore только хвост после
+    последнего разрешенного прогноза, поэтому стоимость пропорциональна числу
+    новых прогнозов, а report() не зависит от длины истории. Состояние
+    хранится в METRICS_DIR/<тикер>.json; rebuild() пересчитывает его по всей
+    истории. Если файл перезаписал другой процесс (например, rebuild из
+    командной строки), update() перечитывает его.
+    """
+
+    def __init__(self, ticker, prediction_dir=PREDICTION_STORE_DIR, metrics_dir=METRICS_DIR):
+        self.ticker = ticker
+        self.store = get_prediction_store(ticker, prediction_dir)
+        self.path = os.path.join(metrics_dir, f'{ticker}.json')
+        self.lock = threading.Lock()
+        self.intervals = {}
+        self.records = 0
+        self.records_until = None
+        self.loaded = False
+        self.mtime = None
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _reset(self):
+        self.intervals = {}
+        self.records = 0
+        self.records_until = None
+
+    def _load(self):
+        self.loaded = True
+        self._reset()
+        self.mtime = self._file_mtime()
+        if self.mtime is None:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Не удалось прочитать метрики {self.ticker}, пересчитываем: {e}")
+            return
+        self.records = state['records']
+        self.records_until = state['records_until']
+        self.intervals = {interval: IntervalMetrics.from_state(data) for interval, data in state['intervals'].items()}
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        state = {'records': self.records, 'records_until': self.records_until, 'intervals': {interval: metrics.state() for interval, metrics in self.intervals.items()}}
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(state, f)
+        os.replace(temporary, self.path)
+        self.mtime = self._file_mtime()
+
+    def _update(self):
+        watermarks = [metrics.resolved_until for metrics in self.intervals.values()]
+        since = min(watermarks) if watermarks and None not in watermarks else None
+        records, horizons = self.store.read(since)
+        if len(records) == 0:
+            return False
+        times = records['time']
+        # Прогноз окончательный, когда после его цели уже есть запись (с запасом на запоздавшие пачки)
+        latest = int(times[-1]) - PREDICTION_REORDER_MICROS
+        start = 0 if self.records_until is None else int(np.searchsorted(times, self.records_until, side='left'))
+        new_records = len(times) - start
+        self.records += new_records
+        self.records_until = int(times[-1]) + 1
+        changed = new_records > 0
+        for interval in np.unique(horizons['interval']).tolist():
+            key = str(interval)
+            metrics = self.intervals.setdefault(key, IntervalMetrics())
+            offset = interval * 60 * 1000000
+            start = 0 if metrics.resolved_until is None else int(np.searchsorted(times, metrics.resolved_until, side='left'))
+            end = int(np.searchsorted(times + offset, latest, side='right'))
+            if end <= start:
+                continue
+            rows = horizons[horizons['interval'] == interval]
+            matched = match_actuals(times, offset)
+            positions = np.searchsorted(rows['time'], times[start:end])
+            positions = np.minimum(positions, max(len(rows) - 1, 0))
+            for i, position in zip(range(start, end), positions.tolist()):
+                j = matched[i]
+                if j < 0 or len(rows) == 0 or rows['time'][position] != times[i]:
+                    continue
+                stats = pair_stats(float(records['current_price'][i]), float(rows['price'][position]), float(records['current_price'][j]))
+                metrics.add(int(times[i]), stats)
+            metrics.resolved_until = int(times[end]) if end < len(times) else int(times[-1]) + 1
+            changed = True
+        return changed
+
+    def update(self):
+        with self.lock:
+            if not self.loaded or self._file_mtime() not in (None, self.mtime):
+                self._load()
+            if self._update():
+                self._save()
+
+    def rebuild(self):
+        with self.lock:
+            self.loaded = True
+            self._reset()
+            self._update()
+            self._save()
+
+    def report(self):
+        """Отчет в формате evaluate_prediction_quality; метрики по окнам - в 'metrics'. None, если прогнозов меньше 5."""
+        with self.lock:
+            if self.records < 5:
+                return None
+            results = {
+                'market_factors': {},
+                'error_patterns': {},
+                'improvement_factors': [],
+                'model_adjustments': {},
+                'meta_learning': {},
+                'metrics': {}
+            }
+            intervals = sorted(self.intervals, key=int)
+            for interval in intervals:
+                metrics = self.intervals[interval]
+                total = metrics.total
+                count = total[STAT['count']]
+                if count == 0:
+                    continue
+                results['metrics'][interval] = dict(summarize(total), last_n=summarize(metrics.last_n_sums), last_day=summarize(metrics.last_day_sums))
+                if count < 3:
+                    continue
+                if total[STAT['over']] > total[STAT['under']]:
+                    bias_type, bias_ratio = "переоценка", total[STAT['over']] / count
+                else:
+                    bias_type, bias_ratio = "недооценка", total[STAT['under']] / count
+                results['error_patterns'][interval] = {
+                    'bias_type': bias_type,
+                    'bias_ratio': round(float(bias_ratio) * 100, 2),
+                    'largest_errors': [{
+                        'timestamp': from_micros(time).isoformat(),
+                        'error_pct': round(float(stats[STAT['error_pct']]), 2),
+                        'predicted_change': round(float(stats[STAT['prediction_diff']]), 2),
+                        'actual_change': round(float(stats[STAT['actual_diff']]), 2)
+                    } for _, _, time, stats in metrics.largest_errors]
+                }
+                if count > 3:
+                    value = correlation(total)
+                    results['market_factors'][interval] = {
+                        'prediction_error_correlation': round(value, 3),
+                        'interpretation': ("Чем больше прогнозируемое изменение, тем больше ошибка" if value > 0.5 else "Величина прогноза слабо влияет на точность" if abs(value) < 0.3 else "Меньшие прогнозы имеют большую ошибку")
+                    }
+                    if value > 0.5:
+                        results['model_adjustments'][interval] = {
+                            'reduce_magnitude': True,
+                            'adjustment_factor': round(0.85 - 0.1 * min(value, 0.8), 2),
+                            'explanation': "Рекомендуется уменьшить амплитуду прогнозов для повышения точности"
+                        }
+                    elif value < -0.3:
+                        results['model_adjustments'][interval] = {
+                            'increase_magnitude': True,
+                            'adjustment_factor': round(1.15 + 0.1 * min(abs(value), 0.8), 2),
+                            'explanation': "Рекомендуется увеличить амплитуду прогнозов для повышения точности"
+                        }
+                if total[STAT['volatile']] > 0:
+                    volatile_error_ratio = float(total[STAT['volatile']] / count)
+                    results['improvement_factors'].append({
+                        'factor': 'volatility',
+                        'impact': round(volatile_error_ratio * 100, 2),
+                        'recommendation': ("Система должна корректировать прогнозы в моменты повышенной волатильности" if volatile_error_ratio > 0.3 else "Влияние волатильности на точность прогнозов несущественно")
+                    })
+            if intervals and all(interval in results['error_patterns'] for interval in intervals):
+                interval_biases = [results['error_patterns'][interval]['bias_type'] == "переоценка" for interval in intervals]
+                if all(interval_biases) or not any(interval_biases):
+                    bias_direction = "переоценка" if interval_biases[0] else "недооценка"
+                    results['meta_learning']['consistent_bias'] = {
+                        'type': bias_direction,
+                        'recommendation': f"Система систематически {bias_direction}ет изменение цены",
+                        'global_adjustment_factor': 0.9 if bias_direction == "переоценка" else 1.1
+                    }
+                interval_accuracies = {interval: self.intervals[interval].total[STAT['direction_matches']] / self.intervals[interval].total[STAT['count']] for interval in intervals}
+                best_interval = max(interval_accuracies.items(), key=lambda x: x[1])
+                results['meta_learning']['interval_performance'] = {
+                    'best_interval': best_interval[0],
+                    'accuracy': round(float(best_interval[1]) * 100, 2),
+                    'recommendation': f"Интервал {best_interval[0]} минут показывает наилучшую точность направления"
+                }
+            return results
+
+_accumulators = {}
+_accumulators_lock = threading.Lock()
+
+def get_metrics_accumulator(ticker, prediction_dir=PREDICTION_STORE_DIR, metrics_dir=METRICS_DIR):
+    key = (prediction_dir, metrics_dir, ticker)
+    with _accumulators_lock:
+        if key not in _accumulators:
+            _accumulators[key] = MetricsAccumulator(ticker, prediction_dir, metrics_dir)
+        return _accumulators[key]
+
+if __name__ == '__main__':
+    # python accuracy_metrics.py rebuild [TICKER ...]
+    if len(sys.argv) < 2 or sys.argv[1] != 'rebuild':
+        print("Использование: python accuracy_metrics.py rebuild [TICKER ...]")
+        sys.exit(1)
+    for ticker in sys.argv[2:] or list_tickers():
+        accumulator = get_metrics_accumulator(ticker)
+        accumulator.rebuild()
+        print(f"{ticker}: пересчитано по {accumulator.records} прогнозам")
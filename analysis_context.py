@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from types import MappingProxyType
+import pandas as pd
+
+ANALYSIS_CONTEXT_CACHE_SIZE = 200
+
+def freeze(mapping):
+    return None if mapping is None else MappingProxyType(dict(mapping))
+
+@dataclass(frozen=True)
+class AnalysisContext:
+    """Неизменяемый результат анализа одного набора свечей.
+
+    Хранит ряды, рассчитанные индикаторы, состояние рынка, прогнозы и
+    рекомендацию. Создается один раз на (FIGI, последняя свеча) и передается
+    во все этапы вместо атрибутов last_* предсказателя, поэтому один
+    StockPredictor можно безопасно использовать из нескольких запросов.
+    Кадр indicators общий для всех потребителей и не должен изменяться.
+    """
+
+    ticker: str
+    figi: str
+    times: tuple
+    prices: tuple
+    volumes: tuple
+    indicators: pd.DataFrame
+    market_state: MappingProxyType = None
+    predictions: MappingProxyType = None
+    ma5: float = None
+    ma20: float = None
+    volatility: float = None
+    price_change: float = 0.0
+    momentum: float = 0.0
+    recommendation: str = None
+    reasons: tuple = field(default_factory=tuple)
+    entry_exit_prices: MappingProxyType = None
+
+    @property
+    def key(self):
+        return context_key(self.figi, self.times, self.prices)
+
+    @property
+    def current_price(self):
+        return self.prices[-1]
+
+    @property
+    def last_rsi(self):
+        return self.indicators['rsi'].iloc[-1]
+
+    @property
+    def last_macd(self):
+        return self.indicators['macd'].iloc[-1]
+
+    @property
+    def last_signal(self):
+        return self.indicators['signal'].iloc[-1]
+
+def context_key(figi, times, prices):
+    # Последняя свеча может еще формироваться, поэтому в ключ входит и ее цена
+    return figi, int(times[-1].timestamp()), float(prices[-1]), len(prices)
+
+_contexts = OrderedDict()
+_contexts_lock = threading.Lock()
+
+def get_analysis_context(key):
+    with _contexts_lock:
+        context = _contexts.get(key)
+        if context is not None:
+            _contexts.move_to_end(key)
+        return context
+
+def put_analysis_context(context):
+    with _contexts_lock:
+        _contexts[context.key] = context
+        _contexts.move_to_end(context.key)
+        while len(_contexts) > ANALYSIS_CONTEXT_CACHE_SIZE:
+            _contexts.popitem(last=False)
+    return context
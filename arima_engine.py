@@ -0,0 +1,136 @@
+import os
+import threading
+import numpy as np
+from prediction_store import to_micros
+
+ARIMA_PARAMS_STATIONARY = (2, 0, 2)
+ARIMA_PARAMS_NONSTATIONARY = (1, 1, 1)
+ARIMA_FALLBACK_PARAMS = (1, 1, 0)
+ARIMA_REFIT_CANDLES = int(os.getenv('PRISMTRADE_ARIMA_REFIT', '60'))
+ARIMA_DRIFT_THRESHOLD = 3.0
+ARIMA_DRIFT_CANDLES = 5
+ARIMA_INFO_FIELDS = ('result', 'order', 'is_stationary', 'adf_pvalue', 'residual_scale', 'candles_since_refit', 'status')
+
+def fit_arima(prices):
+    """Тест Дики-Фуллера, выбор порядка и оценка параметров; при ошибке - ARIMA_FALLBACK_PARAMS."""
+    from statsmodels.tsa.arima.model import ARIMA
+    from statsmodels.tsa.stattools import adfuller
+    adf_pvalue = adfuller(prices)[1]
+    is_stationary = adf_pvalue <= 0.05
+    order = ARIMA_PARAMS_STATIONARY if is_stationary else ARIMA_PARAMS_NONSTATIONARY
+    try:
+        result = ARIMA(prices, order=order).fit()
+    except Exception:
+        order = ARIMA_FALLBACK_PARAMS
+        result = ARIMA(prices, order=order).fit()
+    # Первые d остатков - начальные значения без разностей, в оценку масштаба не входят
+    residual_scale = float(np.mean(np.abs(result.resid[order[1]:])))
+    return {
+        'result': result,
+        'order': order,
+        'is_stationary': bool(is_stationary),
+        'adf_pvalue': float(adf_pvalue),
+        'residual_scale': residual_scale,
+        'candles_since_refit': 0,
+        'forecast': None
+    }
+
+class ARIMACache:
+    """Оцененные ARIMA по тикерам между запросами.
+
+    Новые свечи добавляются в модель через results.append(refit=False):
+    параметры не переоцениваются, фильтр Калмана только продолжает ряд.
+    Тест стационарности, порядок и параметры пересчитываются раз в
+    ARIMA_REFIT_CANDLES свечей, при разрыве в истории и когда средняя
+    ошибка прогноза на шаг по последним ARIMA_DRIFT_CANDLES свечам больше
+    ARIMA_DRIFT_THRESHOLD средних остатков обучения. Формирующаяся
+    последняя свеча в модель не входит (см. forecast). Прогноз на самый
+    дальний горизонт строится один раз на свечу и ее закрытие.
+    """
+
+    def __init__(self, refit_candles=ARIMA_REFIT_CANDLES):
+        self.refit_candles = refit_candles
+        self.entries = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'appends': 0, 'refits': 0, 'drift_refits': 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def _entry_lock(self, ticker):
+        with self.lock:
+            return self.locks.setdefault(ticker, threading.Lock())
+
+    def _append(self, entry, new_prices):
+        """Добавляет свечи без переоценки; None, если ошибки на новых свечах говорят о дрейфе."""
+        result = entry['result'].append(new_prices, refit=False)
+        # Ошибки на шаг по последним свечам после обучения: одна случайная свеча дрейфом не считается
+        recent = min(ARIMA_DRIFT_CANDLES, entry['candles_since_refit'] + len(new_prices))
+        error = float(np.mean(np.abs(result.resid[-recent:])))
+        if error > ARIMA_DRIFT_THRESHOLD * max(entry['residual_scale'], 1e-12):
+            return None
+        return result
+
+    def forecast(self, ticker, prices, times, steps):
+        """Прогноз на steps шагов и копия сведений о модели (ARIMA_INFO_FIELDS).
+
+        times - время свечей prices; без них модель оценивается заново и не кэшируется.
+        Последняя свеча может еще формироваться: в кэшированную модель входят
+        только завершенные свечи, а текущая добавляется к копии модели перед
+        прогнозом, так что прогноз учитывает ее последнее закрытие.
+        Возвращаются копии: запись кэша меняют следующие запросы по тикеру.
+        """
+        prices = np.asarray(prices, dtype=np.float64)
+        if times is None:
+            entry = fit_arima(prices)
+            entry['status'] = 'refit'
+            return np.asarray(entry['result'].forecast(steps=steps)), {key: entry[key] for key in ARIMA_INFO_FIELDS}
+        micros = np.array([to_micros(t) for t in times], dtype=np.int64)
+        completed = prices[:-1]
+        with self._entry_lock(ticker):
+            entry = self.entries.get(ticker)
+            status = 'refit'
+            if entry is not None and micros[0] <= entry['last_time'] <= micros[-2]:
+                start = int(np.searchsorted(micros[:-1], entry['last_time'], side='right'))
+                new_candles = len(completed) - start
+                if new_candles == 0:
+                    status = 'hit'
+                elif entry['candles_since_refit'] + new_candles < self.refit_candles:
+                    result = self._append(entry, completed[start:])
+                    if result is None:
+                        status = 'drift'
+                    else:
+                        status = 'append'
+                        entry.update(result=result, candles_since_refit=entry['candles_since_refit'] + new_candles, forecast=None)
+            if status in ('refit', 'drift'):
+                self._count('drift_refits' if status == 'drift' else 'refits')
+                entry = fit_arima(completed)
+            else:
+                self._count('hits' if status == 'hit' else 'appends')
+            entry['last_time'] = int(micros[-2])
+            entry['status'] = status
+            self.entries[ticker] = entry
+            # Прогноз пересчитывается, только когда поменялась текущая свеча или ее закрытие
+            key = (int(micros[-1]), float(prices[-1]))
+            if entry['forecast'] is None or entry.get('forecast_key') != key or len(entry['forecast']) < steps:
+                current = entry['result'].append(prices[-1:], refit=False)
+                entry.update(forecast=np.asarray(current.forecast(steps=steps)), forecast_key=key, current_result=current)
+            info = {key: entry[key] for key in ARIMA_INFO_FIELDS}
+            info['result'] = entry['current_result']
+            return entry['forecast'][:steps].copy(), info
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, tickers=len(self.entries))
+
+_arima_cache = None
+_arima_cache_lock = threading.Lock()
+
+def get_arima_cache():
+    global _arima_cache
+    with _arima_cache_lock:
+        if _arima_cache is None:
+            _arima_cache = ARIMACache()
+        return _arima_cache
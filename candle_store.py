@@ -0,0 +1,111 @@
+import os
+import threading
+import numpy as np
+from file_lock import file_lock
+
+CANDLE_STORE_DIR = 'data/candles'
+CANDLE_COLUMNS = {
+    'time': np.int64,
+    'close': np.float64,
+    'volume': np.int64
+}
+
+class CandleStore:
+    """Колоночное append-only хранилище 5-минутных свечей одного FIGI.
+
+    Каждая колонка лежит в отдельном бинарном файле и читается через np.memmap.
+    Время хранится в секундах UTC. Последняя (ещё формирующаяся) свеча
+    перезаписывается на месте, всё остальное только дописывается в конец.
+    """
+
+    def __init__(self, figi, base_dir=CANDLE_STORE_DIR):
+        self.figi = figi
+        self.path = os.path.join(base_dir, figi)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.lock = threading.Lock()
+
+    def _column_path(self, name):
+        return os.path.join(self.path, f'{name}.bin')
+
+    def _column_length(self, name):
+        path = self._column_path(name)
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // np.dtype(CANDLE_COLUMNS[name]).itemsize
+
+    def __len__(self):
+        # Длина хранилища - минимальная длина колонок: недописанный хвост после сбоя игнорируется
+        return min(self._column_length(name) for name in CANDLE_COLUMNS)
+
+    def _map(self, name, length):
+        if length == 0:
+            return np.empty(0, dtype=CANDLE_COLUMNS[name])
+        return np.memmap(self._column_path(name), dtype=CANDLE_COLUMNS[name], mode='r', shape=(length,))
+
+    def last_time(self):
+        length = len(self)
+        if length == 0:
+            return None
+        return int(self._map('time', length)[-1])
+
+    def _repair(self, length):
+        for name in CANDLE_COLUMNS:
+            if self._column_length(name) > length:
+                with open(self._column_path(name), 'r+b') as f:
+                    f.truncate(length * np.dtype(CANDLE_COLUMNS[name]).itemsize)
+
+    def append(self, times, closes, volumes):
+        """Добавляет свечи, отсортированные по времени.
+
+        Свеча с тем же временем, что и последняя сохраненная, заменяет ее,
+        более старые свечи отбрасываются. Возвращает число записанных свечей.
+        """
+        columns = {
+            'time': np.asarray(times, dtype=CANDLE_COLUMNS['time']),
+            'close': np.asarray(closes, dtype=CANDLE_COLUMNS['close']),
+            'volume': np.asarray(volumes, dtype=CANDLE_COLUMNS['volume'])
+        }
+        with self.lock, file_lock(self.path):
+            length = len(self)
+            self._repair(length)
+            last_time = int(self._map('time', length)[-1]) if length else None
+            written = 0
+            if last_time is not None:
+                same = columns['time'] == last_time
+                if same.any():
+                    idx = np.flatnonzero(same)[-1]
+                    for name, values in columns.items():
+                        itemsize = np.dtype(CANDLE_COLUMNS[name]).itemsize
+                        with open(self._column_path(name), 'r+b') as f:
+                            f.seek((length - 1) * itemsize)
+                            f.write(values[idx:idx + 1].tobytes())
+                    written += 1
+                newer = columns['time'] > last_time
+                columns = {name: values[newer] for name, values in columns.items()}
+            if len(columns['time']):
+                for name, values in columns.items():
+                    with open(self._column_path(name), 'ab') as f:
+                        f.write(values.tobytes())
+                written += len(columns['time'])
+            return written
+
+    def read(self, since=None):
+        """Возвращает (time, close, volume) начиная с времени since (секунды UTC)."""
+        with self.lock:
+            length = len(self)
+            times = self._map('time', length)
+            start = 0 if since is None else int(np.searchsorted(times, since, side='left'))
+            return (np.array(times[start:]),
+                    np.array(self._map('close', length)[start:]),
+                    np.array(self._map('volume', length)[start:]))
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_candle_store(figi, base_dir=CANDLE_STORE_DIR):
+    key = (base_dir, figi)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = CandleStore(figi, base_dir)
+        return _stores[key]
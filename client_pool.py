@@ -0,0 +1,179 @@
+import os
+import time
+import queue
+import threading
+from contextlib import contextmanager
+from tinkoff.invest import Client, RequestError
+from grpc import StatusCode
+
+CLIENT_POOL_SIZE = int(os.getenv('TINKOFF_POOL_SIZE', '4'))
+CLIENT_POOL_BACKEND = os.getenv('TINKOFF_BACKEND', 'grpc')
+CLIENT_POOL_HEALTH_CHECK_SECONDS = 60
+CLIENT_POOL_ACQUIRE_TIMEOUT = 30
+RECONNECT_STATUS_CODES = (StatusCode.UNAVAILABLE, StatusCode.INTERNAL, StatusCode.UNKNOWN, StatusCode.DEADLINE_EXCEEDED)
+
+class APINotConfigured(ValueError):
+    """Нет токена API, а тестовый бэкенд не выбран."""
+
+class PooledClient:
+    def __init__(self, factory):
+        self.factory = factory
+        self.client = None
+        self.services = None
+        self.last_checked = 0
+        self.connect()
+
+    def connect(self):
+        self.client = self.factory()
+        self.services = self.client.__enter__()
+        self.last_checked = time.monotonic()
+
+    def close(self):
+        if self.client is None:
+            return
+        try:
+            self.client.__exit__(None, None, None)
+        except Exception as e:
+            print(f"Ошибка при закрытии соединения с API: {e}")
+        self.client = None
+        self.services = None
+
+    def reconnect(self):
+        self.close()
+        self.connect()
+
+    def is_healthy(self):
+        try:
+            self.services.users.get_accounts()
+            return True
+        except Exception as e:
+            print(f"Соединение с API не прошло проверку: {e}")
+            return False
+
+class ClientPool:
+    """Пул долгоживущих клиентов API, которые выдаются запросам во временное пользование.
+
+    Соединения создаются лениво до size штук, проверяются перед выдачей
+    не чаще раза в health_check_seconds и переподключаются после сетевых ошибок.
+    """
+
+    def __init__(self, factory, size=CLIENT_POOL_SIZE, health_check_seconds=CLIENT_POOL_HEALTH_CHECK_SECONDS):
+        self.factory = factory
+        self.size = max(1, size)
+        self.health_check_seconds = health_check_seconds
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self.reconnects = 0
+
+    def _create(self):
+        with self._lock:
+            if self._created >= self.size:
+                return None
+            self._created += 1
+        try:
+            return PooledClient(self.factory)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _discard(self, pooled):
+        pooled.close()
+        with self._lock:
+            self._created -= 1
+
+    def _acquire(self, timeout):
+        if self._closed:
+            raise RuntimeError("Пул клиентов API закрыт")
+        try:
+            pooled = self._idle.get_nowait()
+        except queue.Empty:
+            pooled = self._create()
+            if pooled is None:
+                try:
+                    pooled = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError("Нет свободных соединений с API")
+        if time.monotonic() - pooled.last_checked > self.health_check_seconds:
+            if pooled.is_healthy():
+                pooled.last_checked = time.monotonic()
+            else:
+                self._reconnect(pooled)
+        return pooled
+
+    def _reconnect(self, pooled):
+        try:
+            pooled.reconnect()
+            self.reconnects += 1
+        except Exception:
+            self._discard(pooled)
+            raise
+
+    def _release(self, pooled, broken):
+        if self._closed:
+            self._discard(pooled)
+            return
+        if broken:
+            try:
+                self._reconnect(pooled)
+            except Exception as e:
+                print(f"Не удалось переподключиться к API: {e}")
+                return
+        self._idle.put(pooled)
+
+    @contextmanager
+    def client(self, timeout=CLIENT_POOL_ACQUIRE_TIMEOUT):
+        pooled = self._acquire(timeout)
+        broken = False
+        try:
+            yield pooled.services
+        except RequestError as e:
+            broken = e.code in RECONNECT_STATUS_CODES
+            raise
+        finally:
+            self._release(pooled, broken)
+
+    def stats(self):
+        return {'size': self.size, 'created': self._created, 'idle': self._idle.qsize(), 'reconnects': self.reconnects}
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(pooled)
+
+def create_client_factory(backend=CLIENT_POOL_BACKEND, token=None):
+    if backend == 'fake':
+        from fake_backend import FakeClient
+        return FakeClient
+    token = token or os.getenv('TINKOFF_TOKEN')
+    if not token:
+        raise APINotConfigured("TINKOFF_TOKEN не настроен. Пожалуйста, добавьте токен в Secrets (Tools -> Secrets)")
+    return lambda: Client(token)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def init_client_pool(backend=CLIENT_POOL_BACKEND, size=CLIENT_POOL_SIZE, token=None):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ClientPool(create_client_factory(backend, token), size=size)
+        return _pool
+
+def get_client_pool():
+    if _pool is None:
+        return init_client_pool()
+    return _pool
+
+def close_client_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -0,0 +1,175 @@
+import os
+import sys
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.model_selection import TimeSeriesSplit
+from sklearn.preprocessing import StandardScaler, PolynomialFeatures
+from sklearn.linear_model import LinearRegression
+from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.metrics import mean_absolute_error
+
+CV_JOBS = int(os.getenv('PRISMTRADE_CV_JOBS', str(min(4, os.cpu_count() or 1))))
+HYPERPARAM_SEARCH = os.getenv('PRISMTRADE_HYPERPARAM_SEARCH', 'grid')
+HYPERPARAM_GRID = {
+    'n_estimators': [30, 50, 100],
+    'learning_rate': [0.05, 0.1, 0.2],
+    'max_depth': [2, 3, 4]
+}
+HALVING_FACTOR = 3
+CV_CACHE_ENTRIES = 64
+CV_MODELS = ['linear', 'polynomial', 'gradient_boosting']
+
+class FoldSet:
+    """Разбиение TimeSeriesSplit с заранее масштабированными матрицами.
+
+    StandardScaler обучается один раз на обучающей части каждого фолда,
+    и все модели и параметры используют одни и те же матрицы.
+    """
+
+    def __init__(self, X, y, n_splits):
+        self.folds = []
+        self.poly_folds = None
+        for train_idx, test_idx in TimeSeriesSplit(n_splits=n_splits).split(X):
+            scaler = StandardScaler()
+            self.folds.append((scaler.fit_transform(X[train_idx]), scaler.transform(X[test_idx]), y[train_idx], y[test_idx]))
+
+    def __len__(self):
+        return len(self.folds)
+
+    def polynomial(self):
+        """Фолды с квадратичным расширением признаков, считается один раз на все модели."""
+        if self.poly_folds is None:
+            self.poly_folds = []
+            for X_train, X_test, y_train, y_test in self.folds:
+                poly = PolynomialFeatures(degree=2).fit(X_train)
+                self.poly_folds.append((poly.transform(X_train), poly.transform(X_test), y_train, y_test))
+        return self.poly_folds
+
+_results = OrderedDict()
+_results_lock = threading.Lock()
+
+def data_key(*arrays):
+    digest = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(str((array.shape, array.dtype.str)).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+def cached(key, compute):
+    """LRU-кэш результатов по ключу данных: повторный расчет на тех же матрицах не нужен."""
+    with _results_lock:
+        if key in _results:
+            _results.move_to_end(key)
+            return _results[key]
+    result = compute()
+    with _results_lock:
+        _results[key] = result
+        while len(_results) > CV_CACHE_ENTRIES:
+            _results.popitem(last=False)
+    return result
+
+def rmse(y_true, y_pred):
+    return float(np.sqrt(np.mean((y_true - y_pred) ** 2)))
+
+def staged_scores(fold, learning_rate, max_depth, n_estimators_options):
+    """RMSE для всех n_estimators из одного обучения: staged_predict дает прогноз после каждого дерева."""
+    X_train, X_test, y_train, y_test = fold
+    model = GradientBoostingRegressor(n_estimators=max(n_estimators_options), learning_rate=learning_rate, max_depth=max_depth, random_state=42)
+    model.fit(X_train, y_train)
+    wanted = set(n_estimators_options)
+    scores = {}
+    for stage, y_pred in enumerate(model.staged_predict(X_test), start=1):
+        if stage in wanted:
+            scores[stage] = rmse(y_test, y_pred)
+    return scores
+
+def fold_errors(model_name, fold):
+    X_train, X_test, y_train, y_test = fold
+    if model_name == 'gradient_boosting':
+        model = GradientBoostingRegressor(n_estimators=50, learning_rate=0.1, max_depth=3, random_state=42)
+    else:
+        model = LinearRegression()
+    y_pred = model.fit(X_train, y_train).predict(X_test)
+    return rmse(y_test, y_pred), mean_absolute_error(y_test, y_pred)
+
+def cross_validate_models(X, y, n_splits=5, n_jobs=CV_JOBS):
+    """RMSE и MAE моделей perform_cross_validation по фолдам TimeSeriesSplit.
+
+    Фолды, скейлеры и полиномиальные признаки считаются один раз, задачи
+    (модель, фолд) выполняются параллельно в n_jobs потоках.
+    """
+    folds = FoldSet(X, y, n_splits)
+    tasks = []
+    for model_name in CV_MODELS:
+        model_folds = folds.polynomial() if model_name == 'polynomial' else folds.folds
+        tasks.extend((model_name, fold) for fold in model_folds)
+    errors = Parallel(n_jobs=n_jobs, prefer='threads')(delayed(fold_errors)(model_name, fold) for model_name, fold in tasks)
+    cv_results = {}
+    for (model_name, _), (rmse_score, mae_score) in zip(tasks, errors):
+        results = cv_results.setdefault(model_name, {'rmse_scores': [], 'mae_scores': []})
+        results['rmse_scores'].append(rmse_score)
+        results['mae_scores'].append(mae_score)
+    for results in cv_results.values():
+        results['avg_rmse'] = np.mean(results['rmse_scores'])
+        results['avg_mae'] = np.mean(results['mae_scores'])
+    return cv_results
+
+def search_gradient_boosting(X, y, grid=HYPERPARAM_GRID, n_splits=3, n_jobs=CV_JOBS, method=HYPERPARAM_SEARCH):
+    """Перебор параметров GradientBoostingRegressor по фолдам TimeSeriesSplit.
+
+    Одно обучение с максимальным n_estimators на каждую пару (learning_rate,
+    max_depth) и фолд; обучения распределяются по n_jobs потокам. Результаты
+    в порядке полного перебора, лучший - первый с минимальной средней RMSE,
+    как у последовательного цикла. method='halving' - последовательное
+    деление: кандидаты проверяются на фолдах по очереди, после каждого фолда
+    остается лучшая треть по средней RMSE.
+    """
+    folds = FoldSet(X, y, n_splits)
+    pairs = [(learning_rate, max_depth) for learning_rate in grid['learning_rate'] for max_depth in grid['max_depth']]
+    candidates = [(n_estimators, learning_rate, max_depth) for n_estimators in grid['n_estimators'] for learning_rate, max_depth in pairs]
+    scores = {candidate: [] for candidate in candidates}
+    alive = set(candidates)
+    rounds = [[i] for i in range(len(folds))] if method == 'halving' else [list(range(len(folds)))]
+    with Parallel(n_jobs=n_jobs, prefer='threads') as parallel:
+        for round_index, fold_indices in enumerate(rounds):
+            tasks = [(pair, i) for pair in pairs if any(candidate[1:] == pair for candidate in alive) for i in fold_indices]
+            fold_scores = parallel(delayed(staged_scores)(folds.folds[i], pair[0], pair[1], grid['n_estimators']) for pair, i in tasks)
+            for (pair, i), staged in zip(tasks, fold_scores):
+                for n_estimators, score in staged.items():
+                    if (n_estimators,) + pair in alive:
+                        scores[(n_estimators,) + pair].append(score)
+            if round_index < len(rounds) - 1:
+                ranked = sorted(alive, key=lambda candidate: (np.mean(scores[candidate]), candidates.index(candidate)))
+                alive = set(ranked[:max(1, len(ranked) // HALVING_FACTOR)])
+    results = []
+    best_rmse = float('inf')
+    best_params = {}
+    for candidate in candidates:
+        if candidate not in alive:
+            continue
+        params = {'n_estimators': candidate[0], 'learning_rate': candidate[1], 'max_depth': candidate[2]}
+        avg_rmse = np.mean(scores[candidate])
+        results.append({'params': params, 'avg_rmse': avg_rmse})
+        if avg_rmse < best_rmse:
+            best_rmse = avg_rmse
+            best_params = params
+    return best_params, best_rmse, results
+
+if __name__ == '__main__':
+    # python cv_engine.py benchmark [строк] - время перебора в зависимости от числа потоков
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    if len(sys.argv) < 2 or sys.argv[1] != 'benchmark':
+        print("Использование: python cv_engine.py benchmark [строк]")
+        sys.exit(1)
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(rows, 12))
+    y = X[:, 0] * 2 + np.sin(X[:, 1]) + rng.normal(scale=0.1, size=rows)
+    for n_jobs in sorted({1, 2, 4, os.cpu_count() or 1}):
+        started = time.perf_counter()
+        best_params, best_rmse, _ = search_gradient_boosting(X, y, n_jobs=n_jobs)
+        print(f"потоков {n_jobs}: {time.perf_counter() - started:.2f} с, {best_params}, RMSE {best_rmse:.4f}")
@@ -0,0 +1,93 @@
+import os
+import numpy as np
+from prediction_store import match_times
+
+ENSEMBLE_WEIGHT_STEP = float(os.getenv('PRISMTRADE_ENSEMBLE_WEIGHT_STEP', '0.1'))
+ENSEMBLE_WEIGHT_SOLVER = os.getenv('PRISMTRADE_ENSEMBLE_WEIGHT_SOLVER', 'grid')
+
+def compositions(total, parts):
+    if parts == 1:
+        yield (total,)
+        return
+    for first in range(1, total - parts + 2):
+        for rest in compositions(total - first, parts - 1):
+            yield (first,) + rest
+
+def simplex_grid(count, step=ENSEMBLE_WEIGHT_STEP):
+    """Все векторы весов с шагом step, каждый вес не меньше step, сумма 1 - матрица (кандидаты, модели).
+
+    Для двух моделей и шага 0.1 - те же 9 пар (0.1, 0.9) ... (0.9, 0.1) в том же порядке.
+    """
+    units = int(round(1 / step))
+    if count == 1:
+        return np.ones((1, 1))
+    # Как np.arange(step, 1, step): step + k * step, чтобы веса совпадали с прежним перебором до бита
+    grid = (np.array(list(compositions(units, count)), dtype=np.float64)[:, :-1] - 1) * step + step
+    return np.column_stack([grid, 1.0 - grid.sum(axis=1)])
+
+def forecast_matrix(forecasts, observed_times, observed_prices, models):
+    """Прогнозы моделей и фактические цены, выровненные в массивы.
+
+    forecasts - записи MODEL_FORECAST, observed_* - отсортированный ряд
+    наблюдавшихся цен. Берутся пары (время, интервал), для которых есть
+    прогноз каждой модели и разрешенная фактическая цена. Возвращает
+    (прогнозы (модели, выборки), факт (выборки,), начала групп по времени
+    прогноза для np.add.reduceat).
+    """
+    names = np.array([model.encode() for model in models])
+    forecasts = forecasts[np.isin(forecasts['model'], names)]
+    if len(forecasts) == 0:
+        return np.empty((len(models), 0)), np.empty(0), np.empty(0, dtype=np.int64)
+    keys, inverse = np.unique(np.stack([forecasts['time'], forecasts['interval']], axis=1), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    matrix = np.full((len(models), len(keys)), np.nan)
+    for index, name in enumerate(names):
+        rows = forecasts['model'] == name
+        matrix[index, inverse[rows]] = forecasts['price'][rows]
+    matched = match_times(observed_times, keys[:, 0] + keys[:, 1] * 60 * 1000000)
+    actuals = np.where(matched >= 0, np.asarray(observed_prices)[np.maximum(matched, 0)], np.nan)
+    valid = ~np.isnan(matrix).any(axis=0) & ~np.isnan(actuals) & (actuals != 0)
+    keys, matrix, actuals = keys[valid], matrix[:, valid], actuals[valid]
+    starts = np.flatnonzero(np.append(True, keys[1:, 0] != keys[:-1, 0])) if len(keys) else np.empty(0, dtype=np.int64)
+    return matrix, actuals, starts
+
+def ensemble_errors(weights, forecasts, actuals, starts):
+    """Ошибка каждого вектора весов одним матричным расчетом (кандидаты x модели x выборки).
+
+    Средняя относительная ошибка внутри группы (одного момента прогноза),
+    затем среднее по группам.
+    """
+    ensemble = weights @ forecasts
+    relative = np.abs(ensemble - actuals) / actuals
+    group_sums = np.add.reduceat(relative, starts, axis=1)
+    group_sizes = np.diff(np.append(starts, len(actuals)))
+    return (group_sums / group_sizes).mean(axis=1)
+
+def nnls_weights(forecasts, actuals):
+    """Неотрицательные веса по методу наименьших квадратов относительной ошибки, нормированные к сумме 1.
+
+    Минимизируется сумма квадратов относительных ошибок по всем выборкам без
+    ограничения на сумму весов, а не средняя абсолютная ошибка по группам, как
+    в ensemble_errors; после нормировки веса не обязательно оптимальны для нее.
+    """
+    from scipy.optimize import nnls
+    weights, _ = nnls((forecasts / actuals).T, np.ones(len(actuals)))
+    if weights.sum() <= 0:
+        return None
+    return weights / weights.sum()
+
+def search_weights(forecasts, actuals, starts, step=ENSEMBLE_WEIGHT_STEP, solver=ENSEMBLE_WEIGHT_SOLVER):
+    """Лучший вектор весов и его ошибка; первый минимум по сетке, как у полного перебора.
+
+    solver='nnls' - выпуклая задача вместо сетки (другой критерий, см. nnls_weights);
+    возвращаемая ошибка - по критерию сетки, чтобы ее можно было сравнивать
+    с перебором. Если задача вырождена, используется сетка.
+    """
+    if solver == 'nnls':
+        weights = nnls_weights(forecasts, actuals)
+        if weights is not None:
+            return weights, float(ensemble_errors(weights[np.newaxis], forecasts, actuals, starts)[0])
+    grid = simplex_grid(len(forecasts), step)
+    errors = ensemble_errors(grid, forecasts, actuals, starts)
+    best = int(np.argmin(errors))
+    return grid[best], float(errors[best])
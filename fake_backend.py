@@ -0,0 +1,78 @@
+import zlib
+import math
+from types import SimpleNamespace
+from datetime import datetime, timezone
+
+FAKE_INSTRUMENTS = [
+    {'ticker': 'SBER', 'figi': 'BBG004730N88', 'class_code': 'TQBR', 'name': 'Сбер Банк', 'lot': 10, 'currency': 'rub', 'base_price': 280.0},
+    {'ticker': 'GAZP', 'figi': 'BBG004730RP0', 'class_code': 'TQBR', 'name': 'Газпром', 'lot': 10, 'currency': 'rub', 'base_price': 160.0},
+    {'ticker': 'LKOH', 'figi': 'BBG004731032', 'class_code': 'TQBR', 'name': 'ЛУКОЙЛ', 'lot': 1, 'currency': 'rub', 'base_price': 7000.0},
+    {'ticker': 'AFLT', 'figi': 'BBG004S683W7', 'class_code': 'TQBR', 'name': 'Аэрофлот', 'lot': 10, 'currency': 'rub', 'base_price': 55.0}
+]
+FAKE_CANDLE_MINUTES = 5
+
+def to_quotation(value):
+    units = int(math.floor(value))
+    return SimpleNamespace(units=units, nano=int(round((value - units) * 1e9)))
+
+def fake_price(figi, slot, base_price):
+    noise = (zlib.crc32(f'{figi}:{slot}'.encode()) % 1000) / 1000 - 0.5
+    return base_price * (1 + 0.02 * math.sin(slot / 37) + 0.01 * math.sin(slot / 7.3) + 0.002 * noise)
+
+def fake_candle(instrument, slot, is_complete=True):
+    close = fake_price(instrument['figi'], slot, instrument['base_price'])
+    open_ = fake_price(instrument['figi'], slot - 1, instrument['base_price'])
+    return SimpleNamespace(
+        time=datetime.fromtimestamp(slot * FAKE_CANDLE_MINUTES * 60, tz=timezone.utc),
+        open=to_quotation(open_),
+        high=to_quotation(max(open_, close)),
+        low=to_quotation(min(open_, close)),
+        close=to_quotation(close),
+        volume=1000 + zlib.crc32(f'{instrument["figi"]}:{slot}:v'.encode()) % 5000,
+        is_complete=is_complete)
+
+class FakeMarketDataService:
+    def __init__(self, instruments):
+        self.instruments = instruments
+
+    def get_candles(self, figi, from_, to, interval=None):
+        instrument = self.instruments[figi]
+        step = FAKE_CANDLE_MINUTES * 60
+        first_slot = math.ceil(from_.timestamp() / step)
+        now_slot = int(datetime.now(timezone.utc).timestamp() // step)
+        last_slot = min(int(to.timestamp() // step), now_slot)
+        candles = [fake_candle(instrument, slot, slot < now_slot) for slot in range(first_slot, last_slot + 1)]
+        return SimpleNamespace(candles=candles)
+
+class FakeInstrumentsService:
+    def __init__(self, instruments):
+        self.instruments = instruments
+
+    def find_instrument(self, query):
+        found = [SimpleNamespace(**item) for item in self.instruments.values() if query.upper() in item['ticker']]
+        return SimpleNamespace(instruments=found)
+
+    def shares(self):
+        return SimpleNamespace(instruments=[SimpleNamespace(**item) for item in self.instruments.values()])
+
+class FakeUsersService:
+    def get_accounts(self):
+        return SimpleNamespace(accounts=[])
+
+class FakeClient:
+    """Встроенная замена tinkoff.invest.Client для тестов и работы без токена.
+
+    Возвращает детерминированные свечи по сетке 5 минут для FAKE_INSTRUMENTS.
+    """
+
+    def __init__(self, token=None, instruments=FAKE_INSTRUMENTS):
+        self.instruments = {item['figi']: item for item in instruments}
+
+    def __enter__(self):
+        return SimpleNamespace(
+            market_data=FakeMarketDataService(self.instruments),
+            instruments=FakeInstrumentsService(self.instruments),
+            users=FakeUsersService())
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
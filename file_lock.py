@@ -0,0 +1,25 @@
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+@contextmanager
+def file_lock(directory):
+    """Межпроцессная блокировка каталога хранилища: fcntl.flock на файле .lock в нем.
+
+    Нужна, когда в хранилище пишут несколько процессов (PRISMTRADE_EXECUTOR=process,
+    CLI рядом с работающим сервером). Блокировка не реентерабельна: повторный
+    захват в том же процессе ждет сам себя. Без fcntl (Windows) ничего не делает.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, '.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,291 @@
+import sys
+import time
+import numpy as np
+from sklearn.linear_model import LinearRegression
+from sklearn.preprocessing import StandardScaler, PolynomialFeatures
+from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.tree import DecisionTreeRegressor
+
+GB_PARAMS = {'n_estimators': 50, 'learning_rate': 0.1, 'max_depth': 3, 'random_state': 42}
+GB_TREES_PER_CANDLE = 2
+GB_MAX_EXTRA_TREES = 30
+POLY_RECENT_ROWS = 30
+DRIFT_THRESHOLD = 3.0
+
+class MultiOutputGradientBoosting:
+    """Градиентный бустинг с квадратичной функцией потерь сразу для нескольких целей.
+
+    На каждом шаге одно многовыходное дерево обучается на остатках всех
+    горизонтов прогноза, поэтому стоимость обучения почти не зависит от
+    числа горизонтов. Параметры повторяют GradientBoostingRegressor.
+    """
+
+    def __init__(self, n_estimators=50, learning_rate=0.1, max_depth=3, random_state=42, warm_start=False):
+        self.n_estimators = n_estimators
+        self.learning_rate = learning_rate
+        self.max_depth = max_depth
+        self.random_state = random_state
+        self.warm_start = warm_start
+        self.estimators_ = []
+        self.init_ = None
+
+    def fit(self, X, Y):
+        # Как и GradientBoostingRegressor, приводим X к float32 один раз и не проверяем входы на каждом дереве
+        X = np.asarray(X, dtype=np.float32, order='C')
+        Y = np.asarray(Y, dtype=np.float64)
+        if Y.ndim == 1:
+            Y = Y[:, None]
+        if self.warm_start and self.estimators_:
+            # Продолжаем обучение: новые деревья строятся по остаткам текущего ансамбля
+            prediction = self.predict(X)
+        else:
+            self.init_ = Y.mean(axis=0)
+            self.estimators_ = []
+            prediction = np.tile(self.init_, (len(Y), 1))
+        for i in range(len(self.estimators_), self.n_estimators):
+            tree = DecisionTreeRegressor(criterion='squared_error', max_depth=self.max_depth, random_state=self.random_state)
+            tree.fit(X, np.ascontiguousarray(Y - prediction), check_input=False)
+            prediction += self.learning_rate * tree.predict(X, check_input=False).reshape(prediction.shape)
+            self.estimators_.append(tree)
+        return self
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float32, order='C')
+        prediction = np.tile(self.init_, (len(X), 1))
+        for tree in self.estimators_:
+            prediction += self.learning_rate * tree.predict(X, check_input=False).reshape(prediction.shape)
+        return prediction
+
+def tree_nbytes(tree):
+    state = tree.tree_.__getstate__()
+    return state['nodes'].nbytes + state['values'].nbytes
+
+class RecursiveLeastSquares:
+    """Линейная регрессия со свободным членом, дообучаемая построчно (RLS).
+
+    fit() совпадает с LinearRegression, partial_fit() обновляет решение
+    без повторного обучения на всех строках.
+    """
+
+    def __init__(self, forgetting=1.0):
+        self.forgetting = forgetting
+        self.coef_ = None
+        self.P = None
+
+    @staticmethod
+    def _design(X):
+        X = np.asarray(X, dtype=float)
+        return np.hstack([np.ones((len(X), 1)), X])
+
+    def fit(self, X, Y):
+        Y = np.asarray(Y, dtype=float).reshape(len(Y), -1)
+        model = LinearRegression().fit(X, Y)
+        self.coef_ = np.vstack([model.intercept_[None, :], model.coef_.T])
+        A = self._design(X)
+        self.P = np.linalg.pinv(A.T @ A)
+        return self
+
+    def partial_fit(self, X, Y):
+        Y = np.asarray(Y, dtype=float).reshape(len(Y), -1)
+        for a, target in zip(self._design(X), Y):
+            Pa = self.P @ a
+            gain = Pa / (self.forgetting + a @ Pa)
+            self.coef_ += np.outer(gain, target - a @ self.coef_)
+            self.P = (self.P - np.outer(gain, Pa)) / self.forgetting
+        return self
+
+    def predict(self, X):
+        return self._design(X) @ self.coef_
+
+    def nbytes(self):
+        return self.coef_.nbytes + self.P.nbytes
+
+class HorizonModels:
+    """Скейлеры и модели всех горизонтов прогноза одного инструмента.
+
+    Горизонты обучаются группами: в режиме per_horizon у каждого горизонта
+    своя группа, в multi_horizon - одна общая многовыходная. fit() - полное
+    обучение; update() дообучает линейную регрессию (RLS) на строках,
+    появившихся после последнего обучения, и добавляет деревья бустинга
+    через warm_start. Полиномиальная регрессия обучается на последних
+    POLY_RECENT_ROWS строках и пересчитывается при каждом прогнозе.
+    Скейлеры подбираются только в fit() и между полными обучениями не меняются.
+
+    В multi_horizon все горизонты группы обучаются на общих строках, у которых
+    известна цель самого дальнего горизонта, поэтому короткие горизонты теряют
+    max(windows) - window самых свежих строк и могут прогнозировать хуже, чем
+    в per_horizon.
+    """
+
+    def __init__(self, windows, mode='per_horizon'):
+        self.windows = list(windows)
+        self.mode = mode
+        self.groups = [tuple(self.windows)] if mode == 'multi_horizon' else [(window,) for window in self.windows]
+        self.poly = PolynomialFeatures(degree=2)
+        self.scaler_X = None
+        self.scaler_y = None
+        self.models = {}
+        self.last_time = None
+        self.candles_since_refit = 0
+        self.extra_trees = 0
+
+    def _scale(self, X, y):
+        return self.scaler_X.transform(X), self.scaler_y.transform(np.asarray(y).reshape(-1, 1)).flatten()
+
+    @staticmethod
+    def _targets(y_scaled, group, n_train):
+        return np.column_stack([y_scaled[window:window + n_train] for window in group])
+
+    @staticmethod
+    def _fit_boosting(model, X_train, Y_train):
+        model.fit(X_train, Y_train.ravel() if isinstance(model, GradientBoostingRegressor) else Y_train)
+
+    def fit(self, X, y, row_times):
+        self.scaler_X = StandardScaler().fit(X)
+        self.scaler_y = StandardScaler().fit(np.asarray(y).reshape(-1, 1))
+        X_scaled, y_scaled = self._scale(X, y)
+        self.models = {}
+        for group in self.groups:
+            n_train = len(X_scaled) - max(group)
+            if n_train <= 0:
+                continue
+            X_train = X_scaled[:n_train]
+            Y_train = self._targets(y_scaled, group, n_train)
+            linear = RecursiveLeastSquares().fit(X_train, Y_train)
+            if len(group) == 1:
+                boosting = GradientBoostingRegressor(warm_start=True, **GB_PARAMS)
+            else:
+                boosting = MultiOutputGradientBoosting(warm_start=True, **GB_PARAMS)
+            try:
+                self._fit_boosting(boosting, X_train, Y_train)
+            except Exception:
+                boosting = None
+            self.models[group] = {
+                'linear': linear,
+                'boosting': boosting,
+                'residual_scale': float(np.std(Y_train - linear.predict(X_train))),
+                'trained_until': row_times[n_train - 1]
+            }
+        self.last_time = row_times[-1]
+        self.candles_since_refit = 0
+        self.extra_trees = 0
+        return self
+
+    def update(self, X, y, row_times):
+        """Дообучение на новых свечах: 'reuse', 'update', либо 'refit'/'drift', если нужно полное обучение."""
+        if X.shape[1] != self.scaler_X.n_features_in_:
+            return 'refit'
+        new_candles = sum(1 for row_time in row_times if row_time > self.last_time)
+        if new_candles == 0:
+            return 'reuse'
+        added_trees = GB_TREES_PER_CANDLE * new_candles
+        if self.extra_trees + added_trees > GB_MAX_EXTRA_TREES:
+            return 'refit'
+        X_scaled, y_scaled = self._scale(X, y)
+        row_times = np.asarray(row_times)
+        pending = []
+        for group, models in self.models.items():
+            # Последняя свеча может еще формироваться, поэтому в цели берем только завершенные
+            last_row = len(X_scaled) - 2 - max(group)
+            rows = np.flatnonzero(row_times[:max(last_row + 1, 0)] > models['trained_until'])
+            if len(rows) == 0:
+                continue
+            X_new = X_scaled[rows]
+            Y_new = np.column_stack([y_scaled[rows + window] for window in group])
+            error = np.mean(np.abs(Y_new - models['linear'].predict(X_new)))
+            if error > DRIFT_THRESHOLD * max(models['residual_scale'], 1e-12):
+                return 'drift'
+            pending.append((models, X_new, Y_new, row_times[rows[-1]]))
+        for models, X_new, Y_new, trained_until in pending:
+            models['linear'].partial_fit(X_new, Y_new)
+            models['trained_until'] = trained_until
+        for group, models in self.models.items():
+            boosting = models['boosting']
+            # Та же граница завершенных свечей, что и у partial_fit выше
+            n_train = len(X_scaled) - 1 - max(group)
+            if boosting is None or n_train <= 0:
+                continue
+            boosting.n_estimators += added_trees
+            try:
+                self._fit_boosting(boosting, X_scaled[:n_train], self._targets(y_scaled, group, n_train))
+            except Exception:
+                models['boosting'] = None
+        self.extra_trees += added_trees
+        self.candles_since_refit += new_candles
+        self.last_time = row_times[-1]
+        return 'update'
+
+    def predict(self, X, y):
+        X_scaled, y_scaled = self._scale(X, y)
+        last_features = X_scaled[-1:]
+        poly_features = self.poly.fit_transform(X_scaled)
+        last_poly_features = poly_features[-1:]
+        base_predictions = {}
+        for group, models in self.models.items():
+            n_train = len(X_scaled) - max(group)
+            if n_train <= 0:
+                continue
+            pred_lr = models['linear'].predict(last_features)[0]
+            recent_window = min(POLY_RECENT_ROWS, n_train)
+            model_poly = LinearRegression()
+            model_poly.fit(poly_features[:n_train][-recent_window:], self._targets(y_scaled, group, n_train)[-recent_window:])
+            pred_poly = model_poly.predict(last_poly_features).reshape(-1)
+            boosting = models['boosting']
+            pred_gb = boosting.predict(last_features).reshape(-1) if boosting is not None else pred_lr
+            for i, window in enumerate(group):
+                base_predictions[window] = (pred_lr[i], pred_poly[i], pred_gb[i])
+        return base_predictions
+
+    def nbytes(self):
+        total = 0
+        for models in self.models.values():
+            total += models['linear'].nbytes()
+            boosting = models['boosting']
+            if isinstance(boosting, GradientBoostingRegressor):
+                total += sum(tree_nbytes(tree) for tree in boosting.estimators_.ravel())
+            elif boosting is not None:
+                total += sum(tree_nbytes(tree) for tree in boosting.estimators_)
+        return total
+
+if __name__ == '__main__':
+    # python forecast_models.py benchmark [строк] - обучение и прогноз по режимам и числу горизонтов
+    # в сравнении с прежним циклом, который заново обучал все модели для каждого горизонта
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 288
+    if len(sys.argv) < 2 or sys.argv[1] != 'benchmark':
+        print("Использование: python forecast_models.py benchmark [строк]")
+        sys.exit(1)
+
+    def per_window_loop(X, y, windows):
+        X_scaled = StandardScaler().fit_transform(X)
+        y_scaled = StandardScaler().fit_transform(y.reshape(-1, 1)).flatten()
+        last_features = X_scaled[-1:]
+        base_predictions = {}
+        for window in windows:
+            X_train, y_train = X_scaled[:-window], y_scaled[window:]
+            pred_lr = LinearRegression().fit(X_train, y_train).predict(last_features)[0]
+            recent_window = min(POLY_RECENT_ROWS, len(X_train))
+            poly = PolynomialFeatures(degree=2)
+            model_poly = LinearRegression().fit(poly.fit_transform(X_train[-recent_window:]), y_train[-recent_window:])
+            pred_poly = model_poly.predict(poly.transform(last_features))[0]
+            pred_gb = GradientBoostingRegressor(**GB_PARAMS).fit(X_train, y_train).predict(last_features)[0]
+            base_predictions[window] = (pred_lr, pred_poly, pred_gb)
+        return base_predictions
+
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(rows, 18))
+    y = 250 + np.cumsum(rng.normal(scale=0.3, size=rows))
+    row_times = list(range(rows))
+    for windows in ([15, 30, 60], list(range(5, 245, 5))):
+        runs = {'per_window_loop': lambda: per_window_loop(X, y, windows)}
+        for mode in ('per_horizon', 'multi_horizon'):
+            runs[mode] = lambda mode=mode: HorizonModels(windows, mode).fit(X, y, row_times).predict(X, y)
+        reference = None
+        for name, run in runs.items():
+            timings = []
+            for _ in range(3):
+                started = time.perf_counter()
+                predictions = run()
+                timings.append(time.perf_counter() - started)
+            reference = reference or predictions
+            difference = max(np.max(np.abs(np.subtract(predictions[window], reference[window]))) for window in windows)
+            print(f"{name}, горизонтов {len(windows)}: {min(timings) * 1000:.0f} мс, отклонение от прежнего цикла {difference:.4f}")
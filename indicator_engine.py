@@ -0,0 +1,367 @@
+import os
+import math
+import threading
+from collections import deque, OrderedDict
+import numpy as np
+import pandas as pd
+
+INDICATOR_BACKEND = os.getenv('PRISMTRADE_INDICATOR_BACKEND', 'pandas')
+INDICATOR_ENGINE_MAX_ROWS = 5000
+INDICATOR_ENGINE_CACHE_SIZE = 200
+ROLLING_RESYNC_EVERY = 1000
+EPS = np.finfo(float).eps
+NAN = float('nan')
+
+INDICATOR_COLUMNS = [
+    'close', 'volume', 'rsi', 'rsi_fast', 'macd', 'signal', 'macd_hist', 'macd_div', 'sma', 'std',
+    'bb_width_factor', 'upper_band', 'lower_band', 'bb_width', 'percent_b', 'volume_sma', 'volume_sma_long',
+    'volume_change', 'volume_oscillator', 'hl_range', 'ad_factor', 'ad_line', 'price_ma_5', 'price_ma_10',
+    'price_ma_20', 'price_ma_50', 'ma_convergence', 'volatility_short', 'volatility', 'high', 'low', 'tr1',
+    'tr2', 'tr3', 'true_range', 'atr', 'momentum', 'roc_5', 'roc_10', 'tenkan_sen', 'kijun_sen', 'stoch_k',
+    'stoch_d'
+]
+
+# Сколько первых строк окна в пакетном расчете пустые (rolling, diff, pct_change)
+WARMUP_ROWS = {
+    'macd_div': 1, 'sma': 19, 'std': 19, 'volume_sma': 4, 'volume_sma_long': 19, 'volume_change': 1,
+    'hl_range': 1, 'price_ma_5': 4, 'price_ma_10': 9, 'price_ma_20': 19, 'volatility_short': 5,
+    'volatility': 20, 'high': 1, 'low': 1, 'tr1': 1, 'tr2': 1, 'tr3': 1, 'true_range': 1, 'atr': 14,
+    'momentum': 10, 'roc_5': 5, 'roc_10': 10, 'tenkan_sen': 8, 'kijun_sen': 25, 'stoch_k': 13, 'stoch_d': 15
+}
+
+def warmup_rows(count):
+    """Первая строка без пустых колонок в полном пакетном расчете по count свечам."""
+    return max(max(WARMUP_ROWS.values()), min(50, count - 1) - 1)
+
+def safe_div(a, b):
+    if b == 0 or math.isnan(b):
+        if math.isnan(a) or math.isnan(b) or a == 0:
+            return NAN
+        return math.copysign(math.inf, a)
+    return a / b
+
+class Ewm:
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.value = None
+
+    def copy(self):
+        other = Ewm(self.alpha)
+        other.value = self.value
+        return other
+
+    def update(self, x):
+        if self.value is None:
+            self.value = x
+        else:
+            self.value = (1 - self.alpha) * self.value + self.alpha * x
+        return self.value
+
+class RollingWindow:
+    """Скользящее окно с суммой и суммой квадратов (со сдвигом для точности)."""
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self.nan_count = 0
+        self.shift = None
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.same_run = 0
+        self.pushes = 0
+
+    def copy(self):
+        other = RollingWindow.__new__(RollingWindow)
+        other.__dict__.update(self.__dict__)
+        other.values = deque(self.values)
+        return other
+
+    def _resync(self):
+        valid = [x - self.shift for x in self.values if not math.isnan(x)]
+        self.total = math.fsum(valid)
+        self.total_sq = math.fsum(x * x for x in valid)
+
+    def push(self, x):
+        if self.values and not math.isnan(x) and x == self.values[-1]:
+            self.same_run += 1
+        else:
+            self.same_run = 1 if not math.isnan(x) else 0
+        self.values.append(x)
+        if math.isnan(x):
+            self.nan_count += 1
+        else:
+            if self.shift is None:
+                self.shift = x
+            self.total += x - self.shift
+            self.total_sq += (x - self.shift) ** 2
+        if len(self.values) > self.window:
+            old = self.values.popleft()
+            if math.isnan(old):
+                self.nan_count -= 1
+            else:
+                self.total -= old - self.shift
+                self.total_sq -= (old - self.shift) ** 2
+        self.pushes += 1
+        if self.pushes % ROLLING_RESYNC_EVERY == 0:
+            self._resync()
+
+    def ready(self):
+        return len(self.values) == self.window and self.nan_count == 0
+
+    def mean(self):
+        if not self.ready():
+            return NAN
+        if self.same_run >= self.window:
+            return self.values[-1]
+        return self.total / self.window + self.shift
+
+    def std(self):
+        if not self.ready() or self.window < 2:
+            return NAN
+        if self.same_run >= self.window:
+            return 0.0
+        var = (self.total_sq - self.total * self.total / self.window) / (self.window - 1)
+        return math.sqrt(max(var, 0.0))
+
+class RollingExtremum:
+    """Минимум или максимум по окну на монотонной очереди."""
+
+    def __init__(self, window, is_max):
+        self.window = window
+        self.is_max = is_max
+        self.items = deque()
+        self.index = -1
+
+    def copy(self):
+        other = RollingExtremum(self.window, self.is_max)
+        other.items = deque(self.items)
+        other.index = self.index
+        return other
+
+    def push(self, x):
+        self.index += 1
+        if self.is_max:
+            while self.items and self.items[-1][1] <= x:
+                self.items.pop()
+        else:
+            while self.items and self.items[-1][1] >= x:
+                self.items.pop()
+        self.items.append((self.index, x))
+        while self.items[0][0] <= self.index - self.window:
+            self.items.popleft()
+        return self.items[0][1] if self.index >= self.window - 1 else NAN
+
+class IncrementalIndicatorEngine:
+    """Потоковый расчет индикаторов calculate_technical_indicators.
+
+    Каждая новая свеча обновляет все индикаторы за O(1): EWM хранят текущее
+    значение, скользящие средние и std - суммы по окну, min/max - монотонные
+    очереди. Свеча с тем же временем, что и последняя, заменяет ее (пересчет
+    от сохраненного предыдущего состояния).
+
+    Затравка - первое окно свечей, поданное в sync() пустому движку: на нем
+    индикаторы совпадают с пакетным расчетом по этому окну, включая пустые
+    строки прогрева. Дальше состояние только продолжается, и frame(last)
+    равен последним last строкам пакетного расчета по всем свечам с начала
+    затравки. От расчета по одному скользящему окну он отличается: EWM (RSI,
+    MACD) и ad_line помнят свечи до окна, а строк прогрева в окне нет.
+    """
+
+    def __init__(self, max_rows=INDICATOR_ENGINE_MAX_ROWS):
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+        self.rows = {column: [] for column in INDICATOR_COLUMNS}
+        self.count = 0
+        self.last_time = None
+        self.state = self._initial_state()
+        self.previous_state = None
+
+    def _initial_state(self):
+        return {
+            'prev_close': None,
+            'prev_volume': None,
+            'prev_macd': None,
+            'ad_line': 0.0,
+            'gain': Ewm(1 / 14), 'loss': Ewm(1 / 14),
+            'gain_fast': Ewm(1 / 5), 'loss_fast': Ewm(1 / 5),
+            'ema12': Ewm(2 / 13), 'ema26': Ewm(2 / 27), 'signal': Ewm(2 / 10),
+            'close_5': RollingWindow(5), 'close_10': RollingWindow(10),
+            'close_20': RollingWindow(20), 'close_50': RollingWindow(50),
+            'returns_5': RollingWindow(5), 'returns_20': RollingWindow(20),
+            'volume_5': RollingWindow(5), 'volume_20': RollingWindow(20),
+            'true_range_14': RollingWindow(14), 'stoch_k_3': RollingWindow(3),
+            'max_9': RollingExtremum(9, True), 'min_9': RollingExtremum(9, False),
+            'max_14': RollingExtremum(14, True), 'min_14': RollingExtremum(14, False),
+            'max_26': RollingExtremum(26, True), 'min_26': RollingExtremum(26, False),
+            'closes_10': deque(maxlen=11)
+        }
+
+    def _copy_state(self):
+        copied = {}
+        for key, value in self.state.items():
+            if isinstance(value, deque):
+                copied[key] = deque(value, maxlen=value.maxlen)
+            elif hasattr(value, 'copy'):
+                copied[key] = value.copy()
+            else:
+                copied[key] = value
+        return copied
+
+    def _compute_row(self, close, volume):
+        st = self.state
+        prev_close = st['prev_close']
+        prev_volume = st['prev_volume']
+        delta = close - prev_close if prev_close is not None else NAN
+        up = delta if delta > 0 else 0.0
+        down = -delta if delta < 0 else 0.0
+        gain = st['gain'].update(up)
+        loss = st['loss'].update(down)
+        rsi = 100 - 100 / (1 + gain / (loss if loss != 0 else EPS))
+        gain_fast = st['gain_fast'].update(up)
+        loss_fast = st['loss_fast'].update(down)
+        rsi_fast = 100 - 100 / (1 + gain_fast / (loss_fast if loss_fast != 0 else EPS))
+        macd = st['ema12'].update(close) - st['ema26'].update(close)
+        signal = st['signal'].update(macd)
+        macd_div = macd - st['prev_macd'] if st['prev_macd'] is not None else NAN
+        for key in ('close_5', 'close_10', 'close_20', 'close_50'):
+            st[key].push(close)
+        sma = st['close_20'].mean()
+        std = st['close_20'].std()
+        returns = safe_div(close, prev_close) - 1 if prev_close is not None else NAN
+        st['returns_5'].push(returns)
+        st['returns_20'].push(returns)
+        returns_std_20 = st['returns_20'].std()
+        volatility_factor = returns_std_20 * 100
+        bb_width_factor = min(3, max(1.5, 2 + volatility_factor / 10))
+        upper_band = sma + std * bb_width_factor
+        lower_band = sma - std * bb_width_factor
+        st['volume_5'].push(float(volume))
+        st['volume_20'].push(float(volume))
+        volume_sma = st['volume_5'].mean()
+        volume_sma_long = st['volume_20'].mean()
+        volume_change = (safe_div(volume, prev_volume) - 1) * 100 if prev_volume is not None else NAN
+        hl_range = abs(delta)
+        ad_factor = delta / hl_range if hl_range > 0 else 0.0
+        st['ad_line'] += ad_factor * volume
+        price_ma_5 = st['close_5'].mean()
+        price_ma_20 = sma
+        if prev_close is not None:
+            high = max(close, prev_close)
+            low = min(close, prev_close)
+            tr1 = high - low
+            tr2 = abs(high - prev_close)
+            tr3 = abs(low - prev_close)
+            true_range = max(tr1, tr2, tr3)
+        else:
+            high = low = tr1 = tr2 = tr3 = true_range = NAN
+        st['true_range_14'].push(true_range)
+        closes = st['closes_10']
+        closes.append(close)
+        roc_5 = (safe_div(close, closes[-6]) - 1) * 100 if len(closes) >= 6 else NAN
+        roc_10 = (safe_div(close, closes[0]) - 1) * 100 if len(closes) == 11 else NAN
+        low_min = st['min_14'].push(close)
+        high_max = st['max_14'].push(close)
+        stoch_k = 100 * safe_div(close - low_min, high_max - low_min)
+        st['stoch_k_3'].push(stoch_k)
+        row = {
+            'close': close,
+            'volume': volume,
+            'rsi': rsi,
+            'rsi_fast': rsi_fast,
+            'macd': macd,
+            'signal': signal,
+            'macd_hist': macd - signal,
+            'macd_div': macd_div,
+            'sma': sma,
+            'std': std,
+            'bb_width_factor': bb_width_factor,
+            'upper_band': upper_band,
+            'lower_band': lower_band,
+            'bb_width': safe_div(upper_band - lower_band, sma) * 100,
+            'percent_b': safe_div(close - lower_band, upper_band - lower_band),
+            'volume_sma': volume_sma,
+            'volume_sma_long': volume_sma_long,
+            'volume_change': volume_change,
+            'volume_oscillator': (safe_div(volume_sma, volume_sma_long) - 1) * 100,
+            'hl_range': hl_range,
+            'ad_factor': ad_factor,
+            'ad_line': st['ad_line'],
+            'price_ma_5': price_ma_5,
+            'price_ma_10': st['close_10'].mean(),
+            'price_ma_20': price_ma_20,
+            'price_ma_50': st['close_50'].mean(),
+            'ma_convergence': (safe_div(price_ma_5, price_ma_20) - 1) * 100,
+            'volatility_short': st['returns_5'].std() * np.sqrt(252),
+            'volatility': returns_std_20 * np.sqrt(252),
+            'high': high,
+            'low': low,
+            'tr1': tr1,
+            'tr2': tr2,
+            'tr3': tr3,
+            'true_range': true_range,
+            'atr': st['true_range_14'].mean(),
+            'momentum': roc_10,
+            'roc_5': roc_5,
+            'roc_10': roc_10,
+            'tenkan_sen': (st['max_9'].push(close) + st['min_9'].push(close)) / 2,
+            'kijun_sen': (st['max_26'].push(close) + st['min_26'].push(close)) / 2,
+            'stoch_k': stoch_k,
+            'stoch_d': st['stoch_k_3'].mean()
+        }
+        st['prev_close'] = close
+        st['prev_volume'] = volume
+        st['prev_macd'] = macd
+        return row
+
+    def update(self, close, volume, candle_time=None):
+        with self.lock:
+            revise = candle_time is not None and candle_time == self.last_time and self.previous_state is not None
+            if revise:
+                self.state = self.previous_state
+            self.previous_state = self._copy_state()
+            row = self._compute_row(float(close), volume)
+            if revise:
+                for column in INDICATOR_COLUMNS:
+                    self.rows[column][-1] = row[column]
+            else:
+                for column in INDICATOR_COLUMNS:
+                    self.rows[column].append(row[column])
+                self.count += 1
+                if len(self.rows['close']) > self.max_rows:
+                    drop = len(self.rows['close']) - self.max_rows // 2
+                    for column in INDICATOR_COLUMNS:
+                        del self.rows[column][:drop]
+            if candle_time is not None:
+                self.last_time = candle_time
+
+    def sync(self, times, closes, volumes):
+        """Подает свечи новее последней обработанной (последняя может быть заменена)."""
+        for candle_time, close, volume in zip(times, closes, volumes):
+            if self.last_time is None or candle_time >= self.last_time:
+                self.update(close, volume, candle_time)
+
+    def frame(self, last=None):
+        """Последние last строк расчета, начатого с затравки (см. описание класса)."""
+        with self.lock:
+            stored = len(self.rows['close'])
+            start = 0 if last is None else max(0, stored - last)
+            df = pd.DataFrame({column: np.array(self.rows[column][start:], dtype=float) for column in INDICATOR_COLUMNS})
+            df['volume'] = np.array(self.rows['volume'][start:])
+            # Окно MA50 в пакетном расчете равно min(50, len(df) - 1)
+            window = min(50, self.count - 1)
+            if 0 < window < 50:
+                df['price_ma_50'] = pd.Series(self.rows['close']).rolling(window=window).mean().values[start:]
+            return df
+
+_engines = OrderedDict()
+_engines_lock = threading.Lock()
+
+def get_indicator_engine(key):
+    with _engines_lock:
+        engine = _engines.pop(key, None)
+        if engine is None:
+            engine = IncrementalIndicatorEngine()
+        _engines[key] = engine
+        while len(_engines) > INDICATOR_ENGINE_CACHE_SIZE:
+            _engines.popitem(last=False)
+        return engine
@@ -0,0 +1,322 @@
+import os
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import lfilter
+from indicator_engine import INDICATOR_COLUMNS
+from indicator_registry import indicator, indicator_registry
+
+INDICATOR_DTYPE = np.dtype(os.getenv('PRISMTRADE_INDICATOR_DTYPE', 'float64'))
+EPS = np.finfo(float).eps
+
+def shift(x, periods=1):
+    result = np.full_like(x, np.nan)
+    result[..., periods:] = x[..., :-periods]
+    return result
+
+def diff(x, periods=1):
+    return x - shift(x, periods)
+
+def pct_change(x, periods=1):
+    return x / shift(x, periods) - 1
+
+def rolling_view(x, window):
+    return sliding_window_view(x, window, axis=-1)
+
+def pad_front(values, n, window):
+    result = np.full(values.shape[:-1] + (n,), np.nan, dtype=values.dtype)
+    result[..., window - 1:] = values
+    return result
+
+def rolling_apply(x, window, func):
+    n = x.shape[-1]
+    if window < 1 or window > n:
+        return np.full_like(x, np.nan)
+    return pad_front(func(rolling_view(x, window)), n, window)
+
+def rolling_mean(x, window):
+    return rolling_apply(x, window, lambda view: view.mean(axis=-1))
+
+def rolling_std(x, window):
+    return rolling_apply(x, window, lambda view: view.std(axis=-1, ddof=1))
+
+def rolling_max(x, window):
+    return rolling_apply(x, window, lambda view: view.max(axis=-1))
+
+def rolling_min(x, window):
+    return rolling_apply(x, window, lambda view: view.min(axis=-1))
+
+def ewm(x, alpha=None, span=None):
+    """EWM с adjust=False как у pandas: y0 = x0, yt = (1 - a) * yt-1 + a * xt."""
+    if alpha is None:
+        alpha = 2 / (span + 1)
+    zi = (1 - alpha) * x[..., :1]
+    return lfilter([alpha], [1, -(1 - alpha)], x, axis=-1, zi=zi)[0].astype(x.dtype, copy=False)
+
+def rsi(gain, loss, alpha):
+    gain = ewm(gain, alpha)
+    loss = ewm(loss, alpha)
+    loss = np.where(loss == 0, EPS, loss)
+    return 100 - (100 / (1 + gain / loss))
+
+@indicator('prev_close', 'close')
+def prev_close(close):
+    return shift(close)
+
+@indicator('delta', 'close', 'prev_close')
+def delta(close, prev_close):
+    return close - prev_close
+
+@indicator('returns', 'close', 'prev_close')
+def returns(close, prev_close):
+    return close / prev_close - 1
+
+@indicator('up', 'delta')
+def up(delta):
+    return np.where(delta > 0, delta, 0).astype(delta.dtype)
+
+@indicator('down', 'delta')
+def down(delta):
+    return np.where(delta < 0, -delta, 0).astype(delta.dtype)
+
+@indicator('rsi', 'up', 'down')
+def rsi_slow(up, down):
+    return rsi(up, down, 1 / 14)
+
+@indicator('rsi_fast', 'up', 'down')
+def rsi_fast(up, down):
+    return rsi(up, down, 1 / 5)
+
+@indicator('macd', 'close')
+def macd(close):
+    return ewm(close, span=12) - ewm(close, span=26)
+
+@indicator('signal', 'macd')
+def signal(macd):
+    return ewm(macd, span=9)
+
+@indicator('macd_hist', 'macd', 'signal')
+def macd_hist(macd, signal):
+    return macd - signal
+
+@indicator('macd_div', 'macd')
+def macd_div(macd):
+    return diff(macd)
+
+@indicator('close_flat_20', 'close')
+def close_flat_20(close):
+    # Как и pandas, для окна из одинаковых значений среднее равно этому значению, а std - нулю
+    flat = np.zeros(close.shape, dtype=bool)
+    if close.shape[-1] >= 20:
+        view = rolling_view(close, 20)
+        flat[..., 19:] = view.max(axis=-1) == view.min(axis=-1)
+    return flat
+
+@indicator('sma', 'close', 'close_flat_20')
+def sma(close, close_flat_20):
+    result = rolling_mean(close, 20)
+    result[close_flat_20] = close[close_flat_20]
+    return result
+
+@indicator('std', 'close', 'close_flat_20')
+def std(close, close_flat_20):
+    result = rolling_std(close, 20)
+    result[close_flat_20] = 0
+    return result
+
+@indicator('returns_std_20', 'returns')
+def returns_std_20(returns):
+    return rolling_std(returns, 20)
+
+@indicator('bb_width_factor', 'returns_std_20')
+def bb_width_factor(returns_std_20):
+    volatility_factor = returns_std_20 * 100
+    return np.where(np.isnan(volatility_factor), 1.5, np.minimum(3, np.maximum(1.5, 2 + volatility_factor / 10))).astype(returns_std_20.dtype)
+
+@indicator('upper_band', 'sma', 'std', 'bb_width_factor')
+def upper_band(sma, std, bb_width_factor):
+    return sma + std * bb_width_factor
+
+@indicator('lower_band', 'sma', 'std', 'bb_width_factor')
+def lower_band(sma, std, bb_width_factor):
+    return sma - std * bb_width_factor
+
+@indicator('bb_width', 'upper_band', 'lower_band', 'sma')
+def bb_width(upper_band, lower_band, sma):
+    return (upper_band - lower_band) / sma * 100
+
+@indicator('percent_b', 'close', 'upper_band', 'lower_band')
+def percent_b(close, upper_band, lower_band):
+    return (close - lower_band) / (upper_band - lower_band)
+
+@indicator('volume_sma', 'volume')
+def volume_sma(volume):
+    return rolling_mean(volume, 5)
+
+@indicator('volume_sma_long', 'volume')
+def volume_sma_long(volume):
+    return rolling_mean(volume, 20)
+
+@indicator('volume_change', 'volume')
+def volume_change(volume):
+    return pct_change(volume) * 100
+
+@indicator('volume_oscillator', 'volume_sma', 'volume_sma_long')
+def volume_oscillator(volume_sma, volume_sma_long):
+    return (volume_sma / volume_sma_long - 1) * 100
+
+@indicator('hl_range', 'delta')
+def hl_range(delta):
+    return np.abs(delta)
+
+@indicator('ad_factor', 'delta', 'hl_range')
+def ad_factor(delta, hl_range):
+    return np.where(hl_range > 0, delta / hl_range, 0).astype(delta.dtype)
+
+@indicator('ad_line', 'ad_factor', 'volume')
+def ad_line(ad_factor, volume):
+    return np.cumsum(ad_factor * volume, axis=-1)
+
+@indicator('price_ma_5', 'close')
+def price_ma_5(close):
+    return rolling_mean(close, 5)
+
+@indicator('price_ma_10', 'close')
+def price_ma_10(close):
+    return rolling_mean(close, 10)
+
+@indicator('price_ma_20', 'sma')
+def price_ma_20(sma):
+    return sma
+
+@indicator('price_ma_50', 'close')
+def price_ma_50(close):
+    return rolling_mean(close, min(50, close.shape[-1] - 1))
+
+@indicator('ma_convergence', 'price_ma_5', 'sma')
+def ma_convergence(price_ma_5, sma):
+    return (price_ma_5 / sma - 1) * 100
+
+@indicator('volatility_short', 'returns')
+def volatility_short(returns):
+    return rolling_std(returns, 5) * np.sqrt(252)
+
+@indicator('volatility', 'returns_std_20')
+def volatility(returns_std_20):
+    return returns_std_20 * np.sqrt(252)
+
+@indicator('high', 'close', 'prev_close')
+def high(close, prev_close):
+    return np.maximum(close, prev_close)
+
+@indicator('low', 'close', 'prev_close')
+def low(close, prev_close):
+    return np.minimum(close, prev_close)
+
+@indicator('tr1', 'high', 'low')
+def tr1(high, low):
+    return high - low
+
+@indicator('tr2', 'high', 'prev_close')
+def tr2(high, prev_close):
+    return np.abs(high - prev_close)
+
+@indicator('tr3', 'low', 'prev_close')
+def tr3(low, prev_close):
+    return np.abs(low - prev_close)
+
+@indicator('true_range', 'tr1', 'tr2', 'tr3')
+def true_range(tr1, tr2, tr3):
+    return np.fmax(np.fmax(tr1, tr2), tr3)
+
+@indicator('atr', 'true_range')
+def atr(true_range):
+    return rolling_mean(true_range, 14)
+
+@indicator('roc_10', 'close')
+def roc_10(close):
+    return pct_change(close, 10) * 100
+
+@indicator('momentum', 'roc_10')
+def momentum(roc_10):
+    return roc_10
+
+@indicator('roc_5', 'close')
+def roc_5(close):
+    return pct_change(close, 5) * 100
+
+@indicator('tenkan_sen', 'close')
+def tenkan_sen(close):
+    return (rolling_max(close, 9) + rolling_min(close, 9)) / 2
+
+@indicator('kijun_sen', 'close')
+def kijun_sen(close):
+    return (rolling_max(close, 26) + rolling_min(close, 26)) / 2
+
+@indicator('stoch_k', 'close')
+def stoch_k(close):
+    low_min = rolling_min(close, 14)
+    high_max = rolling_max(close, 14)
+    return 100 * (close - low_min) / (high_max - low_min)
+
+@indicator('stoch_d', 'stoch_k')
+def stoch_d(stoch_k):
+    return rolling_mean(stoch_k, 3)
+
+def compute_indicators(prices, volumes, dtype=INDICATOR_DTYPE, columns=None):
+    """Векторизованный расчет колонок calculate_technical_indicators.
+
+    Работает по последней оси, поэтому принимает как ряд одного тикера, так и
+    матрицу (тикеры x время). Считаются только запрошенные колонки и их
+    зависимости из indicator_registry (по умолчанию - все INDICATOR_COLUMNS).
+    Возвращает словарь колонок в запрошенном порядке.
+    """
+    columns = INDICATOR_COLUMNS if columns is None else list(columns)
+    volume_raw = np.asarray(volumes)
+    inputs = {
+        'close': np.ascontiguousarray(prices, dtype=dtype),
+        'volume': np.ascontiguousarray(volume_raw, dtype=dtype)
+    }
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = indicator_registry.compute(columns, inputs)
+    if 'volume' in result:
+        result['volume'] = volume_raw
+    return result
+
+def align_candles(series):
+    """Выравнивает свечи нескольких инструментов по общей 5-минутной сетке.
+
+    series - список (times, closes, volumes) с временем в секундах. Сетка -
+    объединение всех моментов времени. Пропущенная цена заполняется последней
+    известной (до первой свечи - первой ценой), пропущенный объем - нулем.
+    Возвращает (grid, closes, volumes) с матрицами (инструменты x время).
+    """
+    if not series:
+        return np.empty(0, dtype=np.int64), np.empty((0, 0)), np.empty((0, 0), dtype=np.int64)
+    grid = np.unique(np.concatenate([np.asarray(times, dtype=np.int64) for times, _, _ in series]))
+    closes = np.full((len(series), len(grid)), np.nan)
+    volumes = np.zeros((len(series), len(grid)), dtype=np.int64)
+    for row, (times, row_closes, row_volumes) in enumerate(series):
+        columns = np.searchsorted(grid, np.asarray(times, dtype=np.int64))
+        closes[row, columns] = row_closes
+        volumes[row, columns] = row_volumes
+    observed = ~np.isnan(closes)
+    last_seen = np.maximum.accumulate(np.where(observed, np.arange(len(grid)), 0), axis=1)
+    first_seen = observed.argmax(axis=1)
+    rows = np.arange(len(series))[:, None]
+    closes = closes[rows, np.maximum(last_seen, first_seen[:, None])]
+    return grid, closes, volumes
+
+def compute_indicators_batch(closes, volumes, dtype=INDICATOR_DTYPE, keys=None, times=None, columns=None):
+    """Индикаторы для матрицы (инструменты x время) за один векторизованный проход.
+
+    Возвращает массив (инструменты x время x колонки), а если переданы keys
+    и times - DataFrame с MultiIndex (ticker, time).
+    """
+    columns = INDICATOR_COLUMNS if columns is None else list(columns)
+    values = compute_indicators(closes, volumes, dtype=dtype, columns=columns)
+    array = np.stack([np.asarray(values[column], dtype=dtype) for column in columns], axis=-1)
+    if keys is None:
+        return array
+    index = pd.MultiIndex.from_product([list(keys), list(times)], names=['ticker', 'time'])
+    return pd.DataFrame(array.reshape(-1, len(columns)), index=index, columns=columns)
@@ -0,0 +1,52 @@
+class IndicatorRegistry:
+    """Реестр индикаторов с объявленными зависимостями.
+
+    Каждый индикатор - функция от значений своих зависимостей. compute()
+    вычисляет только запрошенные индикаторы и то, от чего они зависят;
+    промежуточные результаты считаются один раз за вызов.
+    """
+
+    def __init__(self):
+        self.indicators = {}
+
+    def register(self, name, *depends):
+        def decorator(func):
+            self.indicators[name] = (func, depends)
+            return func
+        return decorator
+
+    def __contains__(self, name):
+        return name in self.indicators
+
+    def resolve(self, names, inputs=()):
+        order = []
+        visited = set(inputs)
+        visiting = set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Циклическая зависимость индикатора {name}")
+            if name not in self.indicators:
+                raise KeyError(f"Неизвестный индикатор {name}")
+            visiting.add(name)
+            for dependency in self.indicators[name][1]:
+                visit(dependency)
+            visiting.discard(name)
+            visited.add(name)
+            order.append(name)
+
+        for name in names:
+            visit(name)
+        return order
+
+    def compute(self, names, inputs):
+        values = dict(inputs)
+        for name in self.resolve(names, inputs):
+            func, depends = self.indicators[name]
+            values[name] = func(*[values[dependency] for dependency in depends])
+        return {name: values[name] for name in names}
+
+indicator_registry = IndicatorRegistry()
+indicator = indicator_registry.register
@@ -0,0 +1,141 @@
+import os
+import json
+import bisect
+import threading
+from datetime import datetime, timedelta
+from client_pool import get_client_pool
+
+INSTRUMENT_CATALOG_PATH = 'data/instruments.json'
+INSTRUMENT_CATALOG_REFRESH_HOURS = 6
+DEFAULT_CLASS_CODE = 'TQBR'
+
+class InstrumentCatalog:
+    """Справочник инструментов с индексами по тикеру, FIGI и режиму торгов.
+
+    Справочник хранится на диске и обновляется в фоновом потоке, поэтому
+    поиск тикера - это обращение к словарю, а не запрос к API.
+    """
+
+    def __init__(self, client_pool=None, path=INSTRUMENT_CATALOG_PATH, refresh_hours=INSTRUMENT_CATALOG_REFRESH_HOURS):
+        self.client_pool = client_pool
+        self.path = path
+        self.refresh_interval = timedelta(hours=refresh_hours)
+        self.lock = threading.Lock()
+        self.updated_at = None
+        self.by_ticker = {}
+        self.by_figi = {}
+        self.by_class_code = {}
+        self.sorted_tickers = {}
+        self._stop_event = threading.Event()
+        self._refresh_thread = None
+        self.load()
+
+    def _build_indexes(self, instruments):
+        by_ticker = {}
+        by_figi = {}
+        by_class_code = {}
+        for instrument in instruments:
+            by_ticker.setdefault(instrument['ticker'], {})[instrument['class_code']] = instrument
+            by_figi[instrument['figi']] = instrument
+            by_class_code.setdefault(instrument['class_code'], []).append(instrument)
+        sorted_tickers = {class_code: sorted(item['ticker'] for item in items) for class_code, items in by_class_code.items()}
+        with self.lock:
+            self.by_ticker = by_ticker
+            self.by_figi = by_figi
+            self.by_class_code = by_class_code
+            self.sorted_tickers = sorted_tickers
+
+    def is_loaded(self):
+        return bool(self.by_figi)
+
+    def is_stale(self):
+        return self.updated_at is None or datetime.now() - self.updated_at > self.refresh_interval
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self._build_indexes(data['instruments'])
+            self.updated_at = datetime.fromisoformat(data['updated_at'])
+            print(f"Справочник инструментов загружен с диска: {len(self.by_figi)} инструментов")
+            return True
+        except Exception as e:
+            print(f"Ошибка при чтении справочника инструментов: {e}")
+            return False
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        data = {'updated_at': self.updated_at.isoformat(), 'instruments': list(self.by_figi.values())}
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def refresh(self):
+        try:
+            with (self.client_pool or get_client_pool()).client() as client:
+                shares = client.instruments.shares().instruments
+            instruments = [{
+                'ticker': share.ticker,
+                'figi': share.figi,
+                'class_code': share.class_code,
+                'name': share.name,
+                'lot': share.lot,
+                'currency': share.currency
+            } for share in shares]
+        except Exception as e:
+            print(f"Ошибка при обновлении справочника инструментов: {e}")
+            return False
+        self._build_indexes(instruments)
+        self.updated_at = datetime.now()
+        self.save()
+        print(f"Справочник инструментов обновлен: {len(instruments)} инструментов")
+        return True
+
+    def resolve(self, ticker, class_code=DEFAULT_CLASS_CODE):
+        return self.by_ticker.get(ticker, {}).get(class_code)
+
+    def get_by_figi(self, figi):
+        return self.by_figi.get(figi)
+
+    def search(self, prefix, class_code=DEFAULT_CLASS_CODE, limit=10):
+        prefix = prefix.strip().upper()
+        tickers = self.sorted_tickers.get(class_code, [])
+        if not prefix:
+            return []
+        results = []
+        for ticker in tickers[bisect.bisect_left(tickers, prefix):]:
+            if not ticker.startswith(prefix) or len(results) >= limit:
+                break
+            results.append(self.by_ticker[ticker][class_code])
+        return results
+
+    def _refresh_loop(self):
+        while not self._stop_event.is_set():
+            if self.is_stale():
+                self.refresh()
+            self._stop_event.wait(60)
+
+    def start_background_refresh(self):
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._refresh_thread = threading.Thread(target=self._refresh_loop, name='instrument-catalog-refresh', daemon=True)
+        self._refresh_thread.start()
+
+    def stop_background_refresh(self):
+        self._stop_event.set()
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_instrument_catalog():
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = InstrumentCatalog()
+        return _catalog
@@ -0,0 +1,170 @@
+import os
+import math
+import time
+import asyncio
+import threading
+import functools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+
+JOB_EXECUTOR_KIND = os.getenv('PRISMTRADE_EXECUTOR', 'thread')
+JOB_EXECUTOR_WORKERS = int(os.getenv('PRISMTRADE_EXECUTOR_WORKERS', str(min(4, os.cpu_count() or 1))))
+JOB_QUEUE_LIMIT = int(os.getenv('PRISMTRADE_EXECUTOR_QUEUE', '16'))
+ENDPOINT_CONCURRENCY = {
+    'analyze': 8,
+    'auto_update': 8,
+    'live_update': 8,
+    'prediction_accuracy': 4,
+    'advanced_analytics': 1,
+    'screener': 2
+}
+DEFAULT_ENDPOINT_CONCURRENCY = 4
+JOB_TIMINGS_WINDOW = 200
+
+# pyplot хранит текущую фигуру глобально, поэтому графики из разных потоков строим по очереди
+plot_lock = threading.RLock()
+
+def synchronized_plot(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with plot_lock:
+            return func(*args, **kwargs)
+    return wrapper
+
+class JobRejected(Exception):
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f"Очередь задач {endpoint} переполнена")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+def init_process_worker():
+    # Воркер пула завершается без atexit: буферы прогнозов сбрасываем финализатором multiprocessing
+    from multiprocessing.util import Finalize
+    from prediction_store import flush_prediction_stores
+    Finalize(None, flush_prediction_stores, exitpriority=10)
+
+def timed_call(func, args):
+    started = time.time()
+    result = func(*args)
+    return started, time.time(), result
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+class JobExecutor:
+    """Выполнение тяжелых этапов запросов вне цикла событий.
+
+    Задачи уходят в пул потоков или процессов (PRISMTRADE_EXECUTOR). Число
+    задач в работе ограничено для каждого эндпоинта и суммарно (воркеры
+    плюс очередь); при переполнении run() бросает JobRejected со временем,
+    через которое стоит повторить запрос.
+
+    Режим process обходит GIL, но у каждого воркера свои копии кэшей
+    (модели, ARIMA, LSTM, контексты анализа, индикаторы): они прогреваются
+    в каждом воркере отдельно и занимают память N раз, а /health показывает
+    только кэши родительского процесса. Хранилища свечей и прогнозов
+    пишутся под межпроцессной блокировкой (file_lock), буферы прогнозов
+    воркера сбрасываются при его завершении.
+    """
+
+    def __init__(self, kind=JOB_EXECUTOR_KIND, workers=JOB_EXECUTOR_WORKERS, queue_limit=JOB_QUEUE_LIMIT, limits=ENDPOINT_CONCURRENCY):
+        self.kind = kind
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.limits = dict(limits)
+        if kind == 'process':
+            # spawn, а не fork: в родительском процессе уже работают потоки и gRPC-каналы
+            self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'), initializer=init_process_worker)
+        else:
+            self.executor = ThreadPoolExecutor(workers, thread_name_prefix='analysis')
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.completed = {}
+        self.failed = {}
+        self.rejected = {}
+        self.wait_times = {}
+        self.run_times = {}
+
+    def _retry_after(self, endpoint):
+        run_times = self.run_times.get(endpoint)
+        expected = np.mean(run_times) if run_times else 1.0
+        backlog = max(1, sum(self.in_flight.values()) - self.workers + 1)
+        return int(min(60, max(1, math.ceil(expected * backlog / self.workers))))
+
+    def _admit(self, endpoint):
+        with self.lock:
+            limit = self.limits.get(endpoint, DEFAULT_ENDPOINT_CONCURRENCY)
+            if self.in_flight.get(endpoint, 0) >= limit or sum(self.in_flight.values()) >= self.workers + self.queue_limit:
+                self.rejected[endpoint] = self.rejected.get(endpoint, 0) + 1
+                raise JobRejected(endpoint, self._retry_after(endpoint))
+            self.in_flight[endpoint] = self.in_flight.get(endpoint, 0) + 1
+
+    async def run(self, endpoint, func, *args):
+        self._admit(endpoint)
+        submitted = time.time()
+        loop = asyncio.get_running_loop()
+        try:
+            started, finished, result = await loop.run_in_executor(self.executor, timed_call, func, args)
+        except Exception:
+            with self.lock:
+                self.failed[endpoint] = self.failed.get(endpoint, 0) + 1
+            raise
+        finally:
+            with self.lock:
+                self.in_flight[endpoint] -= 1
+        with self.lock:
+            self.completed[endpoint] = self.completed.get(endpoint, 0) + 1
+            self.wait_times.setdefault(endpoint, deque(maxlen=JOB_TIMINGS_WINDOW)).append(max(0.0, started - submitted))
+            self.run_times.setdefault(endpoint, deque(maxlen=JOB_TIMINGS_WINDOW)).append(finished - started)
+        return result
+
+    def stats(self):
+        with self.lock:
+            in_flight = sum(self.in_flight.values())
+            endpoints = {}
+            for endpoint in set(self.in_flight) | set(self.rejected):
+                wait_times = list(self.wait_times.get(endpoint, []))
+                run_times = list(self.run_times.get(endpoint, []))
+                endpoints[endpoint] = {
+                    'in_flight': self.in_flight.get(endpoint, 0),
+                    'limit': self.limits.get(endpoint, DEFAULT_ENDPOINT_CONCURRENCY),
+                    'completed': self.completed.get(endpoint, 0),
+                    'failed': self.failed.get(endpoint, 0),
+                    'rejected': self.rejected.get(endpoint, 0),
+                    'wait_p50_ms': percentile(wait_times, 50) * 1000,
+                    'wait_p99_ms': percentile(wait_times, 99) * 1000,
+                    'run_p50_ms': percentile(run_times, 50) * 1000,
+                    'run_p99_ms': percentile(run_times, 99) * 1000
+                }
+        return {
+            'kind': self.kind,
+            'workers': self.workers,
+            'in_flight': in_flight,
+            'queue_depth': max(0, in_flight - self.workers),
+            'queue_limit': self.queue_limit,
+            # В режиме process кэши в /health - только родительского процесса
+            'shared_caches': self.kind != 'process',
+            'endpoints': endpoints
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_job_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = JobExecutor()
+        return _executor
+
+def shutdown_job_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
@@ -0,0 +1,114 @@
+import os
+import json
+import asyncio
+
+LIVE_POLL_SECONDS = float(os.getenv('PRISMTRADE_LIVE_POLL', '5'))
+LIVE_HEARTBEAT_SECONDS = 15
+LIVE_QUEUE_SIZE = 16
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=float)}\n\n"
+
+def diff_update(previous, current):
+    """Поля, изменившиеся с прошлой рассылки; тикер передается всегда."""
+    if previous is None:
+        return dict(current)
+    delta = {key: value for key, value in current.items() if previous.get(key) != value}
+    delta['ticker'] = current['ticker']
+    return delta
+
+class LiveUpdateHub:
+    """Рассылка обновлений подписчикам одного тикера (Server-Sent Events).
+
+    На каждый тикер с подписчиками работает одна задача: при смене номера
+    свечи (clock) она один раз вызывает compute и рассылает всем очередям
+    только изменившиеся поля. Ошибка или отказ (503, с учетом Retry-After)
+    не засчитывают свечу - расчет повторяется на следующем опросе. Стоимость на сервере зависит от числа разных
+    тикеров, а не от числа клиентов. Последний отписавшийся останавливает
+    задачу. Работает в цикле событий, поэтому блокировки не нужны.
+    """
+
+    def __init__(self, compute, clock, poll_seconds=LIVE_POLL_SECONDS, queue_size=LIVE_QUEUE_SIZE):
+        self.compute = compute
+        self.clock = clock
+        self.poll_seconds = poll_seconds
+        self.queue_size = queue_size
+        self.subscribers = {}
+        self.producers = {}
+        self.last_results = {}
+        self.counters = {'computed': 0, 'published': 0, 'dropped': 0}
+
+    def subscribe(self, ticker):
+        queue = asyncio.Queue(self.queue_size)
+        self.subscribers.setdefault(ticker, set()).add(queue)
+        if ticker in self.producers:
+            last = self.last_results.get(ticker)
+            if last is not None:
+                queue.put_nowait(('snapshot', last))
+        else:
+            self.producers[ticker] = asyncio.ensure_future(self._produce(ticker))
+        return queue
+
+    def unsubscribe(self, ticker, queue):
+        queues = self.subscribers.get(ticker)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.subscribers[ticker]
+            self.last_results.pop(ticker, None)
+            producer = self.producers.pop(ticker, None)
+            if producer is not None:
+                producer.cancel()
+
+    def _publish(self, ticker, event, data):
+        for queue in self.subscribers.get(ticker, ()):
+            if queue.full():
+                # Медленный клиент теряет самые старые события, а не тормозит остальных
+                queue.get_nowait()
+                self.counters['dropped'] += 1
+            queue.put_nowait((event, data))
+            self.counters['published'] += 1
+
+    async def _produce(self, ticker):
+        candle = None
+        while True:
+            current = self.clock()
+            delay = self.poll_seconds
+            if current != candle:
+                try:
+                    result = await self.compute(ticker)
+                except Exception as e:
+                    result = {'error': str(e)}
+                self.counters['computed'] += 1
+                if not isinstance(result, dict):
+                    # Отказ исполнителя (503): ждем столько, сколько просит сервер, и считаем ту же свечу снова
+                    delay = max(delay, float(getattr(result, 'headers', {}).get('retry-after', 0)))
+                    self._publish(ticker, 'error', {'ticker': ticker, 'error': f"Сервер перегружен, повторим через {delay:.0f} с"})
+                elif 'error' in result:
+                    self._publish(ticker, 'error', dict(result, ticker=ticker))
+                else:
+                    # Свеча считается обработанной только после успешного расчета
+                    candle = current
+                    previous = self.last_results.get(ticker)
+                    self._publish(ticker, 'snapshot' if previous is None else 'update', diff_update(previous, result))
+                    self.last_results[ticker] = result
+            await asyncio.sleep(delay)
+
+    async def events(self, ticker, is_disconnected):
+        queue = self.subscribe(ticker)
+        try:
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), LIVE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_event(event, data)
+        finally:
+            self.unsubscribe(ticker, queue)
+
+    def stats(self):
+        return dict(self.counters, tickers=len(self.producers), subscribers=sum(len(queues) for queues in self.subscribers.values()))
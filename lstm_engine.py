@@ -0,0 +1,451 @@
+import os
+import sys
+import time
+import threading
+import joblib
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.special import expit
+from prediction_store import to_micros
+
+LSTM_MODELS_DIR = 'data/lstm_models'
+LSTM_MODELS_VERSION = 1
+LSTM_UNITS = 50
+LSTM_DROPOUT = 0.2
+LSTM_MAX_TIME_STEPS = 60
+LSTM_EPOCHS = int(os.getenv('PRISMTRADE_LSTM_EPOCHS', '20'))
+LSTM_FINE_TUNE_EPOCHS = int(os.getenv('PRISMTRADE_LSTM_FINE_TUNE_EPOCHS', '3'))
+LSTM_BATCH_SIZE = 32
+LSTM_PATIENCE = 3
+LSTM_VALIDATION_FRACTION = 0.1
+LSTM_MIN_NEW_WINDOWS = int(os.getenv('PRISMTRADE_LSTM_MIN_NEW_WINDOWS', '5'))
+LSTM_MAX_FINE_TUNES = int(os.getenv('PRISMTRADE_LSTM_MAX_FINE_TUNES', '50'))
+LSTM_SCALE_MARGIN = 0.25
+# request - обучение в запросе (TensorFlow загружается, только когда нужно обучать), offline - только python lstm_engine.py train
+LSTM_TRAINING = os.getenv('PRISMTRADE_LSTM_TRAINING', 'request')
+
+class InsufficientHistory(ValueError):
+    """Цен меньше, чем длина окна обученной модели."""
+
+def compiled_step(model):
+    """Один шаг прогноза: прямой вызов модели в tf.function вместо model.predict.
+
+    predict на каждом шаге заново собирает датасет и цикл обратных вызовов;
+    скомпилированный вызов трассируется один раз на форму входа.
+    """
+    import tensorflow as tf
+    call = tf.function(lambda batch: model(batch, training=False), reduce_retracing=True)
+    return lambda batch: call(tf.convert_to_tensor(batch, dtype=tf.float32)).numpy()
+
+def rollout(step, sequences, steps):
+    """Авторегрессионный прогноз на steps шагов вперед для пачки последовательностей.
+
+    sequences - массив (пачка, time_steps) в масштабе модели, step принимает
+    (пачка, time_steps, 1) и возвращает (пачка, 1). Окна берутся срезами из
+    одного буфера, куда дописывается каждый прогноз. Возвращает (пачка, steps);
+    любой горизонт до steps - префикс этой траектории.
+    """
+    sequences = np.atleast_2d(np.asarray(sequences, dtype=np.float64))
+    batch, time_steps = sequences.shape
+    buffer = np.empty((batch, time_steps + steps), dtype=np.float64)
+    buffer[:, :time_steps] = sequences
+    for i in range(steps):
+        buffer[:, time_steps + i] = step(buffer[:, i:i + time_steps, np.newaxis])[:, 0]
+    return buffer[:, time_steps:]
+
+def training_windows(scaled, time_steps, start=0):
+    """Обучающие окна без копирования: X[k] = scaled[k:k + time_steps], y[k] = scaled[k + time_steps].
+
+    start - индекс в scaled первой цели, которая нужна; более ранние окна пропускаются.
+    """
+    windows = sliding_window_view(scaled, time_steps + 1)[max(0, start - time_steps):]
+    return windows[:, :time_steps, np.newaxis], windows[:, time_steps]
+
+def build_model(time_steps):
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import Input, LSTM, Dense, Dropout
+    model = Sequential([
+        Input(shape=(time_steps, 1)),
+        LSTM(units=LSTM_UNITS, return_sequences=True),
+        Dropout(LSTM_DROPOUT),
+        LSTM(units=LSTM_UNITS, return_sequences=False),
+        Dropout(LSTM_DROPOUT),
+        Dense(units=1)
+    ])
+    model.compile(optimizer='adam', loss='mean_squared_error')
+    return model
+
+def fit_windows(model, X, y, epochs, batch_size=LSTM_BATCH_SIZE):
+    """Обучение через tf.data с ранней остановкой; возвращает число эпох.
+
+    Число эпох подбирается по последним окнам (валидация), после чего модель
+    возвращается к исходным весам и обучается это число эпох на всех окнах,
+    чтобы самые свежие цены тоже попали в обучение.
+    """
+    import tensorflow as tf
+    validation = int(len(X) * LSTM_VALIDATION_FRACTION)
+    if validation < 2:
+        validation = 0
+    def dataset(X_part, y_part, shuffle):
+        data = tf.data.Dataset.from_tensor_slices((X_part.astype(np.float32), y_part.astype(np.float32)))
+        if shuffle:
+            data = data.shuffle(len(X_part))
+        return data.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+    if not validation:
+        stopping = tf.keras.callbacks.EarlyStopping(monitor='loss', patience=LSTM_PATIENCE, restore_best_weights=True)
+        history = model.fit(dataset(X, y, True), epochs=epochs, callbacks=[stopping], verbose=0)
+        return len(history.history['loss'])
+    initial_weights = model.get_weights()
+    stopping = tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=LSTM_PATIENCE)
+    history = model.fit(dataset(X[:-validation], y[:-validation], True), validation_data=dataset(X[-validation:], y[-validation:], False),
+                        epochs=epochs, callbacks=[stopping], verbose=0)
+    best_epochs = int(np.argmin(history.history['val_loss'])) + 1
+    model.set_weights(initial_weights)
+    model.compile(optimizer='adam', loss='mean_squared_error')
+    model.fit(dataset(X, y, True), epochs=best_epochs, verbose=0)
+    return best_epochs
+
+class NumpyLSTM:
+    """Прямой проход обученной LSTM (2 слоя LSTM и Dense) на NumPy, без TensorFlow.
+
+    Веса экспортируются из Keras в .npz; порядок ворот как в Keras: i, f, c, o,
+    сигмоида на воротах, tanh на состоянии, Dropout при выводе не действует.
+    Матричные умножения пишут в заранее выделенные буферы под размер пачки,
+    поэтому один экземпляр нельзя вызывать из нескольких потоков одновременно.
+    """
+
+    def __init__(self, layers, dense_kernel, dense_bias, model_version=0):
+        self.layers = [tuple(np.ascontiguousarray(w, dtype=np.float32) for w in layer) for layer in layers]
+        self.dense_kernel = np.ascontiguousarray(dense_kernel, dtype=np.float32)
+        self.dense_bias = np.ascontiguousarray(dense_bias, dtype=np.float32)
+        self.model_version = model_version
+        self.buffers = {}
+
+    @classmethod
+    def from_keras(cls, model, model_version=0):
+        from tensorflow.keras.layers import LSTM, Dense
+        layers = [layer.get_weights() for layer in model.layers if isinstance(layer, LSTM)]
+        dense_kernel, dense_bias = [layer for layer in model.layers if isinstance(layer, Dense)][-1].get_weights()
+        return cls(layers, dense_kernel, dense_bias, model_version)
+
+    def save(self, path):
+        arrays = {'model_version': np.int64(self.model_version), 'dense_kernel': self.dense_kernel, 'dense_bias': self.dense_bias}
+        for index, (kernel, recurrent, bias) in enumerate(self.layers):
+            arrays[f'lstm{index}_kernel'] = kernel
+            arrays[f'lstm{index}_recurrent'] = recurrent
+            arrays[f'lstm{index}_bias'] = bias
+        temporary = path + '.tmp.npz'
+        np.savez(temporary, **arrays)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            count = sum(1 for name in data.files if name.endswith('_recurrent'))
+            layers = [(data[f'lstm{i}_kernel'], data[f'lstm{i}_recurrent'], data[f'lstm{i}_bias']) for i in range(count)]
+            return cls(layers, data['dense_kernel'], data['dense_bias'], int(data['model_version']))
+
+    def _buffers(self, batch, time_steps):
+        key = (batch, time_steps)
+        if key not in self.buffers:
+            units = [recurrent.shape[0] for _, recurrent, _ in self.layers]
+            self.buffers[key] = {
+                'inputs': [np.empty((batch, time_steps, 4 * u), dtype=np.float32) for u in units],
+                'sequence': [np.empty((batch, time_steps, u), dtype=np.float32) for u in units],
+                'recurrent': [np.empty((batch, 4 * u), dtype=np.float32) for u in units],
+                'c': [np.empty((batch, u), dtype=np.float32) for u in units],
+                'temp': [np.empty((batch, u), dtype=np.float32) for u in units],
+                'output': np.empty((batch, self.dense_kernel.shape[1]), dtype=np.float32)
+            }
+        return self.buffers[key]
+
+    def _cell(self, gates, h, c, temp):
+        units = h.shape[1]
+        np.tanh(gates[:, 2 * units:3 * units], out=gates[:, 2 * units:3 * units])
+        expit(gates[:, :2 * units], out=gates[:, :2 * units])
+        expit(gates[:, 3 * units:], out=gates[:, 3 * units:])
+        c *= gates[:, units:2 * units]
+        np.multiply(gates[:, :units], gates[:, 2 * units:3 * units], out=temp)
+        c += temp
+        np.tanh(c, out=temp)
+        np.multiply(gates[:, 3 * units:], temp, out=h)
+
+    def __call__(self, batch):
+        """batch - (пачка, time_steps, 1) в масштабе скейлера; возвращает (пачка, 1)."""
+        batch = np.asarray(batch, dtype=np.float32)
+        size, time_steps = batch.shape[0], batch.shape[1]
+        buffers = self._buffers(size, time_steps)
+        sequence = batch
+        # Слои считаются по очереди: проекция входа на все шаги - одно умножение, в цикле только рекуррентная часть
+        for index, (kernel, recurrent, bias) in enumerate(self.layers):
+            inputs = buffers['inputs'][index]
+            np.dot(sequence.reshape(size * time_steps, -1), kernel, out=inputs.reshape(size * time_steps, -1))
+            inputs += bias
+            outputs, c, temp, recurrent_part = buffers['sequence'][index], buffers['c'][index], buffers['temp'][index], buffers['recurrent'][index]
+            c.fill(0)
+            for t in range(time_steps):
+                gates = inputs[:, t]
+                if t > 0:
+                    np.dot(outputs[:, t - 1], recurrent, out=recurrent_part)
+                    gates += recurrent_part
+                self._cell(gates, outputs[:, t], c, temp)
+            sequence = outputs
+        output = buffers['output']
+        np.dot(sequence[:, -1], self.dense_kernel, out=output)
+        output += self.dense_bias
+        return output.copy()
+
+class LSTMRegistry:
+    """Обученные LSTM по тикерам: веса и MinMaxScaler переживают перезапуск.
+
+    На диске в LSTM_MODELS_DIR: <тикер>.joblib (скейлер, время последней
+    свечи в обучении, версия модели), <тикер>.npz (веса для NumpyLSTM) и
+    <тикер>.weights.h5 (веса Keras для дообучения). Прогноз всегда считает
+    NumpyLSTM, TensorFlow загружается только для обучения. Первый запрос
+    обучает модель с нуля (LSTM_EPOCHS), следующие дообучают ее
+    LSTM_FINE_TUNE_EPOCHS эпох только на окнах с новыми свечами, когда их
+    набралось LSTM_MIN_NEW_WINDOWS. Модель обучается заново, если дообучений
+    было LSTM_MAX_FINE_TUNES, цены ушли за диапазон скейлера больше чем на
+    LSTM_SCALE_MARGIN или поменялась длина окна. При train=False (режим
+    offline) модели только читаются; файлы, обновленные отдельным процессом
+    обучения, подхватываются по времени изменения.
+    """
+
+    def __init__(self, base_dir=LSTM_MODELS_DIR):
+        self.base_dir = base_dir
+        self.entries = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'loads': 0, 'trains': 0, 'fine_tunes': 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def _entry_lock(self, ticker):
+        with self.lock:
+            return self.locks.setdefault(ticker, threading.Lock())
+
+    def _path(self, ticker, suffix):
+        return os.path.join(self.base_dir, f'{ticker}{suffix}')
+
+    def _load(self, ticker):
+        path = self._path(ticker, '.joblib')
+        try:
+            mtime = os.path.getmtime(path)
+            entry = joblib.load(path)
+            if entry.get('version') != LSTM_MODELS_VERSION:
+                return None
+            entry['runtime'] = NumpyLSTM.load(self._path(ticker, '.npz'))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Не удалось загрузить LSTM модель {ticker}: {e}")
+            return None
+        if entry['runtime'].model_version != entry['model_version']:
+            # Процесс обучения еще не дописал метаданные
+            return None
+        entry['mtime'] = mtime
+        entry['last_training'] = None
+        self._count('loads')
+        return entry
+
+    def _current(self, ticker):
+        entry = self.entries.get(ticker)
+        try:
+            mtime = os.path.getmtime(self._path(ticker, '.joblib'))
+        except OSError:
+            return entry
+        if entry is None or entry.get('mtime') != mtime:
+            return self._load(ticker) or entry
+        return entry
+
+    def _save(self, ticker, entry):
+        if not os.path.exists(self.base_dir):
+            os.makedirs(self.base_dir)
+        weights = self._path(ticker, '.weights.h5')
+        entry['model'].save_weights(weights + '.tmp.weights.h5')
+        os.replace(weights + '.tmp.weights.h5', weights)
+        entry['runtime'].save(self._path(ticker, '.npz'))
+        meta = {key: value for key, value in entry.items() if key not in ('model', 'runtime', 'mtime', 'last_training')}
+        joblib.dump(meta, self._path(ticker, '.joblib.tmp'))
+        os.replace(self._path(ticker, '.joblib.tmp'), self._path(ticker, '.joblib'))
+        entry['mtime'] = os.path.getmtime(self._path(ticker, '.joblib'))
+
+    def _keras_model(self, ticker, entry):
+        if 'model' not in entry:
+            entry['model'] = build_model(entry['time_steps'])
+            entry['model'].load_weights(self._path(ticker, '.weights.h5'))
+        return entry['model']
+
+    def _out_of_range(self, entry, prices):
+        low, high = entry['scaler'].data_min_[0], entry['scaler'].data_max_[0]
+        margin = (high - low) * LSTM_SCALE_MARGIN
+        return prices.min() < low - margin or prices.max() > high + margin
+
+    def _train(self, prices, times, time_steps):
+        from sklearn.preprocessing import MinMaxScaler
+        scaler = MinMaxScaler(feature_range=(0, 1))
+        scaled = scaler.fit_transform(prices.reshape(-1, 1))[:, 0]
+        model = build_model(time_steps)
+        X, y = training_windows(scaled, time_steps)
+        epochs = fit_windows(model, X, y, LSTM_EPOCHS)
+        self._count('trains')
+        return {
+            'version': LSTM_MODELS_VERSION,
+            'model_version': 1,
+            'fine_tunes': 0,
+            'time_steps': time_steps,
+            'scaler': scaler,
+            'trained_until': None if times is None else to_micros(times[-1]),
+            'trained_at': time.time(),
+            'samples': len(X),
+            'last_training': {'kind': 'full', 'samples': len(X), 'epochs': epochs},
+            'model': model,
+            'runtime': NumpyLSTM.from_keras(model, 1)
+        }
+
+    def _fine_tune(self, ticker, entry, prices, micros, start):
+        model = self._keras_model(ticker, entry)
+        scaled = entry['scaler'].transform(prices.reshape(-1, 1))[:, 0]
+        X, y = training_windows(scaled, entry['time_steps'], start)
+        epochs = fit_windows(model, X, y, LSTM_FINE_TUNE_EPOCHS)
+        model_version = entry['model_version'] + 1
+        entry.update(model_version=model_version, fine_tunes=entry['fine_tunes'] + 1,
+                     trained_until=int(micros[-1]), trained_at=time.time(), samples=entry['samples'] + len(X),
+                     last_training={'kind': 'fine_tune', 'samples': len(X), 'epochs': epochs},
+                     runtime=NumpyLSTM.from_keras(model, model_version))
+        self._count('fine_tunes')
+
+    def forecast(self, ticker, prices, times, steps, train=None):
+        """Траектория модели на steps шагов (float32, масштаб скейлера), скейлер и сведения о модели.
+
+        times - время свечей prices; без них модель (при train) обучается с нуля
+        и не сохраняется. train=None - по LSTM_TRAINING. Если обучать нельзя,
+        а модели нет, - LookupError; если цен меньше окна модели - InsufficientHistory.
+        """
+        if train is None:
+            train = LSTM_TRAINING == 'request'
+        prices = np.asarray(prices, dtype=np.float64)
+        time_steps = min(LSTM_MAX_TIME_STEPS, len(prices) - 1)
+        if times is None and train:
+            entry = self._train(prices, None, time_steps)
+            return self._rollout(entry, prices, steps, None)
+        micros = None if times is None else np.array([to_micros(t) for t in times], dtype=np.int64)
+        with self._entry_lock(ticker):
+            entry = self._current(ticker)
+            if entry is not None:
+                entry['last_training'] = None
+            if not train:
+                if entry is None:
+                    raise LookupError(f"LSTM модель для {ticker} еще не обучена")
+                if len(prices) < entry['time_steps']:
+                    raise InsufficientHistory(f"Недостаточно данных для LSTM модели {ticker}: нужно {entry['time_steps']} точек, получено {len(prices)}")
+                self._count('hits')
+            elif (entry is None or entry['time_steps'] != time_steps or entry['fine_tunes'] >= LSTM_MAX_FINE_TUNES
+                    or self._out_of_range(entry, prices)):
+                entry = self._train(prices, times, time_steps)
+                self._save(ticker, entry)
+            else:
+                # Свечи после trained_until модель еще не видела
+                start = int(np.searchsorted(micros, entry['trained_until'], side='right'))
+                if len(prices) - max(start, time_steps) >= LSTM_MIN_NEW_WINDOWS:
+                    self._fine_tune(ticker, entry, prices, micros, start)
+                    self._save(ticker, entry)
+                else:
+                    self._count('hits')
+            self.entries[ticker] = entry
+            pending = None if micros is None else len(micros) - int(np.searchsorted(micros, entry['trained_until'], side='right'))
+            return self._rollout(entry, prices, steps, pending)
+
+    def _rollout(self, entry, prices, steps, pending):
+        scaled = entry['scaler'].transform(prices[-entry['time_steps']:].reshape(-1, 1))[:, 0]
+        trajectory = rollout(entry['runtime'], scaled, steps)[0].astype(np.float32)
+        info = {
+            'time_steps': entry['time_steps'],
+            'model_version': entry['model_version'],
+            'fine_tunes': entry['fine_tunes'],
+            'samples': entry['samples'],
+            'trained_at': entry['trained_at'],
+            'pending_candles': pending,
+            'training': entry['last_training'],
+            'runtime': 'numpy'
+        }
+        return trajectory, entry['scaler'], info
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, tickers=len(self.entries))
+
+_lstm_registry = None
+_lstm_registry_lock = threading.Lock()
+
+def get_lstm_registry():
+    global _lstm_registry
+    with _lstm_registry_lock:
+        if _lstm_registry is None:
+            _lstm_registry = LSTMRegistry()
+        return _lstm_registry
+
+def random_runtime(time_steps=LSTM_MAX_TIME_STEPS, seed=0):
+    """NumpyLSTM со случайными весами формы рабочей модели - для замеров без обученной модели."""
+    rng = np.random.RandomState(seed)
+    layers = [(rng.normal(scale=0.1, size=(inputs, 4 * LSTM_UNITS)), rng.normal(scale=0.1, size=(LSTM_UNITS, 4 * LSTM_UNITS)), np.zeros(4 * LSTM_UNITS))
+              for inputs in (1, LSTM_UNITS)]
+    return NumpyLSTM(layers, rng.normal(scale=0.1, size=(LSTM_UNITS, 1)), np.zeros(1))
+
+def step_latency(step, batch, repeats=200):
+    step(batch)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        step(batch)
+    return (time.perf_counter() - started) / repeats * 1000
+
+if __name__ == '__main__':
+    # python lstm_engine.py train [TICKER ...] - обучение/дообучение вне веб-процесса
+    # python lstm_engine.py check TICKER - сверка NumpyLSTM с Keras на сохраненной модели
+    # python lstm_engine.py benchmark [TICKER] - задержка одного шага прогноза
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    registry = get_lstm_registry()
+    if command == 'train':
+        from main import StockPredictor
+        from prediction_store import list_tickers
+        for ticker in sys.argv[2:] or list_tickers():
+            predictor = StockPredictor()
+            if not predictor.set_ticker(ticker):
+                print(f"{ticker}: тикер не найден")
+                continue
+            times, prices, _ = predictor.collect_data()
+            if len(prices) < 50:
+                print(f"{ticker}: недостаточно данных ({len(prices)} точек)")
+                continue
+            _, _, info = registry.forecast(ticker, prices, times, 1, train=True)
+            print(f"{ticker}: версия {info['model_version']}, обучение {info['training']}")
+    elif command == 'check' and len(sys.argv) > 2:
+        ticker = sys.argv[2]
+        entry = registry._load(ticker)
+        if entry is None:
+            print(f"{ticker}: модель не найдена")
+            sys.exit(1)
+        model = registry._keras_model(ticker, entry)
+        windows = np.random.RandomState(0).uniform(size=(256, entry['time_steps'], 1)).astype(np.float32)
+        expected = model(windows, training=False).numpy()
+        step_error = np.abs(entry['runtime'](windows) - expected).max()
+        start = windows[:8, :, 0]
+        rollout_error = np.abs(rollout(entry['runtime'], start, 60) - rollout(compiled_step(model), start, 60)).max()
+        print(f"{ticker}: расхождение шага {step_error:.2e}, траектории на 60 шагов {rollout_error:.2e}")
+        sys.exit(0 if step_error < 1e-4 else 1)
+    elif command == 'benchmark':
+        if len(sys.argv) > 2:
+            entry = registry._load(sys.argv[2])
+            runtime, time_steps = entry['runtime'], entry['time_steps']
+        else:
+            runtime, time_steps = random_runtime(), LSTM_MAX_TIME_STEPS
+        for size in (1, 8):
+            batch = np.random.RandomState(0).uniform(size=(size, time_steps, 1))
+            print(f"пачка {size}: NumPy {step_latency(runtime, batch):.3f} мс на шаг")
+            if len(sys.argv) > 2:
+                print(f"пачка {size}: tf.function {step_latency(compiled_step(registry._keras_model(sys.argv[2], entry)), batch):.3f} мс на шаг")
+    else:
+        print("Использование: python lstm_engine.py train [TICKER ...] | check TICKER | benchmark [TICKER]")
+        sys.exit(1)
@@ -1,24 +1,47 @@
 import os
+from dataclasses import replace
 from datetime import datetime, timedelta
 import numpy as np
 import matplotlib.pyplot as plt
-from tinkoff.invest import Client, RequestError, CandleInterval
+from tinkoff.invest import RequestError, CandleInterval
 import pytz
 from tinkoff.invest.utils import now
 import pandas as pd
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import StandardScaler
 import matplotlib
 matplotlib.use('Agg')
 import json
 from fastapi import FastAPI, Form, Request
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 import uvicorn
+from candle_store import get_candle_store
+from instrument_catalog import get_instrument_catalog
+from client_pool import APINotConfigured, init_client_pool, get_client_pool, close_client_pool
+from market_stream import get_market_streamer
+from indicator_engine import INDICATOR_BACKEND, get_indicator_engine, warmup_rows
+from indicator_kernels import INDICATOR_DTYPE, compute_indicators, align_candles, compute_indicators_batch
+from forecast_models import HorizonModels
+from model_cache import MODEL_CACHE_ENABLED, get_model_cache
+from job_executor import JobRejected, get_job_executor, shutdown_job_executor, synchronized_plot
+from single_flight import candle_bucket, get_single_flight
+from live_updates import LiveUpdateHub
+from prediction_store import PREDICTION_STORE_DIR, get_prediction_store, flush_prediction_stores
+from accuracy_metrics import get_metrics_accumulator
+from meta_learning_cache import get_meta_learning_cache
+from lstm_engine import get_lstm_registry
+from arima_engine import get_arima_cache
+from analysis_context import AnalysisContext, context_key, freeze, get_analysis_context, put_analysis_context
 
 ENSEMBLE_WEIGHTS_HIGH_VOL = [0.2, 0.3, 0.5]
 ENSEMBLE_WEIGHTS_LOW_VOL = [0.4, 0.3, 0.3]
+PREDICTION_HORIZONS = [interval.strip() for interval in os.getenv('PRISMTRADE_PREDICTION_HORIZONS', '15,30,60').split(',') if interval.strip()]
+PREDICTION_TRAINING_MODE = os.getenv('PRISMTRADE_TRAINING_MODE', 'per_horizon')
+PREDICTION_FEATURE_COLUMNS = ['rsi', 'macd', 'signal', 'volume', 'volume_sma', 'price_ma_5', 'price_ma_20', 'volatility', 'upper_band', 'lower_band', 'price_diff']
+PREDICTION_CHART_DIR = os.path.join('static', 'predictions')
+MARKET_STATE_COLUMNS = ['close', 'volume', 'rsi', 'macd', 'signal', 'volume_sma', 'price_ma_5', 'price_ma_20', 'price_ma_50', 'volatility', 'volatility_short']
+ANALYSIS_COLUMNS = list(dict.fromkeys(MARKET_STATE_COLUMNS + [column for column in PREDICTION_FEATURE_COLUMNS if column != 'price_diff']))
+ADVANCED_FEATURE_COLUMNS = ['rsi', 'macd', 'signal', 'price_ma_5', 'price_ma_20', 'volatility', 'momentum', 'roc_5', 'roc_10', 'stoch_k']
 
 app = FastAPI(title="PrismTrade")
 if not os.path.exists('templates'):
@@ -29,16 +52,23 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
 class StockPredictor:
-    def __init__(self, ticker=None):
-        self.token = os.getenv('TINKOFF_TOKEN')
-        if not self.token:
-            raise ValueError("TINKOFF_TOKEN не настроен. Пожалуйста, добавьте токен в Secrets (Tools -> Secrets)")
+    def __init__(self, ticker=None, client_pool=None):
+        self.client_pool = client_pool or get_client_pool()
         self.ticker = ticker
         self.figi = None
 
     def set_ticker(self, ticker):
+        catalog = get_instrument_catalog()
+        instrument = catalog.resolve(ticker)
+        if instrument is not None:
+            self.figi = instrument['figi']
+            self.ticker = ticker
+            return True
+        if catalog.is_loaded():
+            print(f"❌ Тикер {ticker} не найден")
+            return False
         try:
-            with Client(self.token) as client:
+            with self.client_pool.client() as client:
                 instruments = client.instruments.find_instrument(query=ticker)
                 for instrument in instruments.instruments:
                     if instrument.ticker == ticker and instrument.class_code == 'TQBR':
@@ -51,16 +81,20 @@ class StockPredictor:
             print(f"Ошибка при поиске тикера: {e}")
             return False
 
-    def get_recommendation(self, rsi, macd, signal, price_change, momentum, current_price):
+    def get_recommendation(self, context):
+        rsi = context.last_rsi
+        macd = context.last_macd
+        signal = context.last_signal
+        price_change = context.price_change
+        momentum = context.momentum
         score = 0
         reasons = []
-        has_market_state = hasattr(self, 'last_market_state')
-        market_state = getattr(self, 'last_market_state', {})
-        is_bullish = market_state.get('bullish', False) if has_market_state else False
-        is_bearish = market_state.get('bearish', False) if has_market_state else False
-        is_correction = market_state.get('correction', False) if has_market_state else False
-        is_pullback_opportunity = market_state.get('pullback_opportunity', False) if has_market_state else False
-        trend_strength = market_state.get('trend_strength', 50) if has_market_state else 50
+        market_state = context.market_state or {}
+        is_bullish = market_state.get('bullish', False)
+        is_bearish = market_state.get('bearish', False)
+        is_correction = market_state.get('correction', False)
+        is_pullback_opportunity = market_state.get('pullback_opportunity', False)
+        trend_strength = market_state.get('trend_strength', 50)
         if is_bullish:
             reasons.append(f"Установлен бычий тренд (сила: {trend_strength}%)")
         if is_bearish:
@@ -179,14 +213,14 @@ class StockPredictor:
             else:
                 score -= 1
                 reasons.append("Отрицательный моментум (слабый сигнал к продаже)")
-        if hasattr(self, 'ma5') and hasattr(self, 'ma20'):
-            if self.ma5 > self.ma20:
-                ma_diff = (self.ma5 / self.ma20 - 1) * 100
+        if context.ma5 is not None and context.ma20 is not None:
+            if context.ma5 > context.ma20:
+                ma_diff = (context.ma5 / context.ma20 - 1) * 100
                 ma_score = min(3, 1 + ma_diff * 0.5)
                 score += ma_score
                 reasons.append(f"Восходящий тренд по MA (MA5 > MA20, расхождение: {ma_diff:.2f}%, сигнал к покупке)")
             else:
-                ma_diff = (self.ma20 / self.ma5 - 1) * 100
+                ma_diff = (context.ma20 / context.ma5 - 1) * 100
                 ma_score = min(2, 0.5 + ma_diff * 0.4)
                 if is_bullish and is_correction:
                     score -= ma_score * 0.3
@@ -204,7 +238,7 @@ class StockPredictor:
             elif is_bearish:
                 score -= 2
                 reasons.append(f"Очень сильный медвежий тренд (сила: {trend_strength}%)")
-        entry_exit_prices = self.calculate_entry_exit_prices(current_price, volatility=price_change)
+        entry_exit_prices = self.calculate_entry_exit_prices(context)
         context_coefficient = trend_strength / 100
         if is_bullish:
             trend_score_adjustment = 0.5 + (context_coefficient * 1.5)
@@ -223,14 +257,14 @@ class StockPredictor:
         else:
             return "ПРОДАВАТЬ (ШОРТ) - Сильный сигнал", reasons, entry_exit_prices
 
-    def calculate_entry_exit_prices(self, current_price, volatility):
-        has_market_state = hasattr(self, 'last_market_state')
-        market_state = getattr(self, 'last_market_state', {})
-        is_bullish = market_state.get('bullish', False) if has_market_state else False
-        is_bearish = market_state.get('bearish', False) if has_market_state else False
-        is_correction = market_state.get('correction', False) if has_market_state else False
-        is_pullback_opportunity = market_state.get('pullback_opportunity', False) if has_market_state else False
-        trend_strength = market_state.get('trend_strength', 50) if has_market_state else 50
+    def calculate_entry_exit_prices(self, context):
+        current_price = context.current_price
+        market_state = context.market_state or {}
+        is_bullish = market_state.get('bullish', False)
+        is_bearish = market_state.get('bearish', False)
+        is_correction = market_state.get('correction', False)
+        is_pullback_opportunity = market_state.get('pullback_opportunity', False)
+        trend_strength = market_state.get('trend_strength', 50)
         min_profit_pct_buy = 1.0
         min_profit_pct_sell = 0.5
         if is_bullish:
@@ -255,10 +289,10 @@ class StockPredictor:
             volatility_coefficient_sell = volatility_coefficient_sell + (trend_strength / 100 * 0.5)
         min_price_change_pct_buy = min_profit_pct_buy
         min_price_change_pct_sell = min_profit_pct_sell
-        if hasattr(self, 'last_volatility'):
-            real_volatility = self.last_volatility
+        if context.volatility is not None:
+            real_volatility = context.volatility
         else:
-            real_volatility = abs(volatility)
+            real_volatility = abs(context.price_change)
         if real_volatility < 0.8:
             target_price_change_pct_buy = max(min_price_change_pct_buy, 1.2)
             target_price_change_pct_sell = max(min_price_change_pct_sell, 1.5)
@@ -337,65 +371,102 @@ class StockPredictor:
         combined_momentum = (short_momentum * 0.7) + (long_momentum * 0.3)
         return combined_momentum
 
-    def collect_data(self, hours=24):
-        print("Получение данных из Тинькофф...")
-        moscow_tz = pytz.timezone('Europe/Moscow')
-        current_time = datetime.now(moscow_tz)
-        times = []
-        prices = []
-        volumes = []
+    def fetch_candles(self, from_, current_time):
+        store = get_candle_store(self.figi)
         try:
-            with Client(self.token) as client:
-                moscow_tz = pytz.timezone('Europe/Moscow')
-                current_time = datetime.now(moscow_tz)
-                from_ = current_time - timedelta(hours=hours)
-                to = current_time
+            last_stored = store.last_time()
+            fetch_from = from_
+            if last_stored is not None:
+                # Запрашиваем только свечи после последней сохраненной, включая ее саму - она могла еще формироваться
+                fetch_from = max(from_, datetime.fromtimestamp(last_stored, tz=pytz.utc))
+            with self.client_pool.client() as client:
                 candles = client.market_data.get_candles(
                     figi=self.figi,
-                    from_=from_,
-                    to=to,
+                    from_=fetch_from,
+                    to=current_time,
                     interval=CandleInterval.CANDLE_INTERVAL_5_MIN).candles
-                print(f"Получено {len(candles)} свечей за последние {hours} часов")
-                if not candles:
-                    print("Не удалось получить данные о свечах")
-                    return [], [], []
+            print(f"Получено {len(candles)} новых свечей (в локальном хранилище: {len(store)})")
+            if candles:
                 candles = sorted(candles, key=lambda x: x.time)
-                for candle in candles:
-                    moscow_time = candle.time.astimezone(moscow_tz)
-                    times.append(moscow_time)
-                    price = float(candle.close.units) + float(candle.close.nano) / 1e9
-                    prices.append(price)
-                    volumes.append(candle.volume)
-                if len(prices) < 20:
-                    print(f"Недостаточно данных для анализа. Получено точек: {len(prices)}, требуется минимум 20")
-                    print("Возможно, торги еще не начались или временно приостановлены")
-                    return [], [], []
-                if times:
-                    current_time = datetime.now(moscow_tz).replace(microsecond=0)
-                    last_candle_time = times[-1].replace(microsecond=0)
-                    print(f"Текущее время сервера: {current_time.strftime('%d.%m.%Y %H:%M')}")
-                    if last_candle_time > current_time:
-                        print(f"⚠️ Ошибка: Некорректное время данных (будущее время)")
-                        print(f"Последнее время свечи: {last_candle_time.strftime('%d.%m.%Y %H:%M')}")
-                        print(f"Текущее время: {current_time.strftime('%d.%m.%Y %H:%M')}")
-                        return [], [], []
-                    time_diff = current_time - last_candle_time
-                    print(f"\nПоследнее обновление данных: {last_candle_time.strftime('%d.%m.%Y %H:%M')}")
-                    if time_diff > timedelta(minutes=30):
-                        print(f"⚠️ Внимание: Данные устарели на {time_diff.seconds // 60} минут")
-                        return [], [], []
-                    else:
-                        print("✅ Данные актуальны")
-                    print(f"Последняя цена в API: {prices[-1]:.2f} ₽")
-                return times, prices, volumes
+                store.append(
+                    [int(candle.time.timestamp()) for candle in candles],
+                    [float(candle.close.units) + float(candle.close.nano) / 1e9 for candle in candles],
+                    [candle.volume for candle in candles])
         except RequestError as e:
             print(f"Ошибка при получении данных: {e}")
-            return [], [], []
+            return None
         except Exception as e:
             print(f"Непредвиденная ошибка при получении данных: {e}")
+            return None
+        return store.read(since=int(from_.timestamp()))
+
+    def collect_data(self, hours=24):
+        moscow_tz = pytz.timezone('Europe/Moscow')
+        streamer = get_market_streamer()
+        buffer = streamer.get_buffer(self.figi) if streamer is not None else None
+        clock = streamer.now if buffer is not None else datetime.now
+        current_time = clock(moscow_tz)
+        from_ = current_time - timedelta(hours=hours)
+        if buffer is not None and buffer.is_stale(current_time.timestamp()):
+            # Поток отстал или отключен: берем свечи из API, заодно дополняя буфер
+            print("Поток котировок отстал, получение данных из Тинькофф...")
+            candles = self.fetch_candles(from_, current_time)
+            if candles is None:
+                return [], [], []
+            buffer.extend(*candles)
+        elif buffer is not None:
+            print("Получение данных из потока котировок...")
+            candles = buffer.snapshot(since=int(from_.timestamp()))
+        else:
+            print("Получение данных из Тинькофф...")
+            candles = self.fetch_candles(from_, current_time)
+            if candles is None:
+                return [], [], []
+            if streamer is not None:
+                streamer.subscribe(self.figi)
+        stored_times, stored_prices, stored_volumes = candles
+        if len(stored_times) == 0:
+            print("Не удалось получить данные о свечах")
+            return [], [], []
+        times = [datetime.fromtimestamp(int(t), tz=moscow_tz) for t in stored_times]
+        prices = stored_prices.tolist()
+        volumes = stored_volumes.tolist()
+        print(f"Доступно {len(prices)} свечей за последние {hours} часов")
+        if len(prices) < 20:
+            print(f"Недостаточно данных для анализа. Получено точек: {len(prices)}, требуется минимум 20")
+            print("Возможно, торги еще не начались или временно приостановлены")
+            return [], [], []
+        current_time = clock(moscow_tz).replace(microsecond=0)
+        last_candle_time = times[-1].replace(microsecond=0)
+        print(f"Текущее время сервера: {current_time.strftime('%d.%m.%Y %H:%M')}")
+        if last_candle_time > current_time:
+            print(f"⚠️ Ошибка: Некорректное время данных (будущее время)")
+            print(f"Последнее время свечи: {last_candle_time.strftime('%d.%m.%Y %H:%M')}")
+            print(f"Текущее время: {current_time.strftime('%d.%m.%Y %H:%M')}")
             return [], [], []
+        time_diff = current_time - last_candle_time
+        print(f"\nПоследнее обновление данных: {last_candle_time.strftime('%d.%m.%Y %H:%M')}")
+        if time_diff > timedelta(minutes=30):
+            print(f"⚠️ Внимание: Данные устарели на {time_diff.seconds // 60} минут")
+            return [], [], []
+        else:
+            print("✅ Данные актуальны")
+        print(f"Последняя цена в API: {prices[-1]:.2f} ₽")
+        return times, prices, volumes
+
+    def calculate_technical_indicators(self, prices, volumes, times=None, backend=None, columns=None):
+        backend = backend or INDICATOR_BACKEND
+        if backend == 'numpy':
+            return pd.DataFrame(compute_indicators(prices, volumes, dtype=INDICATOR_DTYPE, columns=columns))
+        if backend == 'incremental' and times is not None and self.figi:
+            engine = get_indicator_engine(self.figi)
+            engine.sync([int(t.timestamp()) for t in times], prices, volumes)
+            df = engine.frame(last=len(prices))
+        else:
+            df = self._calculate_technical_indicators_pandas(prices, volumes)
+        return df if columns is None else df[list(columns)]
 
-    def calculate_technical_indicators(self, prices, volumes):
+    def _calculate_technical_indicators_pandas(self, prices, volumes):
         df = pd.DataFrame({'close': prices})
         df['volume'] = volumes
         delta = df['close'].diff()
@@ -630,29 +701,55 @@ class StockPredictor:
                     market_state['explanation'].append("Снижение волатильности: возможная консолидация перед новым движением")
         return market_state
 
-    def predict_multiple_intervals(self, times, prices, volumes):
+    def build_analysis_context(self, times, prices, volumes):
+        key = context_key(self.figi, times, prices)
+        context = get_analysis_context(key)
+        if context is not None:
+            return context
+        indicators = self.calculate_technical_indicators(prices, volumes, times, columns=ANALYSIS_COLUMNS)
+        predictions, ma5, ma20, volatility, market_state = self.predict_multiple_intervals(times, prices, indicators)
+        context = AnalysisContext(
+            ticker=self.ticker,
+            figi=self.figi,
+            times=tuple(times),
+            prices=tuple(prices),
+            volumes=tuple(volumes),
+            indicators=indicators,
+            market_state=freeze(market_state),
+            predictions=freeze(predictions),
+            ma5=ma5,
+            ma20=ma20,
+            volatility=volatility,
+            price_change=((prices[-1] - prices[0]) / prices[0]) * 100,
+            momentum=self.calculate_momentum(prices))
+        recommendation, reasons, entry_exit_prices = self.get_recommendation(context)
+        context = replace(context, recommendation=recommendation, reasons=tuple(reasons), entry_exit_prices=freeze(entry_exit_prices))
+        return put_analysis_context(context)
+
+    def fit_horizon_models(self, X, y, windows, row_times=None, mode=None):
+        # Базовые прогнозы (LR, полиномиальная регрессия, бустинг) для каждого горизонта в свечах
+        mode = mode or PREDICTION_TRAINING_MODE
+        windows = [window for window in windows if len(X) > window]
+        if MODEL_CACHE_ENABLED and self.figi and row_times is not None:
+            return get_model_cache().base_predictions(self.figi, X, y, row_times, windows, mode)
+        models = HorizonModels(windows, mode).fit(X, y, row_times or list(range(len(X))))
+        return models.predict(X, y), models.scaler_y
+
+    def predict_multiple_intervals(self, times, prices, indicators, intervals=None):
         if len(prices) < 20:
             return None, None, None, None, None
-        df = self.calculate_technical_indicators(prices, volumes)
-        df['price_diff'] = df['close'].diff()
+        df = indicators.assign(price_diff=indicators['close'].diff())
         df = df.dropna()
         if len(df) < 20:
             return None, None, None, None, None
         market_state = self.analyze_market_state(df)
-        self.last_market_state = market_state
-        self.ma5 = df['price_ma_5'].iloc[-1]
-        self.ma20 = df['price_ma_20'].iloc[-1]
-        feature_columns = ['rsi', 'macd', 'signal', 'volume', 'volume_sma', 'price_ma_5', 'price_ma_20', 'volatility', 'upper_band', 'lower_band', 'price_diff']
-        available_features = [col for col in feature_columns if col in df.columns]
+        available_features = [col for col in PREDICTION_FEATURE_COLUMNS if col in df.columns]
         is_uptrend = df['price_ma_5'].iloc[-1] > df['price_ma_20'].iloc[-1]
         X = df[available_features].values
         y = df['close'].values
-        scaler_X = StandardScaler()
-        X_scaled = scaler_X.fit_transform(X)
-        scaler_y = StandardScaler()
-        y_scaled = scaler_y.fit_transform(y.reshape(-1, 1)).flatten()
+        row_times = [int(times[i].timestamp()) for i in df.index]
         predictions = {}
-        intervals = ["15", "30", "60"]
+        intervals = intervals or PREDICTION_HORIZONS
         trend_coefficient = 1.0
         if len(prices) > 10:
             weights_arr = np.exp(np.linspace(0, 1, 10))
@@ -665,28 +762,11 @@ class StockPredictor:
                 trend_coefficient = 0.8 - min(0.2, abs(weighted_trend) * 3)
         market_volatility = np.std(df['close'].pct_change().dropna()) * 100
         volatility_factor = min(1.5, max(0.5, 1 + market_volatility / 10))
+        base_predictions, scaler_y = self.fit_horizon_models(X, y, [int(int(interval) / 5) for interval in intervals], row_times)
         for interval in intervals:
             window = int(int(interval) / 5)
-            if len(X_scaled) > window:
-                X_train = X_scaled[:-window]
-                y_train = y_scaled[window:]
-                model_lr = LinearRegression()
-                model_lr.fit(X_train, y_train)
-                last_features = X_scaled[-1:]
-                pred_lr = model_lr.predict(last_features)[0]
-                from sklearn.preprocessing import PolynomialFeatures
-                from sklearn.pipeline import Pipeline
-                model_poly = Pipeline([('poly', PolynomialFeatures(degree=2)), ('linear', LinearRegression())])
-                recent_window = min(30, len(X_train))
-                model_poly.fit(X_train[-recent_window:], y_train[-recent_window:])
-                pred_poly = model_poly.predict(last_features)[0]
-                from sklearn.ensemble import GradientBoostingRegressor
-                model_gb = GradientBoostingRegressor(n_estimators=50, learning_rate=0.1, max_depth=3, random_state=42)
-                try:
-                    model_gb.fit(X_train, y_train)
-                    pred_gb = model_gb.predict(last_features)[0]
-                except Exception:
-                    pred_gb = pred_lr
+            if window in base_predictions:
+                pred_lr, pred_poly, pred_gb = base_predictions[window]
                 if market_volatility > 1.5:
                     weights = ENSEMBLE_WEIGHTS_HIGH_VOL
                 else:
@@ -709,24 +789,32 @@ class StockPredictor:
                 }
         return predictions, df['price_ma_5'].iloc[-1], df['price_ma_20'].iloc[-1], df['volatility'].iloc[-1], market_state
 
-    def plot_prediction(self, times, prices, predictions):
+    @synchronized_plot
+    def plot_prediction(self, context, predictions, name='prediction'):
+        # Свой файл на тикер и вид расчета: закэшированный ответ не покажет график другого тикера
+        chart_path = os.path.join(PREDICTION_CHART_DIR, f'{self.ticker}_{name}.png')
+        os.makedirs(PREDICTION_CHART_DIR, exist_ok=True)
+        times = context.times
+        prices = context.prices
         plt.figure(figsize=(15, 8))
         plt.style.use('seaborn-v0_8-darkgrid')
-        has_market_state = hasattr(self, 'last_market_state')
-        market_state = getattr(self, 'last_market_state', {})
-        is_bullish = market_state.get('bullish', False) if has_market_state else False
-        is_bearish = market_state.get('bearish', False) if has_market_state else False
-        is_correction = market_state.get('correction', False) if has_market_state else False
-        trend_strength = market_state.get('trend_strength', 50) if has_market_state else 50
+        market_state = context.market_state or {}
+        is_bullish = market_state.get('bullish', False)
+        is_bearish = market_state.get('bearish', False)
+        is_correction = market_state.get('correction', False)
+        trend_strength = market_state.get('trend_strength', 50)
         plt.plot(times, prices, color='#2E86C1', label='Исторические цены', linewidth=2)
-        if hasattr(self, 'ma5') and hasattr(self, 'ma20'):
-            ma5_values = [self.ma5] * len(times)
-            ma20_values = [self.ma20] * len(times)
+        if context.ma5 is not None and context.ma20 is not None:
+            ma5_values = [context.ma5] * len(times)
+            ma20_values = [context.ma20] * len(times)
             plt.plot(times, ma5_values, color='#F39C12', label='MA5', linewidth=1.5, linestyle='-', alpha=0.7)
             plt.plot(times, ma20_values, color='#8E44AD', label='MA20', linewidth=1.5, linestyle='-', alpha=0.7)
         colors = {'15': '#E74C3C', '30': '#2ECC71', '60': '#9B59B6'}
+        extra_colors = iter(plt.cm.tab10.colors)
         for interval, data in predictions.items():
             if isinstance(data, dict) and 'price' in data:
+                if interval not in colors:
+                    colors[interval] = next(extra_colors, '#7F8C8D')
                 n_points = int(int(interval) / 5)
                 future_times = [times[-1] + timedelta(minutes=5 * i) for i in range(1, n_points + 1)]
                 predicted_prices = [data['price']] * len(future_times)
@@ -780,66 +868,142 @@ class StockPredictor:
             last_time = times[-1]
             plt.scatter([last_time], [last_price], color='blue', s=100, zorder=6)
             plt.annotate(f'{last_price:.2f} ₽', xy=(last_time, last_price), xytext=(10, 0), textcoords='offset points', fontsize=10, fontweight='bold', bbox=dict(boxstyle="round,pad=0.2", facecolor='white', alpha=0.7))
-        if hasattr(self, 'last_recommendation'):
-            rec_text = self.last_recommendation.split(" - ")[0]
+        if context.recommendation:
+            rec_text = context.recommendation.split(" - ")[0]
             rec_color = "#2ECC71" if "ПОКУПАТЬ" in rec_text else "#E74C3C"
             plt.annotate(rec_text, xy=(0.98, 0.05), xycoords='axes fraction', fontsize=12, fontweight='bold', color=rec_color, ha='right', bbox=dict(boxstyle="round,pad=0.3", facecolor='white', alpha=0.9))
         legend = plt.legend(loc='upper left', frameon=True, fancybox=True, shadow=True)
         plt.xticks(rotation=45)
         plt.tight_layout()
-        plt.savefig('static/stock_prediction.png', dpi=300, bbox_inches='tight')
+        plt.savefig(chart_path, dpi=300, bbox_inches='tight')
         plt.close()
+        return '/' + chart_path.replace(os.sep, '/')
 
 import os
 import json
 from datetime import datetime, timedelta
 
-PREDICTION_HISTORY_DIR = 'data/predictions'
+PREDICTION_HISTORY_DIR = PREDICTION_STORE_DIR
 if not os.path.exists(PREDICTION_HISTORY_DIR):
     os.makedirs(PREDICTION_HISTORY_DIR)
 
+@app.on_event("startup")
+async def start_services():
+    get_job_executor()
+    try:
+        app.state.client_pool = init_client_pool()
+    except ValueError as e:
+        print(e)
+        return
+    get_instrument_catalog().start_background_refresh()
+    streamer = get_market_streamer()
+    if streamer is not None:
+        streamer.start()
+
+@app.on_event("shutdown")
+async def stop_services():
+    get_instrument_catalog().stop_background_refresh()
+    streamer = get_market_streamer()
+    if streamer is not None:
+        streamer.stop()
+    shutdown_job_executor()
+    flush_prediction_stores()
+    close_client_pool()
+
+@app.get("/health")
+async def health():
+    try:
+        pool_status = get_client_pool().stats()
+    except APINotConfigured as e:
+        pool_status = {'configured': False, 'error': str(e)}
+    status = {'client_pool': pool_status, 'executor': get_job_executor().stats(), 'single_flight': get_single_flight().stats()}
+    if MODEL_CACHE_ENABLED:
+        status['model_cache'] = get_model_cache().stats()
+    streamer = get_market_streamer()
+    if streamer is not None:
+        status['market_stream'] = streamer.stats()
+    status['live_updates'] = live_hub.stats()
+    status['meta_learning'] = get_meta_learning_cache().stats()
+    status['lstm_models'] = get_lstm_registry().stats()
+    status['arima_models'] = get_arima_cache().stats()
+    return status
+
+def current_candle():
+    streamer = get_market_streamer()
+    now = streamer.now() if streamer is not None else datetime.now(pytz.utc)
+    return candle_bucket(now.timestamp())
+
+def data_candle(ticker):
+    """Время последней свечи тикера в потоке котировок; без свежего потока - номер текущей свечи."""
+    streamer = get_market_streamer()
+    instrument = get_instrument_catalog().resolve(ticker) if streamer is not None else None
+    buffer = streamer.get_buffer(instrument['figi']) if instrument is not None else None
+    if buffer is not None and not buffer.is_stale(streamer.now().timestamp()):
+        return ('candle', buffer.last_time())
+    return ('bucket', current_candle())
+
+async def run_job(endpoint, func, *args, ticker=None):
+    # Одинаковые запросы по одним и тем же данным считаются один раз
+    key = (endpoint, args, data_candle(ticker) if ticker else current_candle())
+    try:
+        return await get_single_flight().run(
+            key,
+            lambda: get_job_executor().run(endpoint, func, *args),
+            cacheable=lambda result: isinstance(result, dict) and 'error' not in result)
+    except JobRejected as e:
+        return JSONResponse({"error": "Сервер перегружен, повторите запрос позже"}, status_code=503, headers={'Retry-After': str(e.retry_after)})
+    except APINotConfigured as e:
+        return {"error": str(e)}
+
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
+@app.get("/instruments/search")
+async def search_instruments(q: str = '', limit: int = 10):
+    instruments = get_instrument_catalog().search(q, limit=min(limit, 50))
+    return {'instruments': [{'ticker': item['ticker'], 'name': item['name'], 'figi': item['figi']} for item in instruments]}
+
 @app.post("/analyze")
-async def analyze(ticker: str = Form(...), use_meta_learning: bool = Form(False)):
+async def analyze(ticker: str = Form(...), use_meta_learning: bool = Form(False), charts: bool = Form(False)):
+    return await run_job('analyze', analyze_job, ticker, use_meta_learning, charts, ticker=ticker)
+
+def analyze_job(ticker, use_meta_learning=False, charts=False):
     if not ticker:
-        return JSONResponse({"error": "Пожалуйста, введите тикер акции"})
+        return {"error": "Пожалуйста, введите тикер акции"}
     predictor = StockPredictor()
     if not predictor.set_ticker(ticker):
-        return JSONResponse({"error": f"Тикер {ticker} не найден"})
+        return {"error": f"Тикер {ticker} не найден"}
     print(f"Анализ акции {ticker}...")
     times, prices, volumes = predictor.collect_data()
     if not prices or len(prices) < 20:
-        return JSONResponse({"error": "Недостаточно данных для анализа"})
-    predictions, ma5, ma20, volatility, market_state = predictor.predict_multiple_intervals(times, prices, volumes)
-    predictor.last_volatility = volatility
-    price_change = ((prices[-1] - prices[0]) / prices[0]) * 100
-    momentum = predictor.calculate_momentum(prices)
-    df = predictor.calculate_technical_indicators(prices, volumes)
-    last_rsi = df['rsi'].iloc[-1]
-    last_macd = df['macd'].iloc[-1]
-    last_signal = df['signal'].iloc[-1]
-    recommendation, reasons, entry_exit_prices = predictor.get_recommendation(last_rsi, last_macd, last_signal, price_change, momentum, prices[-1])
-    predictor.last_recommendation = recommendation
+        return {"error": "Недостаточно данных для анализа"}
+    context = predictor.build_analysis_context(times, prices, volumes)
+    if context.predictions is None:
+        return {"error": "Недостаточно данных для анализа"}
+    market_state = context.market_state
+    ma5 = context.ma5
+    ma20 = context.ma20
+    volatility = context.volatility
+    price_change = context.price_change
+    reasons = list(context.reasons)
     prediction_data = {}
-    for interval, data in predictions.items():
+    for interval, data in context.predictions.items():
         prediction_data[interval] = {'price': data['price'], 'change': data['change']}
-    prediction_data['current_price'] = prices[-1]
+    prediction_data['current_price'] = context.current_price
     prediction_data['volatility'] = volatility
     meta_learning_details = None
     if use_meta_learning:
         try:
             from prediction_analytics import PredictionAnalytics
             analytics = PredictionAnalytics()
-            corrected_predictions, meta_learning_details = analytics.apply_meta_learning_corrections(ticker, prediction_data)
+            corrected_predictions, meta_learning_details = analytics.apply_meta_learning_corrections(ticker, prediction_data, charts)
             if meta_learning_details and meta_learning_details.get('applied', False):
                 prediction_data = corrected_predictions
         except Exception as e:
             print(f"Ошибка при применении метаобучения: {e}")
             meta_learning_details = {"error": str(e), "applied": False}
-    predictor.plot_prediction(times, prices, prediction_data)
+    chart_path = predictor.plot_prediction(context, prediction_data, 'analyze_meta' if use_meta_learning else 'analyze')
     market_state_data = {
         'bullish': market_state.get('bullish', False),
         'bearish': market_state.get('bearish', False),
@@ -850,102 +1014,121 @@ async def analyze(ticker: str = Form(...), use_meta_learning: bool = Form(False)
     }
     result = {
         'ticker': ticker,
-        'current_price': prices[-1],
+        'current_price': context.current_price,
         'ma5': ma5,
         'ma20': ma20,
         'trend': 'ВОСХОДЯЩИЙ' if ma5 > ma20 else 'НИСХОДЯЩИЙ',
         'price_change': price_change,
         'volatility': volatility,
-        'momentum': momentum,
-        'rsi': last_rsi,
-        'macd': last_macd,
-        'signal_line': last_signal,
-        'recommendation': recommendation,
+        'momentum': context.momentum,
+        'rsi': context.last_rsi,
+        'macd': context.last_macd,
+        'signal_line': context.last_signal,
+        'recommendation': context.recommendation,
         'reasons': reasons,
-        'entry_exit_prices': entry_exit_prices,
+        'entry_exit_prices': dict(context.entry_exit_prices),
         'predictions': prediction_data,
         'market_state': market_state_data,
-        'chart_path': '/static/stock_prediction.png'
+        'chart_path': chart_path
     }
     result['confidence_level'] = calculate_recommendation_confidence(reasons, market_state_data, price_change, volatility)
     if meta_learning_details:
         result['meta_learning'] = meta_learning_details
-    save_prediction_history(ticker, prices[-1], prediction_data)
+    save_prediction_history(ticker, context.current_price, prediction_data)
     return result
 
 @app.post("/auto_update")
 async def auto_update(ticker: str = Form(...)):
+    return await run_job('auto_update', auto_update_job, ticker, ticker=ticker)
+
+@app.get("/stream/{ticker}")
+async def stream_updates(ticker: str, request: Request):
+    return StreamingResponse(live_hub.events(ticker.upper(), request.is_disconnected), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def auto_update_job(ticker):
     predictor = StockPredictor()
     if not predictor.set_ticker(ticker):
-        return JSONResponse({"error": f"Тикер {ticker} не найден"})
+        return {"error": f"Тикер {ticker} не найден"}
     times, prices, volumes = predictor.collect_data()
     if not prices or len(prices) < 20:
-        return JSONResponse({"error": "Недостаточно данных для анализа"})
-    predictions, ma5, ma20, volatility, market_state = predictor.predict_multiple_intervals(times, prices, volumes)
-    predictor.last_volatility = volatility
-    price_change = ((prices[-1] - prices[0]) / prices[0]) * 100
-    momentum = predictor.calculate_momentum(prices)
-    df = predictor.calculate_technical_indicators(prices, volumes)
-    last_rsi = df['rsi'].iloc[-1]
-    last_macd = df['macd'].iloc[-1]
-    last_signal = df['signal'].iloc[-1]
-    recommendation, reasons, entry_exit_prices = predictor.get_recommendation(last_rsi, last_macd, last_signal, price_change, momentum, prices[-1])
-    predictor.last_recommendation = recommendation
-    predictor.plot_prediction(times, prices, predictions)
+        return {"error": "Недостаточно данных для анализа"}
+    context = predictor.build_analysis_context(times, prices, volumes)
+    if context.predictions is None:
+        return {"error": "Недостаточно данных для анализа"}
+    chart_path = predictor.plot_prediction(context, context.predictions, 'auto_update')
     prediction_data = {}
-    for interval, data in predictions.items():
+    for interval, data in context.predictions.items():
         prediction_data[interval] = {'price': data['price'], 'change': data['change']}
-    save_prediction_history(ticker, prices[-1], prediction_data)
-    return {
+    save_prediction_history(ticker, context.current_price, prediction_data)
+    result = {
         'ticker': ticker,
-        'current_price': prices[-1],
-        'rsi': last_rsi,
-        'macd': last_macd,
-        'signal_line': last_signal,
-        'price_change': price_change,
-        'momentum': momentum,
-        'recommendation': recommendation,
+        'candle': {'time': times[-1].isoformat(), 'close': prices[-1], 'volume': volumes[-1]},
+        'current_price': context.current_price,
+        'rsi': context.last_rsi,
+        'macd': context.last_macd,
+        'signal_line': context.last_signal,
+        'price_change': context.price_change,
+        'momentum': context.momentum,
+        'recommendation': context.recommendation,
         'predictions': prediction_data,
-        'chart_path': f'/static/stock_prediction.png?t={datetime.now().timestamp()}'
+        'chart_path': f'{chart_path}?t={int(times[-1].timestamp())}'
     }
+    return result
+
+# Подписчики /stream получают тот же расчет, что и /auto_update (общий ключ single-flight), вместе с графиком:
+# история прогнозов пишется один раз на тикер и свечу
+live_hub = LiveUpdateHub(lambda ticker: run_job('auto_update', auto_update_job, ticker, ticker=ticker), current_candle)
 
 from prediction_analytics import PredictionAnalytics
 
 @app.get("/prediction_accuracy/{ticker}")
-async def prediction_accuracy(ticker: str):
-    analytics = PredictionAnalytics()
-    try:
-        accuracy_data = analytics.evaluate_prediction_quality(ticker)
-        if isinstance(accuracy_data, dict) and "error" in accuracy_data:
-            accuracy_data = analytics.calculate_advanced_metrics(ticker)
-    except Exception as e:
-        print(f"Ошибка при использовании нового метода оценки: {e}")
-        accuracy_data = analytics.calculate_advanced_metrics(ticker)
+async def prediction_accuracy(ticker: str, charts: bool = False):
+    return await run_job('prediction_accuracy', prediction_accuracy_job, ticker, charts)
+
+def prediction_accuracy_job(ticker, charts=False):
+    # Метрики накапливаются по мере разрешения прогнозов; полный проход по истории - только ради графиков
+    accumulator = get_metrics_accumulator(ticker, PREDICTION_HISTORY_DIR)
+    accumulator.update()
+    accuracy_data = accumulator.report()
     if not accuracy_data:
-        return JSONResponse({"error": "Недостаточно данных для анализа точности"})
+        return {"error": "Недостаточно данных для анализа точности"}
+    if charts:
+        analytics = PredictionAnalytics(PREDICTION_HISTORY_DIR)
+        tables = analytics.load_prediction_tables(ticker)
+        all_pairs = {interval: analytics.get_prediction_actual_pairs(tables, interval) for interval in accuracy_data['metrics']}
+        chart_path = analytics.plot_learning_curve(ticker, all_pairs)
+        if chart_path:
+            accuracy_data['learning_curve_chart'] = chart_path
+        for interval, pairs in all_pairs.items():
+            if len(pairs) >= 3:
+                accuracy_data['metrics'][interval]['error_distribution_chart'] = analytics.plot_error_distribution([pair['error_pct'] for pair in pairs], ticker, interval)
     return accuracy_data
 
 @app.get("/advanced_analytics/{ticker}")
-async def advanced_analytics(ticker: str):
+async def advanced_analytics(ticker: str, charts: bool = False):
+    return await run_job('advanced_analytics', advanced_analytics_job, ticker, charts)
+
+def advanced_analytics_job(ticker, charts=False):
     predictor = StockPredictor()
     if not predictor.set_ticker(ticker):
-        return JSONResponse({"error": f"Тикер {ticker} не найден"})
+        return {"error": f"Тикер {ticker} не найден"}
     times, prices, volumes = predictor.collect_data()
     if not prices or len(prices) < 40:
-        return JSONResponse({"error": "Недостаточно данных для расширенной аналитики (требуется минимум 40 точек)"})
-    df = predictor.calculate_technical_indicators(prices, volumes)
-    df = df.dropna()
-    feature_columns = ['rsi', 'macd', 'signal', 'price_ma_5', 'price_ma_20', 'volatility', 'momentum', 'roc_5', 'roc_10', 'stoch_k']
-    available_features = [col for col in feature_columns if col in df.columns]
+        return {"error": "Недостаточно данных для расширенной аналитики (требуется минимум 40 точек)"}
+    df = predictor.calculate_technical_indicators(prices, volumes, times, columns=['close'] + ADVANCED_FEATURE_COLUMNS)
+    # Те же строки, что оставлял dropna() по всем индикаторам: с конца прогрева самой длинной колонки
+    df = df.iloc[warmup_rows(len(df)):].dropna()
+    available_features = [col for col in ADVANCED_FEATURE_COLUMNS if col in df.columns]
     features = df[available_features].values
     target = df['close'].values
     analytics = PredictionAnalytics()
-    cv_results = analytics.perform_cross_validation(ticker, target, features)
-    hyperparameter_results = analytics.get_optimal_hyperparameters(ticker, target, features)
+    cv_results = analytics.perform_cross_validation(ticker, target, features, charts)
+    hyperparameter_results = analytics.get_optimal_hyperparameters(ticker, target, features, charts)
     if not cv_results:
-        return JSONResponse({"error": "Не удалось выполнить кросс-валидацию"})
+        return {"error": "Не удалось выполнить кросс-валидацию"}
     try:
-        advanced_models_result = analytics.combine_advanced_models(ticker, prices)
+        advanced_models_result = analytics.combine_advanced_models(ticker, prices, times=times)
         return {
             "cross_validation": cv_results,
             "hyperparameters": hyperparameter_results,
@@ -958,19 +1141,44 @@ async def advanced_analytics(ticker: str):
             "advanced_models_error": str(e)
         }
 
+@app.get("/screener")
+async def screener(tickers: str = ''):
+    return await run_job('screener', screener_job, tickers)
+
+def screener_job(tickers):
+    tickers = [ticker.strip().upper() for ticker in tickers.split(',') if ticker.strip()]
+    if not tickers:
+        return {"error": "Пожалуйста, укажите тикеры через запятую"}
+    frame = calculate_watchlist_indicators(tickers)
+    if frame is None:
+        return {"error": "Недостаточно данных для анализа"}
+    screener_columns = ['close', 'rsi', 'macd', 'signal', 'percent_b', 'volatility', 'roc_10', 'stoch_k']
+    last = frame.groupby(level='ticker', sort=False).tail(1).reset_index(level='time')
+    return {'instruments': [{'ticker': ticker, **{column: (None if pd.isna(row[column]) else float(row[column])) for column in screener_columns}} for ticker, row in last.iterrows()]}
+
+def calculate_watchlist_indicators(tickers, hours=24):
+    # Индикаторы для списка тикеров одним пакетным расчетом по общей сетке времени
+    loaded = []
+    series = []
+    for ticker in tickers:
+        predictor = StockPredictor()
+        if not predictor.set_ticker(ticker):
+            continue
+        times, prices, volumes = predictor.collect_data(hours)
+        if not prices:
+            continue
+        loaded.append(ticker)
+        series.append(([int(t.timestamp()) for t in times], prices, volumes))
+    if not series:
+        return None
+    grid, closes, volumes = align_candles(series)
+    moscow_tz = pytz.timezone('Europe/Moscow')
+    times = [datetime.fromtimestamp(int(t), tz=moscow_tz) for t in grid]
+    return compute_indicators_batch(closes, volumes, dtype=INDICATOR_DTYPE, keys=loaded, times=times)
+
 def save_prediction_history(ticker, current_price, predictions):
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    ticker_dir = os.path.join(PREDICTION_HISTORY_DIR, ticker)
-    if not os.path.exists(ticker_dir):
-        os.makedirs(ticker_dir)
-    prediction_data = {
-        'timestamp': datetime.now().isoformat(),
-        'current_price': current_price,
-        'predictions': predictions
-    }
-    filename = os.path.join(ticker_dir, f"{timestamp}.json")
-    with open(filename, 'w') as f:
-        json.dump(prediction_data, f)
+    store = get_prediction_store(ticker, PREDICTION_HISTORY_DIR)
+    store.append(datetime.now(), current_price, predictions, predictions.get('volatility'))
 
 def calculate_recommendation_confidence(reasons, market_state, price_change, volatility):
     total_signals = len(reasons)
@@ -0,0 +1,328 @@
+import os
+import time
+import queue
+import threading
+from types import SimpleNamespace
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import numpy as np
+from tinkoff.invest import CandleInstrument, CandleInterval, LastPriceInstrument, SubscriptionInterval
+from candle_store import CANDLE_STORE_DIR, get_candle_store
+from client_pool import create_client_factory, get_client_pool
+from fake_backend import to_quotation
+
+MARKET_STREAM_MODE = os.getenv('PRISMTRADE_STREAMING', 'off')
+RING_BUFFER_SIZE = 2048
+CANDLE_SECONDS = 5 * 60
+STREAM_RECONNECT_SECONDS = 5
+# Буфер без новых свечей дольше этого считается отставшим: поток мог отключиться
+STREAM_STALE_SECONDS = 2 * CANDLE_SECONDS
+REPLAY_SPEED = float(os.getenv('PRISMTRADE_REPLAY_SPEED', '1'))
+REPLAY_WARMUP_CANDLES = 200
+REPLAY_MAX_GAP_SECONDS = CANDLE_SECONDS
+
+def quotation_to_float(quotation):
+    return float(quotation.units) + float(quotation.nano) / 1e9
+
+class CandleRingBuffer:
+    """Кольцевой буфер последних свечей одного FIGI фиксированного размера."""
+
+    def __init__(self, size=RING_BUFFER_SIZE):
+        self.size = size
+        self.times = np.zeros(size, dtype=np.int64)
+        self.closes = np.zeros(size, dtype=np.float64)
+        self.volumes = np.zeros(size, dtype=np.int64)
+        self.count = 0
+        self.head = 0
+        self.lock = threading.Lock()
+
+    def _last_index(self):
+        return (self.head - 1) % self.size
+
+    def last_time(self):
+        with self.lock:
+            return int(self.times[self._last_index()]) if self.count else None
+
+    def is_stale(self, now, max_age=STREAM_STALE_SECONDS):
+        last = self.last_time()
+        return last is None or now - last > max_age
+
+    def update(self, candle_time, close, volume):
+        with self.lock:
+            if self.count:
+                last = self._last_index()
+                if candle_time == self.times[last]:
+                    self.closes[last] = close
+                    self.volumes[last] = volume
+                    return
+                if candle_time < self.times[last]:
+                    return
+            self.times[self.head] = candle_time
+            self.closes[self.head] = close
+            self.volumes[self.head] = volume
+            self.head = (self.head + 1) % self.size
+            self.count = min(self.count + 1, self.size)
+
+    def extend(self, times, closes, volumes):
+        for candle_time, close, volume in zip(times[-self.size:], closes[-self.size:], volumes[-self.size:]):
+            self.update(int(candle_time), float(close), int(volume))
+
+    def update_last_price(self, price_time, price):
+        with self.lock:
+            if not self.count:
+                return
+            last = self._last_index()
+            if self.times[last] <= price_time < self.times[last] + CANDLE_SECONDS:
+                self.closes[last] = price
+
+    def snapshot(self, since=None):
+        with self.lock:
+            order = (self.head - self.count + np.arange(self.count)) % self.size
+            times = self.times[order]
+            closes = self.closes[order]
+            volumes = self.volumes[order]
+        start = 0 if since is None else int(np.searchsorted(times, since, side='left'))
+        return times[start:], closes[start:], volumes[start:]
+
+class ReplaySubscriptions:
+    def __init__(self, stream, kind):
+        self.stream = stream
+        self.kind = kind
+
+    def subscribe(self, instruments):
+        for instrument in instruments:
+            self.stream.add(instrument.figi, self.kind)
+
+class ReplayMarketDataStream:
+    """Сессия локального сервера воспроизведения: отдает записанные свечи как поток котировок.
+
+    Время свечей сдвигается так, чтобы прогрев заканчивался в текущем 5-минутном
+    интервале, а затем свечи идут с паузами, ускоренными в speed раз.
+    Виртуальные часы сессии доступны через now().
+    """
+
+    def __init__(self, store_dir, speed, warmup):
+        self.store_dir = store_dir
+        self.speed = max(speed, 1e-6)
+        self.warmup = warmup
+        self.events = queue.Queue()
+        self.stop_event = threading.Event()
+        self.candles = ReplaySubscriptions(self, 'candle')
+        self.last_price = ReplaySubscriptions(self, 'last_price')
+        self.figis = {}
+        self.lock = threading.Lock()
+        self.clock_base = time.time()
+        self.clock_wall = time.monotonic()
+
+    def now(self, tz=timezone.utc):
+        with self.lock:
+            virtual = self.clock_base + (time.monotonic() - self.clock_wall) * self.speed
+        return datetime.fromtimestamp(virtual, tz=tz)
+
+    def _advance_clock(self, timestamp):
+        with self.lock:
+            self.clock_base = max(self.clock_base, timestamp)
+            self.clock_wall = time.monotonic()
+
+    def add(self, figi, kind):
+        with self.lock:
+            kinds = self.figis.setdefault(figi, set())
+            start = not kinds
+            kinds.add(kind)
+        if start:
+            threading.Thread(target=self._emit, args=(figi,), name=f'replay-{figi}', daemon=True).start()
+
+    def _emit(self, figi):
+        times, closes, volumes = get_candle_store(figi, self.store_dir).read()
+        if len(times) == 0:
+            print(f"Нет записанных свечей для воспроизведения {figi}")
+            return
+        warmup = min(self.warmup, len(times))
+        now_slot = int(time.time() // CANDLE_SECONDS) * CANDLE_SECONDS
+        offset = now_slot - int(times[warmup - 1])
+        for i in range(len(times)):
+            if self.stop_event.is_set():
+                return
+            if i >= warmup:
+                gap = min(int(times[i] - times[i - 1]), REPLAY_MAX_GAP_SECONDS)
+                if self.stop_event.wait(gap / self.speed):
+                    return
+            candle_time = datetime.fromtimestamp(int(times[i]) + offset, tz=timezone.utc)
+            kinds = self.figis.get(figi, set())
+            if 'candle' in kinds:
+                self.events.put(SimpleNamespace(candle=SimpleNamespace(figi=figi, time=candle_time, close=to_quotation(float(closes[i])), volume=int(volumes[i])), last_price=None))
+            if 'last_price' in kinds:
+                self.events.put(SimpleNamespace(candle=None, last_price=SimpleNamespace(figi=figi, time=candle_time, price=to_quotation(float(closes[i])))))
+            if i >= warmup - 1:
+                self._advance_clock(candle_time.timestamp())
+        print(f"Воспроизведение свечей {figi} завершено")
+
+    def __iter__(self):
+        while not self.stop_event.is_set():
+            try:
+                yield self.events.get(timeout=1)
+            except queue.Empty:
+                continue
+
+    def stop(self):
+        self.stop_event.set()
+
+class CandleReplayServer:
+    """Локальная замена потока котировок, воспроизводящая свечи из CandleStore."""
+
+    def __init__(self, store_dir=CANDLE_STORE_DIR, speed=REPLAY_SPEED, warmup=REPLAY_WARMUP_CANDLES):
+        self.store_dir = store_dir
+        self.speed = speed
+        self.warmup = warmup
+
+    @contextmanager
+    def session(self):
+        stream = ReplayMarketDataStream(self.store_dir, self.speed, self.warmup)
+        try:
+            yield stream
+        finally:
+            stream.stop()
+
+@contextmanager
+def live_market_data_stream():
+    with create_client_factory()() as client:
+        stream = client.create_market_data_stream()
+        try:
+            yield stream
+        finally:
+            stream.stop()
+
+class MarketDataStreamer:
+    """Подписка на свечи и последние цены с записью в кольцевые буферы по FIGI."""
+
+    def __init__(self, stream_factory, buffer_size=RING_BUFFER_SIZE, persist=True):
+        self.stream_factory = stream_factory
+        self.buffer_size = buffer_size
+        self.persist = persist
+        self.buffers = {}
+        self.lock = threading.Lock()
+        self.stream = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.events_received = 0
+        self.backfilled = 0
+
+    def now(self, tz=timezone.utc):
+        stream = self.stream
+        if stream is not None and hasattr(stream, 'now'):
+            return stream.now(tz)
+        return datetime.now(tz)
+
+    def get_buffer(self, figi):
+        return self.buffers.get(figi)
+
+    def subscribe(self, figi):
+        with self.lock:
+            if figi in self.buffers:
+                return self.buffers[figi]
+            buffer = CandleRingBuffer(self.buffer_size)
+            if self.persist:
+                # Живой поток дополняет историю из локального хранилища свечей
+                buffer.extend(*get_candle_store(figi).read())
+            self.buffers[figi] = buffer
+        if self.stream is not None:
+            self._subscribe(self.stream, [figi])
+        print(f"Подписка на поток котировок {figi}")
+        return buffer
+
+    def _subscribe(self, stream, figis):
+        if not figis:
+            return
+        stream.candles.subscribe([CandleInstrument(figi=figi, interval=SubscriptionInterval.SUBSCRIPTION_INTERVAL_FIVE_MINUTES) for figi in figis])
+        stream.last_price.subscribe([LastPriceInstrument(figi=figi) for figi in figis])
+
+    def _handle(self, marketdata):
+        self.events_received += 1
+        candle = getattr(marketdata, 'candle', None)
+        if candle is not None:
+            buffer = self.buffers.get(candle.figi)
+            if buffer is not None:
+                candle_time = int(candle.time.timestamp())
+                close = quotation_to_float(candle.close)
+                buffer.update(candle_time, close, candle.volume)
+                if self.persist:
+                    get_candle_store(candle.figi).append([candle_time], [close], [candle.volume])
+        last_price = getattr(marketdata, 'last_price', None)
+        if last_price is not None:
+            buffer = self.buffers.get(last_price.figi)
+            if buffer is not None:
+                buffer.update_last_price(int(last_price.time.timestamp()), quotation_to_float(last_price.price))
+
+    def _backfill(self):
+        """Дозагружает через API свечи, пропущенные буферами, пока поток был отключен."""
+        now = datetime.now(timezone.utc)
+        for figi, buffer in list(self.buffers.items()):
+            last = buffer.last_time()
+            if last is None or now.timestamp() - last < CANDLE_SECONDS:
+                continue
+            try:
+                with get_client_pool().client() as client:
+                    candles = client.market_data.get_candles(
+                        figi=figi,
+                        from_=datetime.fromtimestamp(last, tz=timezone.utc),
+                        to=now,
+                        interval=CandleInterval.CANDLE_INTERVAL_5_MIN).candles
+            except Exception as e:
+                print(f"Не удалось дозагрузить свечи {figi}: {e}")
+                continue
+            candles = sorted(candles, key=lambda x: x.time)
+            times = [int(candle.time.timestamp()) for candle in candles]
+            closes = [quotation_to_float(candle.close) for candle in candles]
+            volumes = [candle.volume for candle in candles]
+            buffer.extend(times, closes, volumes)
+            get_candle_store(figi).append(times, closes, volumes)
+            self.backfilled += len(candles)
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                with self.stream_factory() as stream:
+                    self.stream = stream
+                    self._subscribe(stream, list(self.buffers))
+                    if self.persist:
+                        # События, пришедшие во время дозагрузки, ждут в потоке и применяются после нее
+                        self._backfill()
+                    for marketdata in stream:
+                        if self.stop_event.is_set():
+                            break
+                        self._handle(marketdata)
+            except Exception as e:
+                print(f"Ошибка потока котировок: {e}")
+            self.stream = None
+            self.stop_event.wait(STREAM_RECONNECT_SECONDS)
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='market-data-stream', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        stream = self.stream
+        if stream is not None:
+            stream.stop()
+
+    def stats(self):
+        return {'subscriptions': len(self.buffers), 'events_received': self.events_received, 'connected': self.stream is not None, 'backfilled': self.backfilled}
+
+_streamer = None
+_streamer_lock = threading.Lock()
+
+def get_market_streamer(mode=MARKET_STREAM_MODE):
+    global _streamer
+    if mode == 'off':
+        return None
+    with _streamer_lock:
+        if _streamer is None:
+            if mode == 'replay':
+                _streamer = MarketDataStreamer(CandleReplayServer().session, persist=False)
+            else:
+                _streamer = MarketDataStreamer(live_market_data_stream)
+        return _streamer
@@ -0,0 +1,145 @@
+import os
+import time
+import threading
+import joblib
+from accuracy_metrics import STAT, get_metrics_accumulator
+
+META_MODELS_DIR = 'data/meta_models'
+META_RETRAIN_PREDICTIONS = int(os.getenv('PRISMTRADE_META_RETRAIN', '20'))
+META_CHECK_SECONDS = float(os.getenv('PRISMTRADE_META_CHECK_SECONDS', '60'))
+META_MODELS_VERSION = 2
+META_PENDING = {'error': 'Метаобучение для этого тикера еще выполняется'}
+
+class MetaLearningCache:
+    """Обученные правила коррекции метаобучения по тикерам.
+
+    Результат meta_learning() сохраняется в META_MODELS_DIR/<тикер>.joblib с
+    отметкой: сколько пар прогноз/факт было разрешено на момент обучения (по
+    MetricsAccumulator). Переобучение идет, когда разрешилось еще
+    META_RETRAIN_PREDICTIONS пар; проверка отметки выполняется не чаще раза в
+    META_CHECK_SECONDS секунд, в остальное время results() - поиск в словаре.
+    Переобучение выполняется в фоновом потоке: пока оно идет, results()
+    отдает прежний результат (или META_PENDING, если его еще нет), так что
+    запрос анализа его не ждет. Графики при обучении не строятся.
+    """
+
+    def __init__(self, base_dir=META_MODELS_DIR, retrain_predictions=META_RETRAIN_PREDICTIONS, check_seconds=META_CHECK_SECONDS):
+        self.base_dir = base_dir
+        self.retrain_predictions = retrain_predictions
+        self.check_seconds = check_seconds
+        self.entries = {}
+        self.locks = {}
+        self.threads = {}
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'checks': 0, 'loads': 0, 'retrains': 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def _entry_lock(self, ticker):
+        with self.lock:
+            return self.locks.setdefault(ticker, threading.Lock())
+
+    def _path(self, ticker):
+        return os.path.join(self.base_dir, f'{ticker}.joblib')
+
+    def _load(self, ticker):
+        path = self._path(ticker)
+        if not os.path.exists(path):
+            return None
+        try:
+            entry = joblib.load(path)
+        except Exception as e:
+            print(f"Не удалось загрузить модели метаобучения {ticker}: {e}")
+            return None
+        if entry.get('version') != META_MODELS_VERSION:
+            return None
+        self._count('loads')
+        return entry
+
+    def _save(self, ticker, entry):
+        if not os.path.exists(self.base_dir):
+            os.makedirs(self.base_dir)
+        temporary = self._path(ticker) + '.tmp'
+        joblib.dump(entry, temporary)
+        os.replace(temporary, self._path(ticker))
+
+    def _stale(self, entry, records, resolved):
+        if entry is None:
+            return True
+        if 'error' in entry['results']:
+            # Пока данных мало, обучение дешевое - пробуем снова при каждой новой записи
+            return records != entry['records']
+        return resolved - entry['resolved'] >= self.retrain_predictions
+
+    def _retrain(self, analytics, ticker, records, resolved):
+        try:
+            entry = {
+                'version': META_MODELS_VERSION,
+                'records': records,
+                'resolved': resolved,
+                'results': analytics.meta_learning(ticker, charts=False)
+            }
+            self._save(ticker, entry)
+            entry['checked_at'] = time.monotonic()
+            self.entries[ticker] = entry
+        except Exception as e:
+            print(f"Ошибка переобучения метаобучения {ticker}: {e}")
+        finally:
+            with self.lock:
+                self.threads.pop(ticker, None)
+
+    def _start_retrain(self, analytics, ticker, records, resolved):
+        with self.lock:
+            if ticker in self.threads:
+                return
+            self.counters['retrains'] += 1
+            thread = threading.Thread(target=self._retrain, args=(analytics, ticker, records, resolved), daemon=True)
+            self.threads[ticker] = thread
+        thread.start()
+
+    def results(self, analytics, ticker):
+        entry = self.entries.get(ticker)
+        if entry is not None and time.monotonic() - entry['checked_at'] < self.check_seconds:
+            self._count('hits')
+            return entry['results']
+        with self._entry_lock(ticker):
+            entry = self.entries.get(ticker)
+            if entry is not None and time.monotonic() - entry['checked_at'] < self.check_seconds:
+                self._count('hits')
+                return entry['results']
+            self._count('checks')
+            if entry is None:
+                entry = self._load(ticker)
+            accumulator = get_metrics_accumulator(ticker, analytics.prediction_dir)
+            accumulator.update()
+            resolved = sum(int(metrics.total[STAT['count']]) for metrics in accumulator.intervals.values())
+            if self._stale(entry, accumulator.records, resolved):
+                self._start_retrain(analytics, ticker, accumulator.records, resolved)
+            if entry is None:
+                return META_PENDING
+            entry['checked_at'] = time.monotonic()
+            self.entries.setdefault(ticker, entry)
+            return self.entries[ticker]['results']
+
+    def wait(self, timeout=None):
+        """Ждет завершения начатых переобучений."""
+        with self.lock:
+            threads = list(self.threads.values())
+        for thread in threads:
+            thread.join(timeout)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, tickers=len(self.entries), retraining=len(self.threads))
+
+_meta_learning_cache = None
+_meta_learning_cache_lock = threading.Lock()
+
+def get_meta_learning_cache():
+    global _meta_learning_cache
+    with _meta_learning_cache_lock:
+        if _meta_learning_cache is None:
+            _meta_learning_cache = MetaLearningCache()
+        return _meta_learning_cache
@@ -0,0 +1,81 @@
+import os
+import threading
+from collections import OrderedDict
+from forecast_models import HorizonModels
+
+MODEL_CACHE_ENABLED = os.getenv('PRISMTRADE_MODEL_CACHE', 'off') == 'on'
+MODEL_CACHE_MAX_BYTES = int(os.getenv('PRISMTRADE_MODEL_CACHE_MB', '256')) * 1024 * 1024
+MODEL_REFIT_CANDLES = 12
+
+class ModelCache:
+    """Обученные модели прогноза по FIGI между запросами.
+
+    Пока не пришла новая свеча, модели используются как есть. Новые свечи
+    дообучают их (HorizonModels.update), а полное переобучение выполняется
+    раз в MODEL_REFIT_CANDLES свечей, при смене горизонтов или признаков и
+    при обнаружении дрейфа. Вытеснение - LRU с ограничением по памяти.
+    """
+
+    def __init__(self, max_bytes=MODEL_CACHE_MAX_BYTES, refit_candles=MODEL_REFIT_CANDLES):
+        self.max_bytes = max_bytes
+        self.refit_candles = refit_candles
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'updates': 0, 'refits': 0, 'drift_refits': 0, 'evictions': 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def _entry_lock(self, figi):
+        with self.lock:
+            return self.locks.setdefault(figi, threading.Lock())
+
+    def _store(self, figi, models):
+        with self.lock:
+            self.entries[figi] = models
+            self.entries.move_to_end(figi)
+            self.sizes[figi] = models.nbytes()
+            while len(self.entries) > 1 and sum(self.sizes.values()) > self.max_bytes:
+                evicted, _ = self.entries.popitem(last=False)
+                self.sizes.pop(evicted, None)
+                self.locks.pop(evicted, None)
+                self.counters['evictions'] += 1
+
+    def base_predictions(self, figi, X, y, row_times, windows, mode):
+        with self._entry_lock(figi):
+            with self.lock:
+                models = self.entries.get(figi)
+                if models is not None:
+                    self.entries.move_to_end(figi)
+            status = 'refit'
+            if models is not None and models.windows == list(windows) and models.mode == mode:
+                if models.candles_since_refit < self.refit_candles:
+                    status = models.update(X, y, row_times)
+            if status in ('reuse', 'update'):
+                self._count('hits')
+                if status == 'update':
+                    self._count('updates')
+            else:
+                self._count('misses')
+                if models is not None:
+                    self._count('drift_refits' if status == 'drift' else 'refits')
+                models = HorizonModels(windows, mode).fit(X, y, row_times)
+            self._store(figi, models)
+            return models.predict(X, y), models.scaler_y
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries), bytes=sum(self.sizes.values()))
+
+_model_cache = None
+_model_cache_lock = threading.Lock()
+
+def get_model_cache():
+    global _model_cache
+    with _model_cache_lock:
+        if _model_cache is None:
+            _model_cache = ModelCache()
+        return _model_cache
@@ -1,21 +1,19 @@
 import os
-import json
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
 from sklearn.metrics import mean_squared_error, mean_absolute_error
-from sklearn.model_selection import TimeSeriesSplit
 from sklearn.linear_model import LinearRegression
 from sklearn.ensemble import GradientBoostingRegressor
-from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import StandardScaler, PolynomialFeatures
+from job_executor import synchronized_plot
+from prediction_store import MODEL_FORECAST, PREDICTION_HORIZON, PREDICTION_RECORD, as_dicts, from_micros, get_prediction_store, match_actuals
+from meta_learning_cache import get_meta_learning_cache
+from cv_engine import cached, cross_validate_models, data_key, search_gradient_boosting
+from lstm_engine import LSTM_UNITS, LSTM_DROPOUT, InsufficientHistory, get_lstm_registry
+from arima_engine import get_arima_cache
+from ensemble_weights import forecast_matrix, search_weights
 
-LSTM_EPOCHS = 20
-LSTM_BATCH_SIZE = 32
-ARIMA_PARAMS_STATIONARY = (2, 0, 2)
-ARIMA_PARAMS_NONSTATIONARY = (1, 1, 1)
-ARIMA_FALLBACK_PARAMS = (1, 1, 0)
 
 class PredictionAnalytics:
     def __init__(self, prediction_dir="data/predictions"):
@@ -23,30 +21,20 @@ class PredictionAnalytics:
         if not os.path.exists(self.prediction_dir):
             os.makedirs(self.prediction_dir)
 
-    def get_prediction_files(self, ticker):
-        ticker_dir = os.path.join(self.prediction_dir, ticker)
-        if not os.path.exists(ticker_dir):
-            return []
-        return sorted([f for f in os.listdir(ticker_dir) if f.endswith('.json')])
-
-    def load_predictions(self, ticker):
-        files = self.get_prediction_files(ticker)
-        ticker_dir = os.path.join(self.prediction_dir, ticker)
-        predictions = []
-        for file in files:
-            with open(os.path.join(ticker_dir, file), 'r') as f:
-                data = json.load(f)
-                predictions.append(data)
-        return predictions
+    def load_prediction_tables(self, ticker):
+        # (records, horizons) из хранилища прогнозов, см. PredictionStore.read
+        if not os.path.exists(os.path.join(self.prediction_dir, ticker)):
+            return np.empty(0, dtype=PREDICTION_RECORD), np.empty(0, dtype=PREDICTION_HORIZON)
+        return get_prediction_store(ticker, self.prediction_dir).read()
 
     def calculate_advanced_metrics(self, ticker):
-        predictions = self.load_predictions(ticker)
-        if len(predictions) < 5:
+        tables = self.load_prediction_tables(ticker)
+        if len(tables[0]) < 5:
             return None
         intervals = ['15', '30', '60']
         results = {}
         for interval in intervals:
-            prediction_actual_pairs = self.get_prediction_actual_pairs(predictions, interval)
+            prediction_actual_pairs = self.get_prediction_actual_pairs(tables, interval)
             if len(prediction_actual_pairs) < 3:
                 continue
             predicted_values = [pair['predicted'] for pair in prediction_actual_pairs]
@@ -71,36 +59,29 @@ class PredictionAnalytics:
             }
         return results
 
-    def get_prediction_actual_pairs(self, predictions, interval):
+    def get_prediction_actual_pairs(self, tables, interval):
+        # tables - (records, horizons) из load_prediction_tables; время уже в микросекундах и отсортировано
+        records, horizons = tables
+        times = records['time']
+        matched = match_actuals(times, int(interval) * 60 * 1000000)
+        horizons = horizons[horizons['interval'] == int(interval)]
+        rows = np.searchsorted(times, horizons['time'], side='left')
         pairs = []
-        for i in range(len(predictions) - 1):
-            current_pred = predictions[i]
-            later_data = predictions[i + 1:]
-            if interval not in current_pred['predictions']:
+        for i, predicted_price in zip(rows.tolist(), horizons['price'].tolist()):
+            if matched[i] < 0:
                 continue
-            minutes_diff = int(interval)
-            target_time = datetime.fromisoformat(current_pred['timestamp']) + timedelta(minutes=minutes_diff)
-            closest_idx = 0
-            min_diff = timedelta(days=1)
-            for j, future_data in enumerate(later_data):
-                future_time = datetime.fromisoformat(future_data['timestamp'])
-                time_diff = abs(future_time - target_time)
-                if time_diff < min_diff:
-                    min_diff = time_diff
-                    closest_idx = j
-            if min_diff <= timedelta(minutes=5):
-                actual_price = later_data[closest_idx]['current_price']
-                predicted_price = current_pred['predictions'][interval]['price']
-                current_price = current_pred['current_price']
-                pairs.append({
-                    'timestamp': current_pred['timestamp'],
-                    'current_price': current_price,
-                    'predicted': predicted_price,
-                    'actual': actual_price,
-                    'error_pct': abs((predicted_price - actual_price) / actual_price) * 100
-                })
+            actual_price = float(records['current_price'][matched[i]])
+            current_price = float(records['current_price'][i])
+            pairs.append({
+                'timestamp': from_micros(times[i]).isoformat(),
+                'current_price': current_price,
+                'predicted': predicted_price,
+                'actual': actual_price,
+                'error_pct': abs((predicted_price - actual_price) / actual_price) * 100
+            })
         return pairs
 
+    @synchronized_plot
     def plot_error_distribution(self, percentage_errors, ticker, interval):
         if not os.path.exists('static/analytics'):
             os.makedirs('static/analytics')
@@ -119,40 +100,12 @@ class PredictionAnalytics:
         plt.close()
         return f'/{chart_path}'
 
-    def perform_cross_validation(self, ticker, historical_prices, features):
+    def perform_cross_validation(self, ticker, historical_prices, features, charts=False):
         if len(historical_prices) < 30:
             return None
-        X = features
-        y = historical_prices
-        tscv = TimeSeriesSplit(n_splits=5)
-        models = {
-            'linear': LinearRegression(),
-            'polynomial': Pipeline([('poly', PolynomialFeatures(degree=2)), ('linear', LinearRegression())]),
-            'gradient_boosting': GradientBoostingRegressor(n_estimators=50, learning_rate=0.1, max_depth=3, random_state=42)
-        }
-        cv_results = {}
-        for model_name, model in models.items():
-            rmse_scores = []
-            mae_scores = []
-            for train_idx, test_idx in tscv.split(X):
-                X_train, X_test = X[train_idx], X[test_idx]
-                y_train, y_test = y[train_idx], y[test_idx]
-                scaler = StandardScaler()
-                X_train_scaled = scaler.fit_transform(X_train)
-                X_test_scaled = scaler.transform(X_test)
-                model.fit(X_train_scaled, y_train)
-                y_pred = model.predict(X_test_scaled)
-                rmse = np.sqrt(mean_squared_error(y_test, y_pred))
-                mae = mean_absolute_error(y_test, y_pred)
-                rmse_scores.append(rmse)
-                mae_scores.append(mae)
-            cv_results[model_name] = {
-                'avg_rmse': np.mean(rmse_scores),
-                'avg_mae': np.mean(mae_scores),
-                'rmse_scores': rmse_scores,
-                'mae_scores': mae_scores
-            }
-        chart_path = self.plot_cv_results(cv_results, ticker)
+        key = data_key(features, historical_prices)
+        cv_results = cached(('cross_validation', key), lambda: cross_validate_models(features, historical_prices))
+        chart_path = cached(('cross_validation_chart', key, ticker), lambda: self.plot_cv_results(cv_results, ticker)) if charts else None
         cv_summary = {
             'models': {},
             'chart_path': chart_path,
@@ -165,6 +118,7 @@ class PredictionAnalytics:
             }
         return cv_summary
 
+    @synchronized_plot
     def plot_cv_results(self, cv_results, ticker):
         if not os.path.exists('static/analytics'):
             os.makedirs('static/analytics')
@@ -186,42 +140,15 @@ class PredictionAnalytics:
         plt.close()
         return f'/{chart_path}'
 
-    def get_optimal_hyperparameters(self, ticker, historical_prices, features):
+    def get_optimal_hyperparameters(self, ticker, historical_prices, features, charts=False):
         if len(historical_prices) < 40:
             return None
-        X = features
-        y = historical_prices
-        best_rmse = float('inf')
-        best_params = {}
-        n_estimators_options = [30, 50, 100]
-        learning_rate_options = [0.05, 0.1, 0.2]
-        max_depth_options = [2, 3, 4]
-        results = []
-        tscv = TimeSeriesSplit(n_splits=3)
-        for n_estimators in n_estimators_options:
-            for learning_rate in learning_rate_options:
-                for max_depth in max_depth_options:
-                    params = {'n_estimators': n_estimators, 'learning_rate': learning_rate, 'max_depth': max_depth}
-                    rmse_scores = []
-                    for train_idx, test_idx in tscv.split(X):
-                        X_train, X_test = X[train_idx], X[test_idx]
-                        y_train, y_test = y[train_idx], y[test_idx]
-                        scaler = StandardScaler()
-                        X_train_scaled = scaler.fit_transform(X_train)
-                        X_test_scaled = scaler.transform(X_test)
-                        model = GradientBoostingRegressor(n_estimators=n_estimators, learning_rate=learning_rate, max_depth=max_depth, random_state=42)
-                        model.fit(X_train_scaled, y_train)
-                        y_pred = model.predict(X_test_scaled)
-                        rmse = np.sqrt(mean_squared_error(y_test, y_pred))
-                        rmse_scores.append(rmse)
-                    avg_rmse = np.mean(rmse_scores)
-                    results.append({'params': params, 'avg_rmse': avg_rmse})
-                    if avg_rmse < best_rmse:
-                        best_rmse = avg_rmse
-                        best_params = params
-        chart_path = self.plot_hyperparameter_results(results, ticker)
+        key = data_key(features, historical_prices)
+        best_params, best_rmse, results = cached(('hyperparameters', key), lambda: search_gradient_boosting(features, historical_prices))
+        chart_path = cached(('hyperparameters_chart', key, ticker), lambda: self.plot_hyperparameter_results(results, ticker)) if charts else None
         return {'best_params': best_params, 'best_rmse': round(best_rmse, 3), 'chart_path': chart_path}
 
+    @synchronized_plot
     def plot_hyperparameter_results(self, results, ticker):
         if not os.path.exists('static/analytics'):
             os.makedirs('static/analytics')
@@ -242,8 +169,8 @@ class PredictionAnalytics:
         return f'/{chart_path}'
 
     def evaluate_prediction_quality(self, ticker):
-        predictions = self.load_predictions(ticker)
-        if len(predictions) < 5:
+        tables = self.load_prediction_tables(ticker)
+        if len(tables[0]) < 5:
             return {"error": "Недостаточно данных для анализа точности прогнозов"}
         learning_results = {
             'market_factors': {},
@@ -255,7 +182,7 @@ class PredictionAnalytics:
         intervals = ['15', '30', '60']
         all_pairs = {}
         for interval in intervals:
-            all_pairs[interval] = self.get_prediction_actual_pairs(predictions, interval)
+            all_pairs[interval] = self.get_prediction_actual_pairs(tables, interval)
             if len(all_pairs[interval]) < 3:
                 continue
             error_magnitudes = []
@@ -355,6 +282,7 @@ class PredictionAnalytics:
             learning_results['learning_curve_chart'] = chart_path
         return learning_results
 
+    @synchronized_plot
     def plot_learning_curve(self, ticker, all_pairs):
         if not os.path.exists('static/analytics'):
             os.makedirs('static/analytics')
@@ -414,48 +342,24 @@ class PredictionAnalytics:
         plt.close()
         return f'/{chart_path}'
 
-    def build_lstm_model(self, ticker, historical_prices, features=None, intervals=['15', '30', '60']):
-        try:
-            import tensorflow as tf
-            from tensorflow.keras.models import Sequential
-            from tensorflow.keras.layers import LSTM, Dense, Dropout
-        except ImportError:
-            return {"error": "Требуется установить tensorflow для использования LSTM моделей", "recommendation": "Установите tensorflow с помощью команды: pip install tensorflow"}
+    def build_lstm_model(self, ticker, historical_prices, features=None, intervals=['15', '30', '60'], times=None):
         if len(historical_prices) < 50:
             return {"error": "Недостаточно исторических данных для обучения LSTM модели", "recommendation": "Необходимо минимум 50 точек данных"}
-        from sklearn.preprocessing import MinMaxScaler
-        scaler = MinMaxScaler(feature_range=(0, 1))
-        scaled_data = scaler.fit_transform(np.array(historical_prices).reshape(-1, 1))
-        X_train, y_train = [], []
-        time_steps = min(60, len(scaled_data) - 1)
-        for i in range(time_steps, len(scaled_data)):
-            X_train.append(scaled_data[i - time_steps:i, 0])
-            y_train.append(scaled_data[i, 0])
-        X_train, y_train = np.array(X_train), np.array(y_train)
-        X_train = np.reshape(X_train, (X_train.shape[0], X_train.shape[1], 1))
-        model = Sequential()
-        model.add(LSTM(units=50, return_sequences=True, input_shape=(X_train.shape[1], 1)))
-        model.add(Dropout(0.2))
-        model.add(LSTM(units=50, return_sequences=False))
-        model.add(Dropout(0.2))
-        model.add(Dense(units=1))
-        model.compile(optimizer='adam', loss='mean_squared_error')
+        # Прогноз считается на NumPy, TensorFlow загружается только для обучения и дообучения
         try:
-            model.fit(X_train, y_train, epochs=LSTM_EPOCHS, batch_size=LSTM_BATCH_SIZE, verbose=0)
+            trajectory, scaler, registry_info = get_lstm_registry().forecast(ticker, historical_prices, times, max(int(interval) for interval in intervals))
+        except ImportError:
+            return {"error": "Требуется установить tensorflow для использования LSTM моделей", "recommendation": "Установите tensorflow с помощью команды: pip install tensorflow"}
+        except LookupError as e:
+            return {"error": str(e), "recommendation": f"Обучите модель командой: python lstm_engine.py train {ticker}"}
+        except InsufficientHistory as e:
+            return {"error": str(e), "recommendation": "Дождитесь накопления истории цен"}
         except Exception as e:
             return {"error": f"Ошибка при обучении LSTM модели: {str(e)}", "recommendation": "Попробуйте уменьшить размер батча или количество эпох"}
         predictions = {}
         for interval in intervals:
             steps_ahead = int(interval)
-            last_sequence = scaled_data[-time_steps:]
-            future_predictions = []
-            current_batch = last_sequence.reshape((1, time_steps, 1))
-            for i in range(steps_ahead):
-                current_pred = model.predict(current_batch, verbose=0)[0]
-                future_predictions.append(current_pred)
-                new_sequence = np.append(current_batch[0, 1:, 0], current_pred)
-                current_batch = new_sequence.reshape(1, time_steps, 1)
-            unscaled_predictions = scaler.inverse_transform(np.array(future_predictions).reshape(-1, 1))
+            unscaled_predictions = scaler.inverse_transform(trajectory[:steps_ahead].reshape(-1, 1))
             predicted_price = unscaled_predictions[-1][0]
             current_price = historical_prices[-1]
             change_percent = ((predicted_price - current_price) / current_price) * 100
@@ -471,71 +375,60 @@ class PredictionAnalytics:
             'model_info': {
                 'type': 'LSTM',
                 'layers': [
-                    {"type": "LSTM", "units": 50, "return_sequences": True},
-                    {"type": "Dropout", "rate": 0.2},
-                    {"type": "LSTM", "units": 50, "return_sequences": False},
-                    {"type": "Dropout", "rate": 0.2},
+                    {"type": "LSTM", "units": LSTM_UNITS, "return_sequences": True},
+                    {"type": "Dropout", "rate": LSTM_DROPOUT},
+                    {"type": "LSTM", "units": LSTM_UNITS, "return_sequences": False},
+                    {"type": "Dropout", "rate": LSTM_DROPOUT},
                     {"type": "Dense", "units": 1}
                 ],
-                'time_steps': time_steps,
-                'training_samples': len(X_train)
+                'time_steps': registry_info['time_steps'],
+                'training_samples': registry_info['samples'],
+                'registry': registry_info
             },
             'chart_path': f'/static/analytics/{ticker}_lstm_prediction.png'
         }
 
-    def build_arima_model(self, ticker, historical_prices, intervals=['15', '30', '60']):
+    def build_arima_model(self, ticker, historical_prices, intervals=['15', '30', '60'], times=None):
         try:
-            import statsmodels.api as sm
-            from statsmodels.tsa.arima.model import ARIMA
-            from statsmodels.tsa.stattools import adfuller
+            import statsmodels
         except ImportError:
             return {"error": "Требуется установить statsmodels для использования ARIMA моделей", "recommendation": "Установите statsmodels с помощью команды: pip install statsmodels"}
         if len(historical_prices) < 30:
             return {"error": "Недостаточно исторических данных для обучения ARIMA модели", "recommendation": "Необходимо минимум 30 точек данных"}
-        result = adfuller(historical_prices)
-        is_stationary = result[1] <= 0.05
-        if is_stationary:
-            p, d, q = ARIMA_PARAMS_STATIONARY
-        else:
-            p, d, q = ARIMA_PARAMS_NONSTATIONARY
+        # Оцененная модель тикера кэшируется и принимает новые свечи без переоценки параметров
         try:
-            model = ARIMA(historical_prices, order=(p, d, q))
-            model_fit = model.fit()
+            forecast, arima = get_arima_cache().forecast(ticker, historical_prices, times, max(int(interval) for interval in intervals))
         except Exception as e:
-            try:
-                model = ARIMA(historical_prices, order=ARIMA_FALLBACK_PARAMS)
-                model_fit = model.fit()
-            except Exception as e2:
-                return {"error": f"Ошибка при обучении ARIMA модели: {str(e2)}", "recommendation": "Попробуйте использовать другие параметры модели"}
+            return {"error": f"Ошибка при обучении ARIMA модели: {str(e)}", "recommendation": "Попробуйте использовать другие параметры модели"}
+        model_fit = arima['result']
+        p, d, q = arima['order']
         predictions = {}
+        current_price = historical_prices[-1]
         for interval in intervals:
-            steps_ahead = int(interval)
-            try:
-                forecast = model_fit.forecast(steps=steps_ahead)
-                predicted_price = forecast[-1]
-                current_price = historical_prices[-1]
-                change_percent = ((predicted_price - current_price) / current_price) * 100
-                predictions[interval] = {
-                    'price': float(predicted_price),
-                    'change': float(change_percent),
-                    'all_points': [float(p) for p in forecast],
-                    'model_type': 'ARIMA',
-                    'parameters': {'p': p, 'd': d, 'q': q}
-                }
-            except Exception as e:
-                continue
+            points = forecast[:int(interval)]
+            predicted_price = points[-1]
+            change_percent = ((predicted_price - current_price) / current_price) * 100
+            predictions[interval] = {
+                'price': float(predicted_price),
+                'change': float(change_percent),
+                'all_points': [float(p) for p in points],
+                'model_type': 'ARIMA',
+                'parameters': {'p': p, 'd': d, 'q': q}
+            }
         self.plot_arima_results(ticker, historical_prices, predictions, model_fit)
         return {
             'predictions': predictions,
             'model_info': {
                 'type': 'ARIMA',
                 'parameters': {'p': p, 'd': d, 'q': q},
-                'is_stationary': is_stationary,
-                'adf_pvalue': result[1]
+                'is_stationary': arima['is_stationary'],
+                'adf_pvalue': arima['adf_pvalue'],
+                'cache': {'status': arima['status'], 'candles_since_refit': arima['candles_since_refit']}
             },
             'chart_path': f'/static/analytics/{ticker}_arima_prediction.png'
         }
 
+    @synchronized_plot
     def plot_lstm_comparison(self, ticker, historical_prices, predictions):
         if not os.path.exists('static/analytics'):
             os.makedirs('static/analytics')
@@ -566,6 +459,7 @@ class PredictionAnalytics:
         plt.savefig(f'static/analytics/{ticker}_lstm_prediction.png', dpi=200)
         plt.close()
 
+    @synchronized_plot
     def plot_arima_results(self, ticker, historical_prices, predictions, model_fit):
         if not os.path.exists('static/analytics'):
             os.makedirs('static/analytics')
@@ -590,7 +484,8 @@ class PredictionAnalytics:
         plt.legend(loc='best')
         plt.subplot(2, 1, 2)
         try:
-            residuals = pd.DataFrame(model_fit.resid)
+            # Кэшированная модель помнит остатки за всю историю с последней переоценки - берем только текущее окно
+            residuals = pd.DataFrame(np.asarray(model_fit.resid)[-len(historical_prices):])
             residuals.plot(title='Остатки', ax=plt.gca(), color='#3498DB', legend=False)
             plt.xlabel('Временные шаги')
             plt.ylabel('Остатки')
@@ -615,7 +510,8 @@ class PredictionAnalytics:
             return {'lstm': 0.6, 'arima': 0.4}
         
         # Получаем историю прогнозов для оценки точности моделей
-        prediction_history = self.load_predictions(ticker)
+        tables = self.load_prediction_tables(ticker)
+        prediction_history = as_dicts(*tables)
         if len(prediction_history) < 5:
             # Недостаточно предыдущих прогнозов, используем стандартные веса
             return {'lstm': 0.6, 'arima': 0.4}
@@ -626,7 +522,7 @@ class PredictionAnalytics:
             model_errors[model_name] = []
         
         for interval in ['15', '30', '60']:
-            prediction_actual_pairs = self.get_prediction_actual_pairs(prediction_history, interval)
+            prediction_actual_pairs = self.get_prediction_actual_pairs(tables, interval)
             if len(prediction_actual_pairs) < 3:
                 continue
             
@@ -727,78 +623,37 @@ class PredictionAnalytics:
         
         return weights
 
+    def load_model_forecasts(self, ticker, models):
+        """Прогнозы моделей ансамбля и фактические цены одним чтением хранилища (см. forecast_matrix)."""
+        if not os.path.exists(os.path.join(self.prediction_dir, ticker)):
+            return forecast_matrix(np.empty(0, dtype=MODEL_FORECAST), [], [], models)
+        store = get_prediction_store(ticker, self.prediction_dir)
+        records, _ = store.read()
+        forecasts = store.read_models()
+        # Фактические цены - из сохраненных прогнозов и из самих прогнозов моделей
+        observed_times = np.concatenate([records['time'], forecasts['time']])
+        observed_prices = np.concatenate([records['current_price'], forecasts['current_price']])
+        order = np.argsort(observed_times, kind='stable')
+        return forecast_matrix(forecasts, observed_times[order], observed_prices[order], models)
+
     def perform_cross_validation_for_weights(self, ticker, models, historical_prices, window_size=10):
         """Выполняет кросс-валидацию для поиска оптимальных весов ансамбля"""
         if len(historical_prices) < window_size * 3:
             return self.calculate_adaptive_weights(historical_prices, models)
         
-        # Инициализируем массив возможных весовых комбинаций
-        weight_options = []
-        step = 0.1
-        for w1 in np.arange(0.1, 1.0, step):
-            w2 = 1.0 - w1
-            weight_options.append((w1, w2))
-        
-        errors = []
-        for w1, w2 in weight_options:
-            total_error = 0
-            valid_windows = 0
-            
-            # Проводим кросс-валидацию на исторических окнах
-            for i in range(window_size, len(historical_prices) - window_size, window_size):
-                train_data = historical_prices[:i]
-                test_data = historical_prices[i:i+window_size]
-                
-                # Если есть данные о прогнозах моделей для этого окна
-                pred_window = None
-                for pred in self.load_predictions(ticker):
-                    if abs(len(train_data) - pd.Series(pred.get('predictions', {}).get('prices', [])).count()) < 5:
-                        pred_window = pred
-                        break
-                
-                if pred_window is None:
-                    continue
-                
-                # Взвешенный прогноз
-                model_preds = {}
-                for model in models:
-                    if model in pred_window.get('models', {}):
-                        model_preds[model] = pred_window['models'][model].get('predictions', [])
-                
-                if len(model_preds) < len(models):
-                    continue
-                
-                # Расчет ошибки для этого набора весов
-                ensemble_preds = []
-                model_list = list(models)
-                
-                for i in range(min(len(model_preds[model_list[0]]), len(test_data))):
-                    weighted_pred = model_preds[model_list[0]][i] * w1
-                    if len(model_list) > 1:
-                        weighted_pred += model_preds[model_list[1]][i] * w2
-                    ensemble_preds.append(weighted_pred)
-                
-                if len(ensemble_preds) > 0:
-                    error = np.mean([abs(ensemble_preds[i] - test_data[i]) / test_data[i] for i in range(len(ensemble_preds))])
-                    total_error += error
-                    valid_windows += 1
-            
-            if valid_windows > 0:
-                errors.append((w1, w2, total_error / valid_windows))
-        
-        if errors:
-            # Находим комбинацию весов с минимальной ошибкой
-            optimal = min(errors, key=lambda x: x[2])
-            if len(models) == 2:
-                return {models[0]: optimal[0], models[1]: optimal[1]}
+        # История прогнозов моделей собирается в массивы один раз, все веса оцениваются одной матричной операцией
+        forecasts, actuals, starts = self.load_model_forecasts(ticker, models)
+        if len(models) > 1 and len(actuals) > 0:
+            weights, _ = search_weights(forecasts, actuals, starts)
+            return {model: float(weight) for model, weight in zip(models, weights)}
         
         # Если не удалось выполнить кросс-валидацию, используем адаптивные веса
         return self.calculate_adaptive_weights(historical_prices, models)
 
-    def combine_advanced_models(self, ticker, historical_prices, features=None):
+    def combine_advanced_models(self, ticker, historical_prices, features=None, times=None):
         results = {}
-        lstm_results = self.build_lstm_model(ticker, historical_prices, features)
-        arima_results = self.build_arima_model(ticker, historical_prices)
+        lstm_results = self.build_lstm_model(ticker, historical_prices, features, times=times)
+        arima_results = self.build_arima_model(ticker, historical_prices, times=times)
         lstm_error = lstm_results.get('error', None)
         arima_error = arima_results.get('error', None)
         models_available = []
@@ -877,6 +732,16 @@ class PredictionAnalytics:
                     'weight_explanation': ' | '.join(weight_explanations)
                 }
                 
+        # Прогнозы каждой модели сохраняются для подбора весов по фактическим ценам
+        model_forecasts = {}
+        if 'lstm' in models_available:
+            model_forecasts['lstm'] = {interval: data['price'] for interval, data in lstm_results.get('predictions', {}).items()}
+        if 'arima' in models_available:
+            model_forecasts['arima'] = {interval: data['price'] for interval, data in arima_results.get('predictions', {}).items()}
+        # Прогнозы привязаны к последней свече: повторный расчет по тем же данным не добавляет строк
+        forecast_time = times[-1] if times is not None and len(times) else datetime.now()
+        get_prediction_store(ticker, self.prediction_dir).append_models(forecast_time, historical_prices[-1], model_forecasts)
+        
         chart_path = self.plot_model_comparison(ticker, historical_prices, lstm_results.get('predictions', {}), arima_results.get('predictions', {}), combined_predictions, final_weights)
         
         return {
@@ -891,6 +756,7 @@ class PredictionAnalytics:
             'chart_path': chart_path
         }
 
+    @synchronized_plot
     def plot_model_comparison(self, ticker, historical_prices, lstm_predictions, arima_predictions, combined_predictions, dynamic_weights=None):
         if not os.path.exists('static/analytics'):
             os.makedirs('static/analytics')
@@ -990,21 +856,22 @@ class PredictionAnalytics:
         plt.close()
         return f'/{chart_path}'
 
-    def meta_learning(self, ticker):
-        predictions = self.load_predictions(ticker)
+    def meta_learning(self, ticker, charts=True):
+        tables = self.load_prediction_tables(ticker)
+        predictions = as_dicts(*tables)
         if len(predictions) < 10:
             return {"error": "Недостаточно данных для метаобучения", "recommendation": "Необходимо минимум 10 прогнозов в истории"}
         meta_data = {'15': [], '30': [], '60': []}
         for interval in meta_data.keys():
-            prediction_actual_pairs = self.get_prediction_actual_pairs(predictions, interval)
+            prediction_actual_pairs = self.get_prediction_actual_pairs(tables, interval)
             if len(prediction_actual_pairs) < 5:
                 continue
+            by_timestamp = {}
+            for pred in predictions:
+                if interval in pred.get('predictions', {}):
+                    by_timestamp.setdefault(pred['timestamp'], pred)
             for pair in prediction_actual_pairs:
-                original_prediction = None
-                for pred in predictions:
-                    if pred['timestamp'] == pair['timestamp'] and interval in pred.get('predictions', {}):
-                        original_prediction = pred
-                        break
+                original_prediction = by_timestamp.get(pair['timestamp'])
                 if not original_prediction:
                     continue
                 prediction_diff = ((pair['predicted'] - pair['current_price']) / pair['current_price']) * 100
@@ -1116,7 +983,7 @@ class PredictionAnalytics:
                 except Exception as e:
                     correction_model = None
                     model_description = f"Ошибка при создании модели: {str(e)}"
-            chart_path = self.plot_meta_learning_analysis(ticker, interval, df)
+            chart_path = self.plot_meta_learning_analysis(ticker, interval, df) if charts else None
             meta_learning_results[interval] = {
                 'sample_size': len(data),
                 'bias': bias,
@@ -1127,10 +994,9 @@ class PredictionAnalytics:
                 'has_correction_model': correction_model is not None,
                 'chart_path': chart_path
             }
-            if correction_model is not None:
-                meta_learning_results[interval]['model'] = 'correction_model_object'
         return meta_learning_results
 
+    @synchronized_plot
     def plot_meta_learning_analysis(self, ticker, interval, df):
         if not os.path.exists('static/analytics'):
             os.makedirs('static/analytics')
@@ -1219,8 +1085,9 @@ class PredictionAnalytics:
         plt.close()
         return f'/{chart_path}'
 
-    def apply_meta_learning_corrections(self, ticker, predictions):
-        meta_learning_results = self.meta_learning(ticker)
+    def apply_meta_learning_corrections(self, ticker, predictions, charts=False):
+        # Правила коррекции обучаются заранее и переобучаются по мере накопления разрешенных прогнозов
+        meta_learning_results = get_meta_learning_cache().results(self, ticker)
         if isinstance(meta_learning_results, dict) and 'error' in meta_learning_results:
             return predictions, {'applied': False, 'reason': meta_learning_results['error'], 'original_predictions': predictions}
         corrected_predictions = {}
@@ -1269,10 +1136,11 @@ class PredictionAnalytics:
                 correction_details['intervals'][interval] = {'applied': False, 'reason': 'Нет данных метаобучения для этого интервала'}
         correction_details['applied'] = any(details.get('applied', False) for details in correction_details['intervals'].values())
         correction_details['original_predictions'] = predictions
-        chart_path = self.plot_meta_learning_corrections(ticker, predictions, corrected_predictions, correction_details)
-        correction_details['chart_path'] = chart_path
+        if charts:
+            correction_details['chart_path'] = self.plot_meta_learning_corrections(ticker, predictions, corrected_predictions, correction_details)
         return corrected_predictions, correction_details
 
+    @synchronized_plot
     def plot_meta_learning_corrections(self, ticker, original_predictions, corrected_predictions, correction_details):
         if not os.path.exists('static/analytics'):
             os.makedirs('static/analytics')
@@ -0,0 +1,358 @@
+import os
+import sys
+import json
+import atexit
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from file_lock import file_lock
+
+PREDICTION_STORE_DIR = 'data/predictions'
+PREDICTION_FLUSH_RECORDS = int(os.getenv('PRISMTRADE_PREDICTION_FLUSH_RECORDS', '32'))
+PREDICTION_FLUSH_SECONDS = float(os.getenv('PRISMTRADE_PREDICTION_FLUSH_SECONDS', '1'))
+PREDICTION_RECORD = np.dtype([('time', np.int64), ('current_price', np.float64), ('volatility', np.float64)])
+PREDICTION_HORIZON = np.dtype([('time', np.int64), ('interval', np.int64), ('price', np.float64), ('change', np.float64)])
+MODEL_FORECAST = np.dtype([('time', np.int64), ('model', 'S16'), ('interval', np.int64), ('price', np.float64), ('current_price', np.float64)])
+EPOCH = datetime(1970, 1, 1)
+MATCH_TOLERANCE = 5 * 60 * 1000000
+PREDICTION_REORDER_MICROS = int(2 * PREDICTION_FLUSH_SECONDS * 1000000)
+
+def to_micros(timestamp):
+    """Наивное локальное время (как в datetime.now()) в микросекунды от 1970-01-01.
+
+    Время с часовым поясом (свечи приходят в Europe/Moscow) сначала переводится
+    в локальное время сервера, чтобы все таблицы шли по одним часам.
+    """
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+def from_micros(value):
+    return EPOCH + timedelta(microseconds=int(value))
+
+def as_dicts(records, horizons):
+    """Таблицы из PredictionStore.read() в прежний формат словарей {'timestamp', 'current_price', 'predictions'}."""
+    starts = np.searchsorted(horizons['time'], records['time'], side='left')
+    ends = np.searchsorted(horizons['time'], records['time'], side='right')
+    rows = horizons.tolist()
+    predictions = []
+    for record, start, end in zip(records.tolist(), starts.tolist(), ends.tolist()):
+        time, current_price, volatility = record
+        predictions.append({
+            'timestamp': from_micros(time).isoformat(),
+            'current_price': current_price,
+            'predictions': {str(interval): {'price': price, 'change': change} for _, interval, price, change in rows[start:end]}
+        })
+    return predictions
+
+def match_actuals(times, offset, tolerance=MATCH_TOLERANCE):
+    """Для каждого прогноза i - индекс j > i, время которого ближе всего к times[i] + offset.
+
+    times - отсортированные микросекунды. При равном расстоянии берется более
+    ранний индекс; если ближайший прогноз дальше tolerance, индекс равен -1.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    count = len(times)
+    if count == 0:
+        return np.empty(0, dtype=np.int64)
+    positions = np.arange(count)
+    target = times + offset
+    right = np.searchsorted(times, target, side='left')
+    left = right - 1
+    has_left = left > positions
+    # Среди одинаковых времен слева нужен первый индекс после i
+    left = np.maximum(np.searchsorted(times, times[np.maximum(left, 0)], side='left'), positions + 1)
+    has_right = right < count
+    left_diff = np.where(has_left, target - times[np.minimum(left, count - 1)], np.iinfo(np.int64).max)
+    right_diff = np.where(has_right, times[np.minimum(right, count - 1)] - target, np.iinfo(np.int64).max)
+    use_left = left_diff <= right_diff
+    matched = np.where(use_left, left, right)
+    matched_diff = np.where(use_left, left_diff, right_diff)
+    return np.where(matched_diff <= tolerance, matched, -1)
+
+def match_times(times, targets, tolerance=MATCH_TOLERANCE):
+    """Для каждого targets[k] - индекс ближайшего времени в отсортированном times или -1 дальше tolerance.
+
+    При равном расстоянии, как и в match_actuals, берется более ранний индекс.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    if len(times) == 0:
+        return np.full(len(targets), -1, dtype=np.int64)
+    right = np.minimum(np.searchsorted(times, targets, side='left'), len(times) - 1)
+    # Среди одинаковых времен слева нужен первый индекс
+    left = np.searchsorted(times, times[np.maximum(right - 1, 0)], side='left')
+    use_left = np.abs(targets - times[left]) <= np.abs(times[right] - targets)
+    matched = np.where(use_left, left, right)
+    return np.where(np.abs(times[matched] - targets) <= tolerance, matched, -1)
+
+def read_table(path, dtype, since=None):
+    if not os.path.exists(path):
+        return np.empty(0, dtype=dtype)
+    # Недописанная после сбоя последняя строка отбрасывается
+    count = os.path.getsize(path) // dtype.itemsize
+    if since is None or count == 0:
+        return np.fromfile(path, dtype=dtype, count=count)
+    # Хвост ищем бинарным поиском по файлу; запас покрывает пачки, сброшенные разными процессами не по порядку
+    table = np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+    start = int(np.searchsorted(table['time'], since - PREDICTION_REORDER_MICROS, side='left'))
+    return np.array(table[start:])
+
+def write_table(path, table):
+    temporary = path + '.tmp'
+    table.tofile(temporary)
+    os.replace(temporary, path)
+
+class PredictionStore:
+    """Append-only история прогнозов одного тикера в двух бинарных таблицах.
+
+    records.bin - строка на каждый сохраненный прогноз (время в микросекундах,
+    текущая цена, волатильность), horizons.bin - строка на каждый горизонт
+    прогноза, связанная с записью по времени. Запись считается сохраненной,
+    когда дописана ее строка в records.bin, поэтому горизонты пишутся первыми.
+    Записи копятся в памяти и сбрасываются пачками (PREDICTION_FLUSH_RECORDS
+    штук или через PREDICTION_FLUSH_SECONDS секунд); чтение сначала сбрасывает
+    буфер. Таблицы отсортированы по времени, пока их дописывают по порядку;
+    compact() сортирует, убирает дубликаты и осиротевшие горизонты.
+    models.bin - прогнозы отдельных моделей ансамбля (LSTM, ARIMA) на каждый
+    горизонт с ценой на момент прогноза; пишутся сразу, без буфера, повторный
+    прогноз той же модели на тот же момент и интервал не дописывается.
+    """
+
+    def __init__(self, ticker, base_dir=PREDICTION_STORE_DIR):
+        self.ticker = ticker
+        self.path = os.path.join(base_dir, ticker)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.records_path = os.path.join(self.path, 'records.bin')
+        self.horizons_path = os.path.join(self.path, 'horizons.bin')
+        self.models_path = os.path.join(self.path, 'models.bin')
+        self.lock = threading.Lock()
+        self.pending_records = []
+        self.pending_horizons = []
+        self.timer = None
+
+    def append(self, timestamp, current_price, predictions, volatility=None):
+        """Добавляет прогноз; predictions - {интервал: {'price', 'change'}}, прочие ключи игнорируются."""
+        time = to_micros(timestamp)
+        with self.lock:
+            self.pending_records.append((time, current_price, np.nan if volatility is None else volatility))
+            for interval, data in predictions.items():
+                if isinstance(data, dict) and str(interval).isdigit():
+                    self.pending_horizons.append((time, int(interval), data['price'], data['change']))
+            if len(self.pending_records) >= PREDICTION_FLUSH_RECORDS:
+                self._flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(PREDICTION_FLUSH_SECONDS, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending_records:
+            return
+        with file_lock(self.path):
+            self._write_pending()
+
+    def _write_pending(self):
+        horizons = np.array(self.pending_horizons, dtype=PREDICTION_HORIZON)
+        records = np.array(self.pending_records, dtype=PREDICTION_RECORD)
+        with open(self.horizons_path, 'ab') as f:
+            f.write(horizons.tobytes())
+        with open(self.records_path, 'ab') as f:
+            f.write(records.tobytes())
+        self.pending_records = []
+        self.pending_horizons = []
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def read(self, since=None):
+        """Возвращает (records, horizons) - структурированные массивы, отсортированные по времени.
+
+        since - наивное время или микросекунды; горизонты без сохраненной записи отбрасываются.
+        """
+        if since is not None:
+            since = since if isinstance(since, (int, np.integer)) else to_micros(since)
+        with self.lock:
+            self._flush()
+            records = read_table(self.records_path, PREDICTION_RECORD, since)
+            horizons = read_table(self.horizons_path, PREDICTION_HORIZON, since)
+        if len(records) > 1 and np.any(np.diff(records['time']) < 0):
+            records = records[np.argsort(records['time'], kind='stable')]
+        if len(horizons) > 1 and np.any(np.diff(horizons['time']) < 0):
+            horizons = horizons[np.argsort(horizons['time'], kind='stable')]
+        if since is not None:
+            records = records[np.searchsorted(records['time'], since, side='left'):]
+            horizons = horizons[np.searchsorted(horizons['time'], since, side='left'):]
+        if len(horizons) and not np.all(np.isin(horizons['time'], records['time'])):
+            horizons = horizons[np.isin(horizons['time'], records['time'])]
+        return records, horizons
+
+    def append_models(self, timestamp, current_price, forecasts):
+        """Сохраняет прогнозы моделей ансамбля; forecasts - {модель: {интервал: цена}}.
+
+        timestamp - время последней свечи, по которой построен прогноз; уже
+        сохраненные строки с тем же (время, модель, интервал) пропускаются.
+        """
+        time = to_micros(timestamp)
+        rows = [(time, model.encode(), int(interval), price, current_price)
+                for model, prices in forecasts.items() for interval, price in prices.items()]
+        if not rows:
+            return
+        with self.lock, file_lock(self.path):
+            existing = read_table(self.models_path, MODEL_FORECAST, since=time)
+            existing = {(model, int(interval)) for model, interval in existing[existing['time'] == time][['model', 'interval']].tolist()}
+            rows = [row for row in rows if (row[1], row[2]) not in existing]
+            if rows:
+                with open(self.models_path, 'ab') as f:
+                    f.write(np.array(rows, dtype=MODEL_FORECAST).tobytes())
+
+    def read_models(self, since=None):
+        """Прогнозы моделей ансамбля, отсортированные по времени."""
+        if since is not None:
+            since = since if isinstance(since, (int, np.integer)) else to_micros(since)
+        with self.lock:
+            forecasts = read_table(self.models_path, MODEL_FORECAST, since)
+        if len(forecasts) > 1 and np.any(np.diff(forecasts['time']) < 0):
+            forecasts = forecasts[np.argsort(forecasts['time'], kind='stable')]
+        if since is not None:
+            forecasts = forecasts[np.searchsorted(forecasts['time'], since, side='left'):]
+        return forecasts
+
+    def frame(self, since=None):
+        """История в DataFrame: индекс - время, колонки current_price, volatility, price_<интервал>, change_<интервал>."""
+        records, horizons = self.read(since)
+        df = pd.DataFrame({'current_price': records['current_price'], 'volatility': records['volatility']},
+                          index=pd.to_datetime(records['time'], unit='us'))
+        if len(horizons):
+            wide = pd.DataFrame({'time': pd.to_datetime(horizons['time'], unit='us'), 'interval': horizons['interval'],
+                                 'price': horizons['price'], 'change': horizons['change']})
+            wide = wide.drop_duplicates(['time', 'interval'], keep='last').pivot(index='time', columns='interval')
+            wide.columns = [f'{name}_{interval}' for name, interval in wide.columns]
+            df = df.join(wide)
+        df.index.name = 'timestamp'
+        return df
+
+    def load(self, since=None):
+        """История в прежнем формате словарей {'timestamp', 'current_price', 'predictions'}."""
+        return as_dicts(*self.read(since))
+
+    def __len__(self):
+        self.flush()
+        return os.path.getsize(self.records_path) // PREDICTION_RECORD.itemsize if os.path.exists(self.records_path) else 0
+
+    def compact(self):
+        """Сортирует таблицы по времени, убирает повторные записи и осиротевшие горизонты.
+
+        Таблицы переписываются под блокировкой каталога (file_lock), поэтому
+        строки, которые другой процесс дописывает в это время, не теряются.
+        """
+        with self.lock, file_lock(self.path):
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.pending_records:
+                self._write_pending()
+            records = read_table(self.records_path, PREDICTION_RECORD)
+            horizons = read_table(self.horizons_path, PREDICTION_HORIZON)
+            records = records[np.argsort(records['time'], kind='stable')]
+            if len(records):
+                keep = np.append(records['time'][1:] != records['time'][:-1], True)
+                records = records[keep]
+            horizons = horizons[np.isin(horizons['time'], records['time'])]
+            horizons = horizons[np.lexsort((horizons['interval'], horizons['time']))]
+            if len(horizons):
+                keep = np.append((horizons['time'][1:] != horizons['time'][:-1]) | (horizons['interval'][1:] != horizons['interval'][:-1]), True)
+                horizons = horizons[keep]
+            # Сначала горизонты: при сбое между заменами записи из records.bin не теряют свои горизонты
+            write_table(self.horizons_path, horizons)
+            write_table(self.records_path, records)
+            if os.path.exists(self.models_path):
+                forecasts = read_table(self.models_path, MODEL_FORECAST)
+                forecasts = forecasts[np.lexsort((forecasts['interval'], forecasts['model'], forecasts['time']))]
+                if len(forecasts):
+                    # Как и append_models, из повторов (время, модель, интервал) оставляем первый записанный
+                    keep = np.append(True, (forecasts['time'][1:] != forecasts['time'][:-1]) | (forecasts['model'][1:] != forecasts['model'][:-1])
+                                     | (forecasts['interval'][1:] != forecasts['interval'][:-1]))
+                    forecasts = forecasts[keep]
+                write_table(self.models_path, forecasts)
+            return len(records)
+
+    def migrate_json(self, remove=False):
+        """Переносит старые файлы <timestamp>.json из каталога тикера в хранилище.
+
+        Перенесенные файлы переименовываются в .json.migrated (remove=True -
+        удаляются); файлы, которые не удалось прочитать или в которых нет
+        нужных полей, остаются на месте. Возвращает число перенесенных прогнозов.
+        """
+        files = sorted(f for f in os.listdir(self.path) if f.endswith('.json'))
+        entries = []
+        for file in files:
+            try:
+                with open(os.path.join(self.path, file), 'r') as f:
+                    entry = json.load(f)
+                predictions = entry.get('predictions', {})
+                # Проверяем все поля до записи, чтобы испорченный файл не оставил половину прогноза
+                time = to_micros(entry['timestamp'])
+                current_price = float(entry['current_price'])
+                horizons = {interval: {'price': float(data['price']), 'change': float(data['change'])}
+                            for interval, data in predictions.items() if isinstance(data, dict) and str(interval).isdigit()}
+                volatility = predictions.get('volatility')
+            except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+                print(f"Пропущен файл {file}: {e!r}")
+                continue
+            entries.append((time, file, current_price, horizons, volatility))
+        entries.sort(key=lambda entry: entry[0])
+        for time, _, current_price, horizons, volatility in entries:
+            self.append(from_micros(time), current_price, horizons, volatility)
+        self.compact()
+        for _, file, _, _, _ in entries:
+            path = os.path.join(self.path, file)
+            if remove:
+                os.remove(path)
+            else:
+                os.replace(path, path + '.migrated')
+        return len(entries)
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_prediction_store(ticker, base_dir=PREDICTION_STORE_DIR):
+    key = (base_dir, ticker)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = PredictionStore(ticker, base_dir)
+        return _stores[key]
+
+@atexit.register
+def flush_prediction_stores():
+    with _stores_lock:
+        stores = list(_stores.values())
+    for store in stores:
+        store.flush()
+
+def list_tickers(base_dir=PREDICTION_STORE_DIR):
+    if not os.path.exists(base_dir):
+        return []
+    return sorted(name for name in os.listdir(base_dir) if os.path.isdir(os.path.join(base_dir, name)))
+
+if __name__ == '__main__':
+    # python prediction_store.py migrate|compact [TICKER ...]
+    # Можно запускать при работающем сервере: запись и сжатие идут под file_lock каталога тикера
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command not in ('migrate', 'compact'):
+        print("Использование: python prediction_store.py migrate|compact [TICKER ...]")
+        sys.exit(1)
+    for ticker in sys.argv[2:] or list_tickers():
+        store = get_prediction_store(ticker)
+        if command == 'migrate':
+            print(f"{ticker}: перенесено {store.migrate_json()} прогнозов")
+        else:
+            print(f"{ticker}: после сжатия {store.compact()} прогнозов")
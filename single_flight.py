@@ -0,0 +1,74 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+
+RESULT_CACHE_TTL_SECONDS = float(os.getenv('PRISMTRADE_RESULT_CACHE_TTL', '60'))
+RESULT_CACHE_MAX_ENTRIES = 1000
+CANDLE_SECONDS = 5 * 60
+
+def candle_bucket(timestamp):
+    return int(timestamp // CANDLE_SECONDS)
+
+class SingleFlight:
+    """Объединение одинаковых одновременных запросов и короткий кэш их результатов.
+
+    Ключ включает номер 5-минутной свечи, поэтому с началом новой свечи
+    результаты перестают совпадать с ключом и считаются заново. Внутри
+    свечи результат живет не дольше ttl секунд. Работает в цикле событий,
+    поэтому блокировки не нужны.
+    """
+
+    def __init__(self, ttl=RESULT_CACHE_TTL_SECONDS, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.in_flight = {}
+        self.results = OrderedDict()
+        self.counters = {'hits': 0, 'coalesced': 0, 'misses': 0}
+
+    def _cached(self, key):
+        entry = self.results.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if time.monotonic() >= expires_at:
+            del self.results[key]
+            return None
+        return entry
+
+    async def _execute(self, key, factory, cacheable):
+        try:
+            result = await factory()
+        finally:
+            self.in_flight.pop(key, None)
+        if self.ttl > 0 and cacheable(result):
+            self.results[key] = (time.monotonic() + self.ttl, result)
+            while len(self.results) > self.max_entries:
+                self.results.popitem(last=False)
+        return result
+
+    async def run(self, key, factory, cacheable=lambda result: True):
+        entry = self._cached(key)
+        if entry is not None:
+            self.counters['hits'] += 1
+            return entry[1]
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.counters['coalesced'] += 1
+        else:
+            self.counters['misses'] += 1
+            # Отдельная задача: отмена первого запроса не отменяет расчет для остальных
+            task = asyncio.ensure_future(self._execute(key, factory, cacheable))
+            self.in_flight[key] = task
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return dict(self.counters, in_flight=len(self.in_flight), cached=len(self.results))
+
+_single_flight = None
+
+def get_single_flight():
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight()
+    return _single_flight
@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from accuracy_metrics import MetricsAccumulator
+from prediction_store import PredictionStore
+
+START = datetime(2026, 1, 5, 10, 0)
+
+def fill(prediction_dir, count, seed=3):
+    rng = np.random.default_rng(seed)
+    store = PredictionStore('TEST', str(prediction_dir))
+    prices = 100 + np.cumsum(rng.normal(0, 0.5, count))
+    for i, price in enumerate(prices):
+        predictions = {interval: {'price': price * (1 + rng.normal(0, 0.01)), 'change': 0.0} for interval in ('15', '30')}
+        store.append(START + timedelta(minutes=5 * i), float(price), predictions)
+    store.flush()
+
+def test_rebuild_after_load(tmp_path):
+    fill(tmp_path / 'predictions', 40)
+    first = MetricsAccumulator('TEST', str(tmp_path / 'predictions'), str(tmp_path / 'metrics'))
+    first.update()
+    expected = first.report()
+    assert expected is not None
+    loaded = MetricsAccumulator('TEST', str(tmp_path / 'predictions'), str(tmp_path / 'metrics'))
+    loaded.update()
+    loaded.rebuild()
+    assert loaded.records == 40
+    assert loaded.report() == expected
+
+def test_update_reloads_rebuilt_file(tmp_path):
+    fill(tmp_path / 'server', 40)
+    fill(tmp_path / 'other', 40, seed=4)
+    server = MetricsAccumulator('TEST', str(tmp_path / 'server'), str(tmp_path / 'metrics'))
+    server.update()
+    # Другой процесс пересчитал метрики и перезаписал файл
+    other = MetricsAccumulator('TEST', str(tmp_path / 'other'), str(tmp_path / 'metrics'))
+    other.rebuild()
+    server.update()
+    assert server.report()['metrics'] == other.report()['metrics']
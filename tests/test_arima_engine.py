@@ -0,0 +1,43 @@
+import warnings
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+pytest.importorskip('statsmodels')
+
+from arima_engine import ARIMACache, fit_arima
+
+def series(count=160, seed=0):
+    rng = np.random.default_rng(seed)
+    prices = 100 + np.cumsum(rng.normal(size=count))
+    times = [datetime(2026, 1, 5, 10, 0) + timedelta(minutes=5 * i) for i in range(count)]
+    return prices, times
+
+@pytest.fixture(autouse=True)
+def quiet():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        yield
+
+def test_forming_candle_is_not_absorbed():
+    prices, times = series()
+    cache = ARIMACache()
+    partial = prices[:150].copy()
+    partial[-1] += 3
+    cache.forecast('TEST', partial, times[:150], 12)
+    forecast, info = cache.forecast('TEST', prices[:150], times[:150], 12)
+    assert info['status'] == 'hit'
+    # Модель видела только завершенные свечи, прогноз - от последнего закрытия текущей
+    expected = fit_arima(prices[:149])['result'].append(prices[149:150], refit=False).forecast(12)
+    np.testing.assert_allclose(forecast, expected)
+
+def test_new_candles_are_appended():
+    prices, times = series()
+    cache = ARIMACache()
+    cache.forecast('TEST', prices[:150], times[:150], 12)
+    forecast, info = cache.forecast('TEST', prices[3:153], times[3:153], 12)
+    assert info['status'] == 'append'
+    expected = fit_arima(prices[:149])['result'].append(prices[149:153], refit=False).forecast(12)
+    np.testing.assert_allclose(forecast, expected)
+    assert len(info['result'].resid) == 153
@@ -0,0 +1,59 @@
+import numpy as np
+from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.linear_model import LinearRegression
+from sklearn.metrics import mean_absolute_error, mean_squared_error
+from sklearn.model_selection import TimeSeriesSplit
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+
+from cv_engine import cross_validate_models, search_gradient_boosting
+
+GRID = {'n_estimators': [5, 10], 'learning_rate': [0.1, 0.2], 'max_depth': [2, 3]}
+
+def data(rows=80, seed=0):
+    rng = np.random.RandomState(seed)
+    X = rng.normal(size=(rows, 4))
+    y = X[:, 0] * 2 + np.sin(X[:, 1]) + rng.normal(scale=0.1, size=rows)
+    return X, y
+
+def fold_scores(model, X, y, n_splits):
+    # Прежний последовательный цикл из PredictionAnalytics
+    rmse_scores, mae_scores = [], []
+    for train_idx, test_idx in TimeSeriesSplit(n_splits=n_splits).split(X):
+        scaler = StandardScaler()
+        y_pred = model.fit(scaler.fit_transform(X[train_idx]), y[train_idx]).predict(scaler.transform(X[test_idx]))
+        rmse_scores.append(np.sqrt(mean_squared_error(y[test_idx], y_pred)))
+        mae_scores.append(mean_absolute_error(y[test_idx], y_pred))
+    return rmse_scores, mae_scores
+
+def test_cross_validation_matches_sequential_loop():
+    X, y = data()
+    models = {
+        'linear': LinearRegression(),
+        'polynomial': Pipeline([('poly', PolynomialFeatures(degree=2)), ('linear', LinearRegression())]),
+        'gradient_boosting': GradientBoostingRegressor(n_estimators=50, learning_rate=0.1, max_depth=3, random_state=42)
+    }
+    results = cross_validate_models(X, y, n_jobs=2)
+    for name, model in models.items():
+        rmse_scores, mae_scores = fold_scores(model, X, y, 5)
+        np.testing.assert_allclose(results[name]['rmse_scores'], rmse_scores, rtol=1e-9)
+        np.testing.assert_allclose(results[name]['mae_scores'], mae_scores, rtol=1e-9)
+
+def test_grid_search_matches_sequential_loop():
+    X, y = data()
+    expected = []
+    for n_estimators in GRID['n_estimators']:
+        for learning_rate in GRID['learning_rate']:
+            for max_depth in GRID['max_depth']:
+                model = GradientBoostingRegressor(n_estimators=n_estimators, learning_rate=learning_rate, max_depth=max_depth, random_state=42)
+                params = {'n_estimators': n_estimators, 'learning_rate': learning_rate, 'max_depth': max_depth}
+                expected.append((params, np.mean(fold_scores(model, X, y, 3)[0])))
+    best_params, best_rmse, results = search_gradient_boosting(X, y, grid=GRID, n_jobs=2, method='grid')
+    assert [result['params'] for result in results] == [params for params, _ in expected]
+    np.testing.assert_allclose([result['avg_rmse'] for result in results], [score for _, score in expected], rtol=1e-9)
+    assert best_params == min(expected, key=lambda item: item[1])[0]
+    # Последовательное деление оставляет часть кандидатов, но их оценка - по всем фолдам, как у полного перебора
+    _, _, halving = search_gradient_boosting(X, y, grid=GRID, n_jobs=2, method='halving')
+    full = {tuple(params.values()): score for params, score in expected}
+    for result in halving:
+        assert np.isclose(result['avg_rmse'], full[tuple(result['params'].values())], rtol=1e-9)
@@ -0,0 +1,34 @@
+import itertools
+
+import numpy as np
+
+from ensemble_weights import search_weights
+
+def brute_force(forecasts, actuals, starts, step=0.1):
+    # Перебор всех весов с шагом step (каждый не меньше step, сумма 1) и явный расчет ошибки по группам
+    units = int(round(1 / step))
+    best = None
+    for parts in itertools.product(range(1, units), repeat=len(forecasts) - 1):
+        if sum(parts) >= units:
+            continue
+        weights = [part * step for part in parts] + [1.0 - sum(part * step for part in parts)]
+        bounds = list(starts) + [len(actuals)]
+        errors = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            ensemble = [sum(weights[m] * forecasts[m][k] for m in range(len(forecasts))) for k in range(start, end)]
+            errors.append(np.mean([abs(value - actuals[k]) / actuals[k] for value, k in zip(ensemble, range(start, end))]))
+        error = np.mean(errors)
+        if best is None or error < best[1]:
+            best = (weights, error)
+    return best
+
+def test_grid_search_matches_brute_force():
+    rng = np.random.default_rng(0)
+    actuals = 100 + rng.normal(size=60)
+    starts = np.array([0, 7, 20, 21, 40, 55])
+    for models in (2, 3):
+        forecasts = actuals + rng.normal(scale=rng.uniform(0.5, 3, size=(models, 1)), size=(models, 60))
+        weights, error = search_weights(forecasts, actuals, starts, solver='grid')
+        expected_weights, expected_error = brute_force(forecasts, actuals, starts)
+        np.testing.assert_allclose(weights, expected_weights, atol=1e-12)
+        assert np.isclose(error, expected_error, rtol=1e-12)
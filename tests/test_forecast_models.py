@@ -0,0 +1,20 @@
+import numpy as np
+
+from forecast_models import HorizonModels
+
+def data(count=120, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(count, 6))
+    y = 250 + np.cumsum(rng.normal(scale=0.3, size=count))
+    return X, y, list(range(count))
+
+def test_update_does_not_train_on_forming_close():
+    X, y, row_times = data()
+    predictions = []
+    for forming_close in (y[-1], y[-1] + 5):
+        models = HorizonModels([3, 6]).fit(X[:110], y[:110], row_times[:110])
+        y_live = y.copy()
+        y_live[-1] = forming_close
+        assert models.update(X, y_live, row_times) == 'update'
+        predictions.append([models.models[group]['boosting'].predict(X[-1:])[0] for group in models.groups])
+    assert np.allclose(predictions[0], predictions[1])
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from indicator_engine import IncrementalIndicatorEngine, INDICATOR_COLUMNS, warmup_rows
+
+main = pytest.importorskip('main')
+
+WINDOW = 120
+
+def candles(count, seed=7):
+    rng = np.random.default_rng(seed)
+    prices = 250 + np.cumsum(rng.normal(0, 0.4, count))
+    volumes = rng.integers(100, 5000, count)
+    times = 1700000000 + 60 * np.arange(count)
+    return times.tolist(), prices.tolist(), volumes.tolist()
+
+def batch(prices, volumes):
+    return main.StockPredictor._calculate_technical_indicators_pandas(None, prices, volumes)
+
+def assert_same(incremental, reference):
+    for column in INDICATOR_COLUMNS + ['volume']:
+        left = incremental[column].to_numpy(dtype=float)
+        right = reference[column].to_numpy(dtype=float)
+        assert np.array_equal(np.isnan(left), np.isnan(right)), column
+        np.testing.assert_allclose(left, right, rtol=1e-7, atol=1e-8, equal_nan=True, err_msg=column)
+
+def test_fresh_engine_matches_batch():
+    times, prices, volumes = candles(WINDOW)
+    engine = IncrementalIndicatorEngine()
+    engine.sync(times, prices, volumes)
+    assert_same(engine.frame(last=WINDOW), batch(prices, volumes))
+
+@pytest.mark.parametrize('shift', [1, 17, 60, 300])
+def test_sliding_window_continues_from_seed(shift):
+    times, prices, volumes = candles(WINDOW + shift)
+    engine = IncrementalIndicatorEngine()
+    # Затравка - первое окно; дальше движок только продолжает свое состояние
+    engine.sync(times[:WINDOW], prices[:WINDOW], volumes[:WINDOW])
+    window = slice(shift, shift + WINDOW)
+    engine.sync(times[window], prices[window], volumes[window])
+    # Эталон - пакетный расчет по всем поданным свечам (при shift > WINDOW - с разрывом)
+    fed = list(range(WINDOW)) + list(range(max(WINDOW, shift), shift + WINDOW))
+    reference = batch([prices[i] for i in fed], [volumes[i] for i in fed]).iloc[-WINDOW:].reset_index(drop=True)
+    assert_same(engine.frame(last=WINDOW), reference)
+
+def test_forming_candle_is_replaced():
+    times, prices, volumes = candles(WINDOW)
+    engine = IncrementalIndicatorEngine()
+    engine.sync(times, prices[:-1] + [prices[-1] + 5], volumes)
+    engine.sync(times[-1:], prices[-1:], volumes[-1:])
+    assert_same(engine.frame(last=WINDOW), batch(prices, volumes))
+
+def test_short_seed_price_ma_50():
+    times, prices, volumes = candles(30)
+    engine = IncrementalIndicatorEngine()
+    engine.sync(times, prices, volumes)
+    assert_same(engine.frame(last=30), batch(prices, volumes))
+
+@pytest.mark.parametrize('count', [40, 51, 120])
+def test_warmup_rows_is_first_complete_row(count):
+    _, prices, volumes = candles(count)
+    assert batch(prices, volumes).dropna().index[0] == warmup_rows(count)
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from indicator_kernels import INDICATOR_COLUMNS, align_candles, compute_indicators, compute_indicators_batch
+
+main = pytest.importorskip('main')
+
+def pandas_indicators(prices, volumes):
+    return main.StockPredictor._calculate_technical_indicators_pandas(None, prices, volumes)
+
+def series(count, seed):
+    rng = np.random.default_rng(seed)
+    prices = 250 + np.cumsum(rng.normal(0, 0.4, count))
+    # Участок без движения цены: окна из одинаковых значений и нулевые потери в RSI
+    prices[count // 3:count // 3 + 25] = prices[count // 3]
+    volumes = rng.integers(0, 5000, count)
+    return prices, volumes
+
+def assert_columns_equal(values, reference, columns):
+    # На ровном участке pandas дает std порядка 1e-7 вместо нуля, а percent_b - 0/0 из этого шума
+    flat = reference['std'].to_numpy(dtype=float) < 1e-6
+    for column in columns:
+        left = np.asarray(values[column], dtype=float)
+        right = reference[column].to_numpy(dtype=float)
+        if column == 'percent_b':
+            left, right = left[~flat], right[~flat]
+        assert np.array_equal(np.isnan(left), np.isnan(right)), column
+        np.testing.assert_allclose(left, right, rtol=1e-7, atol=1e-6, equal_nan=True, err_msg=column)
+
+@pytest.mark.parametrize('count', [3, 30, 120])
+def test_kernels_match_pandas(count):
+    prices, volumes = series(count, count)
+    assert_columns_equal(compute_indicators(prices, volumes), pandas_indicators(prices, volumes), INDICATOR_COLUMNS)
+
+def test_align_candles_matches_pandas():
+    rng = np.random.default_rng(3)
+    series_list = []
+    for _ in range(3):
+        times = np.sort(rng.choice(np.arange(1700000000, 1700000000 + 300 * 200, 300), 120, replace=False))
+        series_list.append((times, 100 + rng.normal(size=120).cumsum(), rng.integers(1, 100, 120)))
+    grid, closes, volumes = align_candles(series_list)
+    for row, (times, row_closes, row_volumes) in enumerate(series_list):
+        frame = pd.DataFrame({'close': row_closes, 'volume': row_volumes}, index=times).reindex(grid)
+        np.testing.assert_array_equal(closes[row], frame['close'].ffill().bfill().to_numpy())
+        np.testing.assert_array_equal(volumes[row], frame['volume'].fillna(0).to_numpy())
+
+def test_batch_matches_pandas_per_ticker():
+    rows = [series(150, seed) for seed in range(4)]
+    closes = np.array([prices for prices, _ in rows])
+    volumes = np.array([row_volumes for _, row_volumes in rows])
+    frame = compute_indicators_batch(closes, volumes, keys=['A', 'B', 'C', 'D'], times=np.arange(150))
+    for key, (prices, row_volumes) in zip('ABCD', rows):
+        assert_columns_equal(frame.loc[key], pandas_indicators(prices, row_volumes), INDICATOR_COLUMNS)
@@ -0,0 +1,24 @@
+import asyncio
+
+from live_updates import LiveUpdateHub
+
+def test_failed_compute_is_retried_within_the_candle():
+    results = [{'error': 'нет данных'}, {'ticker': 'TEST', 'current_price': 100.0}]
+    calls = []
+
+    async def compute(ticker):
+        calls.append(ticker)
+        return results[min(len(calls), len(results)) - 1]
+
+    async def scenario():
+        hub = LiveUpdateHub(compute, lambda: 1, poll_seconds=0.01)
+        queue = hub.subscribe('TEST')
+        events = [await asyncio.wait_for(queue.get(), 1) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        hub.unsubscribe('TEST', queue)
+        return events
+
+    events = asyncio.run(scenario())
+    assert [event for event, _ in events] == ['error', 'snapshot']
+    # После успеха та же свеча больше не считается
+    assert len(calls) == 2
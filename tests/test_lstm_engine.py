@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+
+import joblib
+import numpy as np
+import pytest
+from sklearn.preprocessing import MinMaxScaler
+
+from lstm_engine import LSTM_MODELS_VERSION, InsufficientHistory, LSTMRegistry, NumpyLSTM, random_runtime
+from prediction_store import to_micros
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+def reference_forward(runtime, batch):
+    """Прямой проход по формулам Keras LSTM в float64, шаг за шагом."""
+    sequence = np.asarray(batch, dtype=np.float64)
+    for kernel, recurrent, bias in runtime.layers:
+        kernel, recurrent, bias = (np.asarray(w, dtype=np.float64) for w in (kernel, recurrent, bias))
+        units = recurrent.shape[0]
+        h = np.zeros((len(sequence), units))
+        c = np.zeros((len(sequence), units))
+        outputs = []
+        for t in range(sequence.shape[1]):
+            z = sequence[:, t] @ kernel + h @ recurrent + bias
+            i, f, g, o = sigmoid(z[:, :units]), sigmoid(z[:, units:2 * units]), np.tanh(z[:, 2 * units:3 * units]), sigmoid(z[:, 3 * units:])
+            c = f * c + i * g
+            h = o * np.tanh(c)
+            outputs.append(h)
+        sequence = np.stack(outputs, axis=1)
+    return sequence[:, -1] @ runtime.dense_kernel.astype(np.float64) + runtime.dense_bias.astype(np.float64)
+
+@pytest.mark.parametrize('size', [1, 8])
+def test_numpy_lstm_matches_float64_reference(size):
+    runtime = random_runtime(time_steps=20)
+    batch = np.random.RandomState(1).uniform(size=(size, 20, 1))
+    np.testing.assert_allclose(runtime(batch), reference_forward(runtime, batch), atol=1e-5)
+
+def test_numpy_lstm_matches_keras():
+    tf = pytest.importorskip('tensorflow')
+    from lstm_engine import build_model
+    tf.keras.utils.set_random_seed(0)
+    model = build_model(20)
+    batch = np.random.RandomState(2).uniform(size=(8, 20, 1)).astype(np.float32)
+    expected = model(batch, training=False).numpy()
+    np.testing.assert_allclose(NumpyLSTM.from_keras(model)(batch), expected, atol=1e-5)
+
+def test_offline_reports_insufficient_history(tmp_path):
+    registry = LSTMRegistry(str(tmp_path))
+    runtime = random_runtime(time_steps=20)
+    runtime.save(registry._path('TEST', '.npz'))
+    prices = 100 + np.cumsum(np.random.RandomState(3).normal(size=80))
+    times = [datetime(2026, 1, 5, 10, 0) + timedelta(minutes=5 * i) for i in range(len(prices))]
+    joblib.dump({
+        'version': LSTM_MODELS_VERSION, 'model_version': 0, 'fine_tunes': 0, 'time_steps': 20,
+        'scaler': MinMaxScaler().fit(prices.reshape(-1, 1)), 'trained_until': to_micros(times[-1]), 'trained_at': 0.0, 'samples': 60
+    }, registry._path('TEST', '.joblib'))
+    with pytest.raises(InsufficientHistory):
+        registry.forecast('TEST', prices[:10], times[:10], 5, train=False)
+    trajectory, _, info = registry.forecast('TEST', prices, times, 5, train=False)
+    assert trajectory.shape == (5,)
+    with pytest.raises(LookupError):
+        registry.forecast('OTHER', prices, times, 5, train=False)
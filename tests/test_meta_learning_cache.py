@@ -0,0 +1,39 @@
+import threading
+
+import meta_learning_cache
+from meta_learning_cache import META_PENDING, MetaLearningCache
+
+class FakeAccumulator:
+    records = 0
+    intervals = {}
+
+    def update(self):
+        FakeAccumulator.records += 1
+
+class FakeAnalytics:
+    prediction_dir = 'unused'
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.trained = 0
+
+    def meta_learning(self, ticker, charts=False):
+        self.release.wait(5)
+        self.trained += 1
+        return {'15': {'trained': self.trained}}
+
+def test_retrain_runs_in_background(tmp_path, monkeypatch):
+    monkeypatch.setattr(meta_learning_cache, 'get_metrics_accumulator', lambda ticker, prediction_dir: FakeAccumulator())
+    cache = MetaLearningCache(str(tmp_path), retrain_predictions=0, check_seconds=0)
+    analytics = FakeAnalytics()
+    assert cache.results(analytics, 'TEST') == META_PENDING
+    analytics.release.set()
+    cache.wait(5)
+    analytics.release.clear()
+    # Переобучение снова начато, но запрос получает прежний результат, не дожидаясь его
+    assert cache.results(analytics, 'TEST') == {'15': {'trained': 1}}
+    assert cache.stats()['retraining'] == 1
+    analytics.release.set()
+    cache.wait(5)
+    assert cache.results(analytics, 'TEST') == {'15': {'trained': 2}}
+    assert (tmp_path / 'TEST.joblib').exists()
@@ -0,0 +1,113 @@
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+import pytz
+
+from prediction_analytics import PredictionAnalytics
+from prediction_store import MATCH_TOLERANCE, get_prediction_store, match_actuals, match_times, to_micros
+
+MOSCOW = pytz.timezone('Europe/Moscow')
+
+@pytest.fixture
+def utc_host(monkeypatch):
+    # Сервер в UTC, свечи - в Europe/Moscow: часы расходятся на 3 часа
+    monkeypatch.setenv('TZ', 'UTC')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+def test_candle_time_uses_local_clock(utc_host):
+    candle = MOSCOW.localize(datetime(2026, 1, 5, 13, 0))
+    assert to_micros(candle) == to_micros(datetime(2026, 1, 5, 10, 0))
+
+def test_model_forecasts_pair_with_now_keyed_records(utc_host, tmp_path):
+    store = get_prediction_store('TEST', str(tmp_path))
+    start = datetime(2026, 1, 5, 10, 0)
+    # Записи прогнозов - по datetime.now() (локальное время сервера), цена растет на 1 за 5 минут
+    for i in range(12):
+        store.append(start + timedelta(minutes=5 * i), 100.0 + i, {'15': {'price': 0.0, 'change': 0.0}})
+    store.flush()
+    # Прогнозы моделей - по времени последней свечи в Europe/Moscow
+    candle = MOSCOW.localize(datetime(2026, 1, 5, 13, 0))
+    store.append_models(candle, 100.0, {'lstm': {'15': 104.0}, 'arima': {'15': 102.0}})
+    forecasts, actuals, _ = PredictionAnalytics(str(tmp_path)).load_model_forecasts('TEST', ['lstm', 'arima'])
+    np.testing.assert_array_equal(forecasts[:, 0], [104.0, 102.0])
+    assert actuals.tolist() == [103.0]
+
+def append_from_worker(directory, worker, count):
+    store = get_prediction_store('TEST', directory)
+    for i in range(count):
+        store.append(datetime(2026, 1, 5) + timedelta(minutes=worker * 1000 + i), 100.0, {'15': {'price': 101.0, 'change': 1.0}})
+    # Буфер не сброшен явно: его сбросит финализатор воркера
+
+def test_process_workers_do_not_lose_rows(tmp_path):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from job_executor import init_process_worker
+    with ProcessPoolExecutor(3, mp_context=multiprocessing.get_context('spawn'), initializer=init_process_worker) as pool:
+        list(pool.map(append_from_worker, [str(tmp_path)] * 6, range(6), [50] * 6))
+    store = get_prediction_store('TEST', str(tmp_path))
+    assert len(store) == 300
+    assert store.compact() == 300
+
+def test_migrate_json_keeps_files_it_could_not_import(tmp_path):
+    import json
+    directory = tmp_path / 'TEST'
+    directory.mkdir()
+    good = {'timestamp': '2026-01-05T10:00:00', 'current_price': 100.0, 'predictions': {'15': {'price': 101.0, 'change': 1.0}, 'volatility': 0.5}}
+    (directory / '1.json').write_text(json.dumps(good))
+    (directory / '2.json').write_text('{"timestamp": ')
+    (directory / '3.json').write_text(json.dumps({'timestamp': '2026-01-05T10:05:00', 'current_price': 100.0, 'predictions': {'15': {'price': 101.0}}}))
+    store = get_prediction_store('TEST', str(tmp_path))
+    assert store.migrate_json() == 1
+    assert sorted(path.name for path in directory.iterdir() if 'json' in path.name) == ['1.json.migrated', '2.json', '3.json']
+    records, horizons = store.read()
+    assert len(records) == 1 and horizons['interval'].tolist() == [15]
+
+def test_prediction_actual_pairs_match_brute_force(tmp_path):
+    rng = np.random.default_rng(0)
+    store = get_prediction_store('TEST', str(tmp_path))
+    now = datetime(2026, 1, 5, 10, 0)
+    for _ in range(200):
+        now += timedelta(seconds=int(rng.integers(30, 600)))
+        price = float(rng.uniform(90, 110))
+        store.append(now, price, {interval: {'price': price + 1, 'change': 1.0} for interval in ('15', '30') if rng.random() < 0.8})
+    analytics = PredictionAnalytics(str(tmp_path))
+    predictions = store.load()
+    times = [datetime.fromisoformat(pred['timestamp']) for pred in predictions]
+    for interval in ('15', '30', '60'):
+        expected = []
+        for i, pred in enumerate(predictions):
+            target = times[i] + timedelta(minutes=int(interval))
+            later = [j for j in range(i + 1, len(times)) if abs(times[j] - target) <= timedelta(minutes=5)]
+            if interval in pred['predictions'] and later:
+                j = min(later, key=lambda j: abs(times[j] - target))
+                expected.append((pred['timestamp'], pred['predictions'][interval]['price'], predictions[j]['current_price']))
+        pairs = analytics.get_prediction_actual_pairs(analytics.load_prediction_tables('TEST'), interval)
+        assert [(pair['timestamp'], pair['predicted'], pair['actual']) for pair in pairs] == expected
+
+def brute_force_match(times, targets, first):
+    # Как прежний цикл: ближайшее время среди кандидатов, при равенстве - более раннее
+    matched = []
+    for target, start in zip(targets, first):
+        best, best_diff = -1, None
+        for j in range(start, len(times)):
+            diff = abs(times[j] - target)
+            if best_diff is None or diff < best_diff:
+                best, best_diff = j, diff
+        matched.append(best if best_diff is not None and best_diff <= MATCH_TOLERANCE else -1)
+    return matched
+
+def test_match_actuals_and_match_times_match_brute_force():
+    rng = np.random.default_rng(1)
+    minute = 60 * 1000000
+    # Шаг в целые минуты дает повторы времени и равные расстояния до соседей
+    times = np.cumsum(rng.integers(0, 8, 300)) * minute
+    for offset in (5 * minute, 15 * minute, 60 * minute):
+        expected = brute_force_match(times.tolist(), (times + offset).tolist(), range(1, len(times) + 1))
+        assert match_actuals(times, offset).tolist() == expected
+    targets = rng.integers(-10, times[-1] // minute + 10, 200) * minute
+    assert match_times(times, targets).tolist() == brute_force_match(times.tolist(), targets.tolist(), [0] * len(targets))